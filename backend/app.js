@@ -44,12 +44,48 @@ if (process.env.MQTT_USERNAME && process.env.MQTT_PASSWORD) {
   
   // Make MQTT client available to routes
   app.set('mqttClient', mqttClient);
+
+  // Latest position telemetry per sensor, served by GET /api/ptz/position/:sensor_id
+  const positionCache = new Map();
+  app.set('positionCache', positionCache);
+  
+  // Latest device status snapshots (retained on {sensor_id}/status), served by GET /api/ptz/status/:sensor_id
+  const statusCache = new Map();
+  app.set('statusCache', statusCache);
   
   // Subscribe to example topics when connected
- 
+  mqttClient.on('connect', () => {
+    subscribe(mqttClient, '+/telemetry');
+    subscribe(mqttClient, '+/status');
+  });
   
   // Handle incoming messages
   mqttClient.on('message', (topic, message) => {
+    // Telemetry arrives continuously while cameras move, keep it out of the logs
+    if (topic.endsWith('/telemetry')) {
+      try {
+        const telemetry = JSON.parse(message.toString());
+        const samples = telemetry.samples || [];
+        if (samples.length > 0) {
+          const [timestamp, pan, tilt, zoom] = samples[samples.length - 1];
+          positionCache.set(telemetry.sensor_id, { pan, tilt, zoom, timestamp });
+        }
+      } catch (error) {
+        console.error(`Invalid telemetry on ${topic}:`, error.message);
+      }
+      return;
+    }
+
+    if (topic.endsWith('/status')) {
+      try {
+        const status = JSON.parse(message.toString());
+        statusCache.set(status.sensor_id || topic.slice(0, -'/status'.length), status);
+      } catch (error) {
+        console.error(`Invalid status on ${topic}:`, error.message);
+      }
+      return;
+    }
+
     console.log(`[MQTT] Received on ${topic}: ${message.toString()}`);
     // Process messages based on topic
   });
@@ -3,7 +3,8 @@ const mqtt = require('mqtt');
 // Instead of enum, use object constants
 const MQTT_CONNECTION_TYPES = {
     CREDENTIALS: 'credentials',
-    CERTIFICATE: 'certificate'
+    CERTIFICATE: 'certificate',
+    PLAIN: 'plain' // No TLS, for a local broker (load testing, development)
 };
 
 const getOptions = () => {
@@ -31,6 +32,16 @@ const getOptions = () => {
                 connectTimeout: 5000,
                 reconnectPeriod: 1000,
             }
+        case MQTT_CONNECTION_TYPES.PLAIN:
+            return {
+                host: process.env.MQTT_HOST,
+                port: process.env.MQTT_PORT,
+                username: process.env.MQTT_USERNAME,
+                password: process.env.MQTT_PASSWORD,
+                clientId: process.env.CLIENT_ID,
+                connectTimeout: 5000,
+                reconnectPeriod: 1000,
+            }
         default:
             return {
                 host: process.env.MQTT_HOST,
@@ -51,7 +62,8 @@ const createMqttClient = () => {
     const options = getOptions();
 
     // Construct URL with protocol, host and port
-    const connectUrl = `mqtts://${options.host}:${options.port}`;
+    const protocol = process.env.MQTT_CONNECTION_TYPE === MQTT_CONNECTION_TYPES.PLAIN ? 'mqtt' : 'mqtts';
+    const connectUrl = `${protocol}://${options.host}:${options.port}`;
 
     // Create client with options
     const client = mqtt.connect(connectUrl, options);
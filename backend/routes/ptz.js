@@ -244,7 +244,7 @@ router.post("/go-to-preset", (req, res) => {
 });
 
 router.post("/start-patrol", (req, res) => {
-  const { presets, sensor_id } = req.body;
+  const { presets, sensor_id, dwell_time, use_camera_tour, optimize_route } = req.body;
 
   const mqttClient = req.app.get("mqttClient");
   if (!mqttClient) {
@@ -264,6 +264,9 @@ router.post("/start-patrol", (req, res) => {
       JSON.stringify({
         command: "start_patrol",
         presets: presets,
+        dwell_time: dwell_time,
+        use_camera_tour: use_camera_tour,
+        optimize_route: optimize_route,
       })
     );
   } catch (error) {
@@ -464,7 +467,7 @@ router.post("/stop-stream", (req, res) => {
 });
 
 router.post("/start-on-demand-stream", (req, res) => {
-  const { rtmp_url, video_file, sensor_id } = req.body;
+  const { rtmp_url, video_file, sensor_id, stream_id } = req.body;
 
   const mqttClient = req.app.get("mqttClient");
   if (!mqttClient) {
@@ -483,6 +486,7 @@ router.post("/start-on-demand-stream", (req, res) => {
         command: "start_on_demand_stream",
         rtmp_url: rtmp_url,
         video_file: video_file,
+        stream_id: stream_id,
       })
     );
   } catch (error) {
@@ -494,7 +498,7 @@ router.post("/start-on-demand-stream", (req, res) => {
 });
 
 router.post("/stop-on-demand-stream", (req, res) => {
-  const { sensor_id } = req.body;
+  const { sensor_id, stream_id } = req.body;
 
   const mqttClient = req.app.get("mqttClient");
   if (!mqttClient) {
@@ -511,6 +515,7 @@ router.post("/stop-on-demand-stream", (req, res) => {
       topic,
       JSON.stringify({
         command: "stop_on_demand_stream",
+        stream_id: stream_id,
       })
     );
   } catch (error) {
@@ -521,6 +526,203 @@ router.post("/stop-on-demand-stream", (req, res) => {
   res.json({ success: true });
 });
 
+// Bulk preset commands: one MQTT message, one aggregated reply on {sensor_id}/response
+const bulkPresetRoute = (command, field) => (req, res) => {
+  const { sensor_id } = req.body;
+  const items = req.body[field];
+
+  if (!sensor_id || !items || (Array.isArray(items) && items.length === 0)) {
+    return res.status(400).json({
+      error: "Missing required parameters",
+      received: { sensor_id, [field]: items },
+    });
+  }
+
+  const mqttClient = req.app.get("mqttClient");
+  if (!mqttClient) {
+    return res.status(500).json({ error: "MQTT client not configured" });
+  }
+  let topic = `${sensor_id}/control`;
+
+  const message = { command, [field]: items };
+  if (command === "rename_presets") {
+    message.sync_camera = Boolean(req.body.sync_camera);
+  }
+
+  try {
+    publish(mqttClient, topic, JSON.stringify(message));
+  } catch (error) {
+    console.error("Error publishing MQTT message:", error);
+    return res.status(500).json({ error: "Failed to publish MQTT message" });
+  }
+
+  res.json({ success: true, topic });
+};
+
+router.post("/create-presets", bulkPresetRoute("create_presets", "presets"));
+router.post("/delete-presets", bulkPresetRoute("delete_presets", "presets"));
+router.post("/rename-presets", bulkPresetRoute("rename_presets", "renames"));
+
+router.post("/move-absolute", (req, res) => {
+  const { pan, tilt, zoom, speed, sensor_id } = req.body;
+
+  if (!sensor_id || (pan === undefined && tilt === undefined && zoom === undefined)) {
+    return res.status(400).json({
+      error: "Missing required parameters",
+      received: { pan, tilt, zoom, sensor_id },
+    });
+  }
+
+  const mqttClient = req.app.get("mqttClient");
+  if (!mqttClient) {
+    return res.status(500).json({ error: "MQTT client not configured" });
+  }
+  let topic = `${sensor_id}/control`;
+
+  const message = {
+    command: "move_absolute",
+    pan: pan === undefined ? null : Number(pan),
+    tilt: tilt === undefined ? null : Number(tilt),
+    zoom: zoom === undefined ? null : Number(zoom),
+    speed: speed === undefined ? null : Number(speed),
+  };
+
+  try {
+    publish(mqttClient, topic, JSON.stringify(message));
+  } catch (error) {
+    console.error("Error publishing MQTT message:", error);
+    return res.status(500).json({ error: "Failed to publish MQTT message" });
+  }
+
+  res.json({ success: true, data: message });
+});
+
+router.post("/move-relative", (req, res) => {
+  const { pan, tilt, zoom, speed, sensor_id } = req.body;
+
+  if (!sensor_id || (pan === undefined && tilt === undefined && zoom === undefined)) {
+    return res.status(400).json({
+      error: "Missing required parameters",
+      received: { pan, tilt, zoom, sensor_id },
+    });
+  }
+
+  const mqttClient = req.app.get("mqttClient");
+  if (!mqttClient) {
+    return res.status(500).json({ error: "MQTT client not configured" });
+  }
+  let topic = `${sensor_id}/control`;
+
+  const message = {
+    command: "move_relative",
+    pan: pan === undefined ? null : Number(pan),
+    tilt: tilt === undefined ? null : Number(tilt),
+    zoom: zoom === undefined ? null : Number(zoom),
+    speed: speed === undefined ? null : Number(speed),
+  };
+
+  try {
+    publish(mqttClient, topic, JSON.stringify(message));
+  } catch (error) {
+    console.error("Error publishing MQTT message:", error);
+    return res.status(500).json({ error: "Failed to publish MQTT message" });
+  }
+
+  res.json({ success: true, data: message });
+});
+
+router.post("/get-position", (req, res) => {
+  const { sensor_id, refresh = false } = req.body;
+
+  const mqttClient = req.app.get("mqttClient");
+  if (!mqttClient) {
+    return res.status(500).json({ error: "MQTT client not configured" });
+  }
+  let topic = `${sensor_id}/control`;
+
+  try {
+    publish(
+      mqttClient,
+      topic,
+      JSON.stringify({
+        command: "get_position",
+        refresh: Boolean(refresh),
+      })
+    );
+  } catch (error) {
+    console.error("Error publishing MQTT message:", error);
+    return res.status(500).json({ error: "Failed to publish MQTT message" });
+  }
+
+  res.json({ success: true, topic });
+});
+
+// Ask the device for its command rate-limit counters (answered on {sensor_id}/response)
+router.post("/command-metrics", (req, res) => {
+  const { sensor_id } = req.body;
+
+  const mqttClient = req.app.get("mqttClient");
+  if (!mqttClient) {
+    return res.status(500).json({ error: "MQTT client not configured" });
+  }
+  let topic = `${sensor_id}/control`;
+
+  try {
+    publish(mqttClient, topic, JSON.stringify({ command: "get_command_metrics" }));
+  } catch (error) {
+    console.error("Error publishing MQTT message:", error);
+    return res.status(500).json({ error: "Failed to publish MQTT message" });
+  }
+
+  res.json({ success: true, topic });
+});
+
+// Profile the device for `duration` seconds or the next `commands` commands (report on {sensor_id}/response)
+router.post("/profile", (req, res) => {
+  const { sensor_id, mode, duration, commands, top, action } = req.body;
+
+  const mqttClient = req.app.get("mqttClient");
+  if (!mqttClient) {
+    return res.status(500).json({ error: "MQTT client not configured" });
+  }
+  let topic = `${sensor_id}/control`;
+
+  const message = { command: "profile", mode, duration, commands, top, action };
+
+  try {
+    publish(mqttClient, topic, JSON.stringify(message));
+  } catch (error) {
+    console.error("Error publishing MQTT message:", error);
+    return res.status(500).json({ error: "Failed to publish MQTT message" });
+  }
+
+  res.json({ success: true, topic });
+});
+
+// Latest position reported by the device's telemetry stream
+router.get("/position/:sensor_id", (req, res) => {
+  const positionCache = req.app.get("positionCache");
+  const position = positionCache ? positionCache.get(req.params.sensor_id) : undefined;
+
+  if (!position) {
+    return res.status(404).json({ error: "No position telemetry received for this sensor" });
+  }
+
+  res.json({ success: true, sensor_id: req.params.sensor_id, position });
+});
+
+// Latest retained status snapshot published by the device on {sensor_id}/status
+router.get("/status/:sensor_id", (req, res) => {
+  const statusCache = req.app.get("statusCache");
+  const status = statusCache ? statusCache.get(req.params.sensor_id) : undefined;
+
+  if (!status) {
+    return res.status(404).json({ error: "No status received for this sensor" });
+  }
+
+  res.json({ success: true, sensor_id: req.params.sensor_id, status });
+});
+
 // Get MQTT connection status
 router.get("/status", (req, res) => {
   const mqttClient = req.app.get("mqttClient");
@@ -0,0 +1,127 @@
+"""Micro-benchmark: per-message command dispatch, old inline lambda table vs CommandRegistry.
+
+The old on_message built a dict of ~25 lambdas for every message (and called stop_patrol() while
+doing it); the registry is built once and only validates the payload and binds arguments.
+Handlers are no-ops here, so the numbers are pure dispatch overhead:
+
+    python command_dispatch_benchmark.py --iterations 20000
+"""
+import argparse
+import importlib.util
+import json
+import os
+import time
+
+SUBSCRIBER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "subscriber-raspi5.py")
+
+SAMPLE_MESSAGES = [
+    {"command": "move", "pan": 0.5, "tilt": -0.2, "zoom": 0, "velocity": 0.8},
+    {"command": "stop_ptz"},
+    {"command": "go-to-preset", "preset_name": "gate"},
+    {"command": "get_position", "refresh": False},
+    {"command": "move_relative", "pan": 0.1, "tilt": None, "zoom": None, "speed": 0.5},
+]
+
+
+def load_subscriber():
+    spec = importlib.util.spec_from_file_location("subscriber_raspi5", SUBSCRIBER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class NoOpTarget:
+    """Stands in for MQTTSubscriber: every handler method exists and does nothing."""
+
+    def __init__(self, specs):
+        for method, _ in specs.values():
+            setattr(self, method, self._noop)
+        self.command_scheduler = self
+        self.commands = self
+
+    def _noop(self, *args, **kwargs):
+        return None
+
+    def snapshot(self):
+        return {}
+
+    def publish_response(self, payload):
+        return None
+
+    def update_model(self, *args):
+        return None
+
+
+def legacy_dispatch(self, payload):
+    """The table on_message rebuilt per message before the registry (same entries, same side effect)."""
+    command = payload.get("command")
+    command_methods = {
+        "move": lambda: self.move_camera(payload.get("pan", 0), payload.get("tilt", 0), payload.get("zoom", 0), payload.get("velocity", 0.5)),
+        "stop_ptz": lambda: self.stop_camera(),
+        "test": lambda: self.testing_function(),
+        "create_preset": lambda: self.create_preset(payload.get("preset_name")),
+        "go-to-preset": lambda: self.move_to_preset(payload.get("preset_name")),
+        "start_patrol": lambda: self.start_patrol(payload.get("presets", []), payload.get("dwell_time"), payload.get("use_camera_tour", True), payload.get("optimize_route", False)),
+        "stop_patrol": self.stop_patrol(),
+        "set_fpsbr": lambda: self.set_fpsbr(payload.get("fps", None), payload.get("width", None), payload.get("height", None), payload.get("BitrateLimit", None)),
+        "set_time": lambda: self.set_time(payload.get("timezone", "UTC"), payload.get("ntp_server", "pool.ntp.org")),
+        "update_configuration": lambda: self.update_local_config(payload.get("sensor_id")),
+        "refresh_ptz_capabilities": lambda: self.refresh_ptz_capabilities(),
+        "move_absolute": lambda: self.move_absolute(payload.get("pan"), payload.get("tilt"), payload.get("zoom"), payload.get("speed")),
+        "move_relative": lambda: self.move_relative(payload.get("pan"), payload.get("tilt"), payload.get("zoom"), payload.get("speed")),
+        "get_position": lambda: self.report_position(payload.get("refresh", False)),
+        "get_status": lambda: self.publish_response({"type": "status", **self.snapshot()}),
+        "get_command_metrics": lambda: self.publish_response({"type": "command_metrics", **self.command_scheduler.snapshot()}),
+        "profile": lambda: self.start_profiling(payload),
+        "create_presets": lambda: self.create_presets(payload.get("presets", [])),
+        "delete_presets": lambda: self.delete_presets(payload.get("presets", [])),
+        "rename_presets": lambda: self.rename_presets(payload.get("renames", []), payload.get("sync_camera", False)),
+        "start_stream": lambda: self.start_streaming(payload.get("rtmp_url"), payload.get("stream_timer"), payload.get("streaming_fps")),
+        "stop_stream": self.stop_streaming,
+        "start_on_demand_stream": lambda: self.start_on_demand_stream(payload.get("rtmp_url"), payload.get("video_file")),
+        "stop_on_demand_stream": self.stop_on_demand_stream,
+    }
+    handler = command_methods.get(command)
+    if handler:
+        handler()
+
+
+def time_per_call(function, payloads, iterations):
+    """Mean microseconds per dispatched message."""
+    started = time.perf_counter()
+    for index in range(iterations):
+        function(payloads[index % len(payloads)])
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare per-message command dispatch overhead")
+    parser.add_argument("--iterations", type=int, default=20000, help="Messages dispatched per variant")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    subscriber = load_subscriber()
+    target = NoOpTarget(subscriber.COMMAND_SPECS)
+    registry = subscriber.CommandRegistry(target)
+
+    def registry_dispatch(payload):
+        handler = registry.prepare(payload.get("command"), payload)
+        if handler:
+            handler()
+
+    payloads = [json.loads(json.dumps(message)) for message in SAMPLE_MESSAGES]
+    for function in (legacy_dispatch.__get__(target), registry_dispatch):
+        time_per_call(function, payloads, min(args.iterations, 1000))
+
+    legacy = time_per_call(legacy_dispatch.__get__(target), payloads, args.iterations)
+    registry_us = time_per_call(registry_dispatch, payloads, args.iterations)
+    print(f"{'dispatch':<26}{'us/message':>12}")
+    print(f"{'inline lambda table':<26}{legacy:>12.2f}")
+    print(f"{'CommandRegistry':<26}{registry_us:>12.2f}   (validation + timing hooks included)")
+    print(f"speedup: {legacy / registry_us:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
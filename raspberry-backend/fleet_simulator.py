@@ -0,0 +1,794 @@
+"""In-process fleet simulator: hundreds of virtual camera subscribers against a local MQTT broker.
+
+Each virtual device is a real MQTTSubscriber (same command handling code as subscriber-raspi5.py)
+backed by a simulated ONVIF PTZ camera with SOAP latency and motion timing. All MQTT sockets are
+serviced by one network thread and commands run on a shared worker pool, so 500 devices do not
+need 500 processes.
+
+Example:
+    python fleet_simulator.py --devices 500 --rate 1000 --duration 60 --host 127.0.0.1 --port 1883
+"""
+import argparse
+import contextlib
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import selectors
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+SUBSCRIBER_PATH = os.path.join(current_dir, "subscriber-raspi5.py")
+
+# Relative weights of the commands the driver sends (roughly what operators do with a joystick)
+DEFAULT_COMMAND_MIX = {
+    "move": 40,
+    "stop_ptz": 30,
+    "go-to-preset": 15,
+    "move_absolute": 10,
+    "get_position": 5,
+}
+
+SIMULATED_PRESETS = ("gate", "yard", "dock", "road")
+
+
+def load_subscriber_module():
+    """Import subscriber-raspi5.py (not importable by name because of the dash)."""
+    spec = importlib.util.spec_from_file_location("subscriber", SUBSCRIBER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ---------------------------------------------------
+# 🎥 Simulated ONVIF Camera
+# ---------------------------------------------------
+
+def _field(request, name):
+    """Read a request field from either a dict or a zeep-style object."""
+    if isinstance(request, dict):
+        return request.get(name)
+    return getattr(request, name, None)
+
+
+def _range(low, high):
+    return SimpleNamespace(Min=low, Max=high)
+
+
+class SimulatedPTZ:
+    """PTZ service with per-call SOAP latency and axes that take time to move."""
+
+    LIMITS = {"pan": (-1.0, 1.0), "tilt": (-1.0, 1.0), "zoom": (0.0, 1.0)}
+
+    def __init__(self, speeds, latency, jitter):
+        self._lock = Lock()  # cheap firmwares handle one SOAP request at a time
+        self.speeds = speeds
+        self.latency = latency
+        self.jitter = jitter
+        self.position = {"pan": 0.0, "tilt": 0.0, "zoom": 0.0}
+        self.velocity = None
+        self.target = None
+        self.updated_at = time.monotonic()
+        self.presets = {}
+        self._tokens = itertools.count(1)
+        self.calls = 0
+
+    def _soap(self):
+        self.calls += 1
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def _advance(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        for axis, (low, high) in self.LIMITS.items():
+            if self.velocity:
+                value = self.position[axis] + self.velocity[axis] * self.speeds[axis] * elapsed
+            elif self.target:
+                step = self.speeds[axis] * elapsed
+                delta = self.target[axis] - self.position[axis]
+                value = self.position[axis] + max(-step, min(delta, step))
+            else:
+                continue
+            self.position[axis] = max(low, min(value, high))
+        if self.target and all(abs(self.target[axis] - self.position[axis]) < 1e-6 for axis in self.LIMITS):
+            self.target = None
+
+    def _moving(self):
+        return bool(self.target) or bool(self.velocity and any(self.velocity.values()))
+
+    def _go_to(self, pan=None, tilt=None, zoom=None):
+        self._advance()
+        self.velocity = None
+        target = dict(self.position)
+        for axis, value in (("pan", pan), ("tilt", tilt), ("zoom", zoom)):
+            if value is not None:
+                low, high = self.LIMITS[axis]
+                target[axis] = max(low, min(float(value), high))
+        self.target = target
+
+    def create_type(self, name):
+        return SimpleNamespace()
+
+    def ContinuousMove(self, request):
+        with self._lock:
+            self._soap()
+            self._advance()
+            velocity = _field(request, "Velocity") or {}
+            pan_tilt = velocity.get("PanTilt") or {}
+            zoom = velocity.get("Zoom") or {}
+            self.target = None
+            self.velocity = {"pan": pan_tilt.get("x", 0.0), "tilt": pan_tilt.get("y", 0.0), "zoom": zoom.get("x", 0.0)}
+
+    def Stop(self, request):
+        with self._lock:
+            self._soap()
+            self._advance()
+            self.velocity = None
+            self.target = None
+
+    def AbsoluteMove(self, request):
+        with self._lock:
+            self._soap()
+            position = _field(request, "Position") or {}
+            pan_tilt = position.get("PanTilt") or {}
+            self._go_to(pan_tilt.get("x"), pan_tilt.get("y"), (position.get("Zoom") or {}).get("x"))
+
+    def RelativeMove(self, request):
+        with self._lock:
+            self._soap()
+            self._advance()
+            translation = _field(request, "Translation") or {}
+            pan_tilt = translation.get("PanTilt") or {}
+            zoom = translation.get("Zoom") or {}
+            self._go_to(self.position["pan"] + pan_tilt.get("x", 0.0),
+                        self.position["tilt"] + pan_tilt.get("y", 0.0),
+                        self.position["zoom"] + zoom.get("x", 0.0))
+
+    def GotoPreset(self, request):
+        with self._lock:
+            self._soap()
+            preset = self.presets.get(str(_field(request, "PresetToken")))
+            if preset is None:
+                raise ValueError("No such preset")
+            self._go_to(**preset["position"])
+
+    def GetStatus(self, request):
+        with self._lock:
+            self._soap()
+            self._advance()
+            state = "MOVING" if self._moving() else "IDLE"
+            return SimpleNamespace(
+                Position=SimpleNamespace(
+                    PanTilt=SimpleNamespace(x=self.position["pan"], y=self.position["tilt"]),
+                    Zoom=SimpleNamespace(x=self.position["zoom"]),
+                ),
+                MoveStatus=SimpleNamespace(PanTilt=state, Zoom=state),
+            )
+
+    def GetPresets(self, request):
+        with self._lock:
+            self._soap()
+            return [
+                SimpleNamespace(
+                    Name=preset["name"], token=token,
+                    PTZPosition=SimpleNamespace(
+                        PanTilt=SimpleNamespace(x=preset["position"]["pan"], y=preset["position"]["tilt"]),
+                        Zoom=SimpleNamespace(x=preset["position"]["zoom"]),
+                    ),
+                )
+                for token, preset in self.presets.items()
+            ]
+
+    def SetPreset(self, request):
+        with self._lock:
+            self._soap()
+            self._advance()
+            token = str(_field(request, "PresetToken") or next(self._tokens))
+            self.presets[token] = {"name": _field(request, "PresetName"), "position": dict(self.position)}
+            return token
+
+    def RemovePreset(self, request):
+        with self._lock:
+            self._soap()
+            self.presets.pop(str(_field(request, "PresetToken")), None)
+
+    def GetNodes(self):
+        with self._lock:
+            self._soap()
+            return [SimpleNamespace(
+                token="node0",
+                SupportedPTZSpaces=self._spaces(),
+                MaximumNumberOfPresets=255,
+                HomeSupported=True,
+                Extension=None,
+            )]
+
+    def GetConfigurationOptions(self, request):
+        with self._lock:
+            self._soap()
+            return SimpleNamespace(Spaces=self._spaces(), PTZTimeout=_range(1, 60))
+
+    def GetServiceCapabilities(self):
+        with self._lock:
+            self._soap()
+            return SimpleNamespace(EFlip=False, Reverse=False, MoveStatus=True, StatusPosition=True)
+
+    def _spaces(self):
+        def space(uri, *ranges):
+            return [SimpleNamespace(URI=uri, XRange=ranges[0], YRange=ranges[1] if len(ranges) > 1 else None)]
+        return SimpleNamespace(
+            AbsolutePanTiltPositionSpace=space("abs-pt", _range(-1, 1), _range(-1, 1)),
+            AbsoluteZoomPositionSpace=space("abs-z", _range(0, 1)),
+            RelativePanTiltTranslationSpace=space("rel-pt", _range(-1, 1), _range(-1, 1)),
+            RelativeZoomTranslationSpace=space("rel-z", _range(-1, 1)),
+            ContinuousPanTiltVelocitySpace=space("vel-pt", _range(-1, 1), _range(-1, 1)),
+            ContinuousZoomVelocitySpace=space("vel-z", _range(-1, 1)),
+            PanTiltSpeedSpace=space("spd-pt", _range(0, 1)),
+            ZoomSpeedSpace=space("spd-z", _range(0, 1)),
+        )
+
+
+class SimulatedMedia:
+    """Just enough of the media service for the PTZ commands (one profile)."""
+
+    def __init__(self):
+        self.profile = SimpleNamespace(
+            token="profile0",
+            PTZConfiguration=SimpleNamespace(token="ptz0", NodeToken="node0"),
+            VideoEncoderConfiguration=None,
+        )
+
+    def GetProfiles(self):
+        return [self.profile]
+
+
+class SimulatedCamera:
+    def __init__(self, speeds, latency, jitter):
+        self.ptz = SimulatedPTZ(speeds, latency, jitter)
+        self.media = SimulatedMedia()
+        for index, name in enumerate(SIMULATED_PRESETS):
+            self.ptz.presets[str(index + 1)] = {
+                "name": name,
+                "position": {"pan": random.uniform(-1, 1), "tilt": random.uniform(-1, 1), "zoom": random.uniform(0, 1)},
+            }
+
+    def create_ptz_service(self):
+        return self.ptz
+
+    def create_media_service(self):
+        return self.media
+
+
+# ---------------------------------------------------
+# 📡 Shared MQTT Network Loop
+# ---------------------------------------------------
+
+class SharedMQTTLoop:
+    """Services many paho clients from one thread (paho's external-loop API) instead of one thread each."""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._clients = {}
+        self._lock = Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add(self, client):
+        with self._lock:
+            self._clients[id(client)] = client
+            self._selector.register(client.socket(), selectors.EVENT_READ, client)
+
+    def remove(self, client):
+        with self._lock:
+            if self._clients.pop(id(client), None) is None:
+                return
+            with contextlib.suppress(Exception):
+                self._selector.unregister(client.socket())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fleet-mqtt-loop", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        last_misc = time.monotonic()
+        while not self._stop_event.is_set():
+            with self._lock:
+                clients = list(self._clients.values())
+            if not clients:
+                time.sleep(0.05)
+                continue
+
+            for key, _ in self._selector.select(timeout=0.05):
+                if key.data.loop_read() != mqtt.MQTT_ERR_SUCCESS:
+                    self.remove(key.data)
+            for client in clients:
+                if client.want_write():
+                    client.loop_write()
+
+            if time.monotonic() - last_misc >= 1.0:
+                last_misc = time.monotonic()
+                for client in clients:
+                    client.loop_misc()
+
+
+# ---------------------------------------------------
+# ⏲️ Shared Housekeeping
+# ---------------------------------------------------
+
+class FleetHousekeeping:
+    """Periodic per-device work (preset reconciliation, telemetry sampling) driven from one thread.
+
+    A real subscriber runs a reconciler thread (and a telemetry thread when enabled) of its own; with
+    hundreds of virtual devices that is hundreds of mostly sleeping threads. Here one thread tracks
+    when each job is due and runs it on the fleet's shared worker pool.
+    """
+
+    def __init__(self, executor, tick=0.05):
+        self.executor = executor
+        self.tick = tick
+        self._lock = Lock()
+        self._jobs = {}         # (kind, sensor_id) -> {"run": callable returning the next interval, "due", "wake"}
+        self._running = set()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add(self, kind, sensor_id, run, first_delay, wake=None):
+        """Schedule run() first_delay seconds from now; it returns the seconds until its next run."""
+        with self._lock:
+            self._jobs[(kind, sensor_id)] = {"run": run, "due": time.monotonic() + first_delay, "wake": wake}
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="fleet-housekeeping", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop_event.wait(self.tick):
+            now = time.monotonic()
+            with self._lock:
+                due = []
+                for key, job in self._jobs.items():
+                    woken = job["wake"] is not None and job["wake"].is_set()
+                    if key not in self._running and (woken or job["due"] <= now):
+                        if woken:
+                            job["wake"].clear()
+                        self._running.add(key)
+                        due.append(key)
+            for key in due:
+                self.executor.submit(self._execute, key)
+
+    def _execute(self, key):
+        job = self._jobs[key]
+        try:
+            interval = job["run"]()
+        except Exception as e:
+            logging.error(f"Housekeeping {key[0]} for {key[1]} failed: {e}")
+            interval = None
+        with self._lock:
+            job["due"] = time.monotonic() + (interval or 1.0)
+            self._running.discard(key)
+
+
+# ---------------------------------------------------
+# 📊 Statistics
+# ---------------------------------------------------
+
+def percentiles(values, points=(50, 90, 99)):
+    """Nearest-rank percentiles in milliseconds, plus max."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {f"p{p}": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 2) for p in points}
+    result["max"] = round(ordered[-1] * 1000, 2)
+    return result
+
+
+def process_rss_kb():
+    """Current resident set size of this process in KiB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class FleetStats:
+    def __init__(self):
+        self._lock = Lock()
+        self.sent = 0
+        self.received = 0
+        self.completed = 0
+        self.failed = 0
+        self.published = 0
+        self.disconnects = 0
+        self.delivery = []      # driver publish -> device on_message
+        self.queueing = []      # on_message -> worker picks it up
+        self.service = []       # command handler wall time
+        self.end_to_end = []    # driver publish -> handler done
+        self.per_command = {}
+        self.device_cpu = {}    # sensor_id -> handler CPU seconds
+        self.device_commands = {}
+
+    def record_sent(self):
+        with self._lock:
+            self.sent += 1
+
+    def record_received(self):
+        with self._lock:
+            self.received += 1
+
+    def record_published(self):
+        with self._lock:
+            self.published += 1
+
+    def record_disconnect(self):
+        with self._lock:
+            self.disconnects += 1
+
+    def record_command(self, sensor_id, command, sent_at, received_at, started_at, finished_at, cpu, ok):
+        with self._lock:
+            self.completed += 1
+            self.failed += 0 if ok else 1
+            if sent_at:
+                self.delivery.append(received_at - sent_at)
+                self.end_to_end.append(finished_at - sent_at)
+            self.queueing.append(started_at - received_at)
+            self.service.append(finished_at - started_at)
+            self.per_command.setdefault(command, []).append(finished_at - started_at)
+            self.device_cpu[sensor_id] = self.device_cpu.get(sensor_id, 0.0) + cpu
+            self.device_commands[sensor_id] = self.device_commands.get(sensor_id, 0) + 1
+
+
+# ---------------------------------------------------
+# 🤖 Virtual Devices
+# ---------------------------------------------------
+
+def make_virtual_subscriber_class(subscriber_module):
+    """Subclass MQTTSubscriber so network I/O and command execution go through the shared fleet runtime."""
+
+    class VirtualSubscriber(subscriber_module.MQTTSubscriber):
+        def __init__(self, sensor_id, camera, fleet, **kwargs):
+            super().__init__(sensor_id, **kwargs)
+            self.simulated_camera = camera
+            self.fleet = fleet
+            # One command at a time per device, like the real subscriber's single network thread
+            self._command_lock = Lock()
+            self._command_failed = threading.local()
+            self.commands.prepare = self._tracked_prepare(self.commands.prepare)
+            if self.telemetry:
+                # Sampled by the fleet's housekeeping thread instead of a thread per device
+                self.telemetry.start = self._start_shared_telemetry
+
+        def _mark_failed(self):
+            if getattr(self._command_failed, "value", None) is False:
+                self._command_failed.value = True
+
+        def _tracked_prepare(self, prepare):
+            """Count unknown commands and handler exceptions, which on_message only logs, as failures."""
+            def tracked_prepare(command, payload):
+                handler = prepare(command, payload)
+                if handler is None:
+                    self._mark_failed()
+                    return None
+
+                def tracked():
+                    try:
+                        handler()
+                    except Exception:
+                        self._mark_failed()
+                        raise
+                return tracked
+            return tracked_prepare
+
+        def start_preset_reconciler(self):
+            def reconcile():
+                if not self._preset_reconciler_stop.is_set():
+                    self.reconcile_presets()
+                return self.preset_reconcile_interval
+            self.fleet.housekeeping.add("reconcile", self.sensor_id, reconcile, self.preset_reconcile_interval)
+
+        def _start_shared_telemetry(self):
+            telemetry = self.telemetry
+            self.fleet.housekeeping.add("telemetry", self.sensor_id, telemetry.step, 0, wake=telemetry._wake_event)
+
+        def init_camera(self):
+            if self.camera is None:
+                self.camera = self.simulated_camera
+                self.ptz_service = self.camera.create_ptz_service()
+                self.media_service = self.camera.create_media_service()
+                self.media_profile = self.media_service.GetProfiles()[0]
+                self.profile_token = self.media_profile.token
+            return self.camera, self.ptz_service, self.profile_token
+
+        def persist_presets(self):
+            # Virtual devices have no configuration.json of their own
+            self.camera_details["presets"] = self.presets.as_list()
+
+        def on_message(self, client, userdata, msg):
+            received_at = time.time()
+            if not msg.topic.endswith("/control"):
+                # Our own replies echoed back on the response topic
+                return super().on_message(client, userdata, msg)
+            self.fleet.stats.record_received()
+            self.fleet.executor.submit(self._run_command, client, userdata, msg, received_at)
+
+        def _run_command(self, client, userdata, msg, received_at):
+            with self._command_lock:
+                started_at = time.time()
+                cpu_started = time.thread_time()
+                # on_message reports handler failures as replies rather than exceptions
+                self._command_failed.value = False
+                try:
+                    payload = json.loads(msg.payload)
+                    super().on_message(client, userdata, msg)
+                    ok = not self._command_failed.value
+                except Exception:
+                    payload, ok = {}, False
+                finally:
+                    self._command_failed.value = None
+                self.fleet.stats.record_command(
+                    self.sensor_id, payload.get("command"), payload.get("sim_sent_at"), received_at,
+                    started_at, time.time(), time.thread_time() - cpu_started, ok,
+                )
+
+        def on_disconnect(self, client, userdata, rc):
+            self._connected_event.clear()
+            self.fleet.stats.record_disconnect()
+            self.fleet.loop.remove(client)
+
+        def publish_response(self, payload):
+            self.fleet.stats.record_published()
+            # command_error, rejected command_ack, or a handler's own {"error": ...} reply
+            if payload.get("error") or payload.get("status") == "rejected":
+                self._mark_failed()
+            super().publish_response(payload)
+
+        def publish_telemetry(self, payload):
+            self.fleet.stats.record_published()
+            super().publish_telemetry(payload)
+
+    return VirtualSubscriber
+
+
+class Fleet:
+    def __init__(self, args):
+        self.args = args
+        self.stats = FleetStats()
+        self.loop = SharedMQTTLoop()
+        self.executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="fleet-worker")
+        self.housekeeping = FleetHousekeeping(self.executor)
+        self.devices = []
+        self.module = self._prepare_module()
+
+    def _prepare_module(self):
+        module = load_subscriber_module()
+        module.ROOT_DIR = tempfile.mkdtemp(prefix="fleet-sim-")
+        module.MQTT_HOST = self.args.host
+        module.MQTT_PORT = self.args.port
+        module.MQTT_USERNAME = self.args.username
+        module.MQTT_PASSWORD = self.args.password
+        module.MQTT_CONNECTION_TYPE = module.MQTT_CONNECTION_TYPES["PLAIN"]
+        module.mqtt_topics = {
+            "control": "{sensor_id}/control",
+            "response": "{sensor_id}/response",
+            "telemetry": "{sensor_id}/telemetry",
+        }
+        module.config = {"service_settings": {"mqtt_topics": module.mqtt_topics}}
+        if self.args.telemetry:
+            module.config["service_settings"]["telemetry"] = {"enabled": True}
+        return module
+
+    def create_devices(self):
+        VirtualSubscriber = make_virtual_subscriber_class(self.module)
+        speeds = {"pan": self.args.pan_speed, "tilt": self.args.tilt_speed, "zoom": self.args.zoom_speed}
+        for index in range(self.args.devices):
+            sensor_id = f"{self.args.prefix}{index:04d}"
+            camera = SimulatedCamera(speeds, self.args.soap_latency / 1000, self.args.soap_jitter / 1000)
+            camera_config = {
+                "host": f"sim-{index}",
+                "http_port": 80,
+                "ptz_speed": speeds,
+                "preset_reconcile_interval": 3600,
+                "presets": [{"name": p["name"], "token": t} for t, p in camera.ptz.presets.items()],
+            }
+            self.devices.append(VirtualSubscriber(sensor_id, camera, self, camera_config=camera_config,
+                                                  client_id=f"fleet-sim-{sensor_id}"))
+
+    def connect(self):
+        self.loop.start()
+        for device in self.devices:
+            device.client.connect(self.args.host, self.args.port, keepalive=60)
+            self.loop.add(device.client)
+
+        deadline = time.monotonic() + self.args.connect_timeout
+        for device in self.devices:
+            device._connected_event.wait(timeout=max(0.0, deadline - time.monotonic()))
+        return sum(device._connected_event.is_set() for device in self.devices)
+
+    def shutdown(self):
+        self.housekeeping.stop()
+        for device in self.devices:
+            device._preset_reconciler_stop.set()
+            with contextlib.suppress(Exception):
+                device.client.disconnect()
+        self.loop.stop()
+        self.executor.shutdown(wait=False)
+
+
+# ---------------------------------------------------
+# 🚦 Load Driver
+# ---------------------------------------------------
+
+def build_command(command, rng):
+    """Random payload for one of the simulated operator commands."""
+    if command == "move":
+        return {"command": "move", "pan": rng.choice((-1, 0, 1)), "tilt": rng.choice((-1, 0, 1)),
+                "zoom": 0, "velocity": round(rng.uniform(0.2, 1.0), 2)}
+    if command == "go-to-preset":
+        return {"command": "go-to-preset", "preset_name": rng.choice(SIMULATED_PRESETS)}
+    if command == "move_absolute":
+        return {"command": "move_absolute", "pan": round(rng.uniform(-1, 1), 3),
+                "tilt": round(rng.uniform(-1, 1), 3), "zoom": round(rng.uniform(0, 1), 3)}
+    if command == "get_position":
+        return {"command": "get_position", "refresh": rng.random() < 0.5}
+    return {"command": command}
+
+
+def drive_load(fleet, args):
+    """Publish commands to random devices at a fixed total rate for the configured duration."""
+    if args.rate <= 0:
+        # Devices only: commands come from elsewhere (e.g. ptz_load_generator.py through the backend)
+        time.sleep(args.duration)
+        return args.duration
+
+    driver = mqtt.Client(client_id=f"fleet-sim-driver-{os.getpid()}")
+    if args.username:
+        driver.username_pw_set(args.username, args.password)
+    driver.connect(args.host, args.port, keepalive=60)
+    driver.loop_start()
+
+    rng = random.Random(args.seed)
+    commands, weights = zip(*DEFAULT_COMMAND_MIX.items())
+    sensor_ids = [device.sensor_id for device in fleet.devices]
+    interval = 1.0 / args.rate
+    started = time.monotonic()
+    next_send = started
+    while time.monotonic() - started < args.duration:
+        payload = build_command(rng.choices(commands, weights)[0], rng)
+        payload["sim_sent_at"] = time.time()
+        driver.publish(f"{rng.choice(sensor_ids)}/control", json.dumps(payload))
+        fleet.stats.record_sent()
+        next_send += interval
+        delay = next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = time.monotonic() - started
+
+    driver.loop_stop()
+    driver.disconnect()
+    return elapsed
+
+
+def build_report(fleet, elapsed, rss_before, rss_after_setup, cpu_before):
+    stats = fleet.stats
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    device_count = max(1, len(fleet.devices))
+    cpu_per_device = sorted(stats.device_cpu.values())
+    return {
+        "devices": len(fleet.devices),
+        "duration_s": round(elapsed, 2),
+        "throughput": {
+            "commands_sent_per_s": round(stats.sent / elapsed, 1),
+            "commands_delivered_per_s": round(stats.received / elapsed, 1),
+            "commands_completed_per_s": round(stats.completed / elapsed, 1),
+            "device_publishes_per_s": round(stats.published / elapsed, 1),
+        },
+        "counts": {
+            "sent": stats.sent, "delivered": stats.received, "completed": stats.completed,
+            "failed": stats.failed, "lost": max(0, stats.sent - stats.received) if stats.sent else 0, "disconnects": stats.disconnects,
+        },
+        "latency_ms": {
+            "broker_delivery": percentiles(stats.delivery),
+            "worker_queueing": percentiles(stats.queueing),
+            "command_service": percentiles(stats.service),
+            "end_to_end": percentiles(stats.end_to_end),
+        },
+        "command_service_ms": {command: percentiles(values) for command, values in sorted(stats.per_command.items())},
+        "resources": {
+            "rss_kb_per_device": round((rss_after_setup - rss_before) / device_count, 1),
+            "rss_kb_total": process_rss_kb(),
+            "process_cpu_s": round(usage.ru_utime + usage.ru_stime - cpu_before, 2),
+            "handler_cpu_ms_per_device_mean": round(sum(cpu_per_device) / device_count * 1000, 2),
+            "handler_cpu_ms_per_device_max": round(cpu_per_device[-1] * 1000, 2) if cpu_per_device else 0,
+            "threads": threading.active_count(),
+            "simulated_soap_calls": sum(device.simulated_camera.ptz.calls for device in fleet.devices),
+        },
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of camera subscribers against a local MQTT broker")
+    parser.add_argument("--devices", type=int, default=100, help="Number of virtual devices")
+    parser.add_argument("--rate", type=float, default=200, help="Total commands per second sent to the fleet (0: just run the devices)")
+    parser.add_argument("--duration", type=float, default=30, help="Load duration in seconds")
+    parser.add_argument("--host", default="127.0.0.1", help="MQTT broker host (plain TCP)")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument("--username", default="", help="MQTT username (optional)")
+    parser.add_argument("--password", default="", help="MQTT password (optional)")
+    parser.add_argument("--workers", type=int, default=64, help="Shared command worker threads")
+    parser.add_argument("--prefix", default="sim-cam-", help="Sensor ID prefix for virtual devices")
+    parser.add_argument("--soap-latency", type=float, default=40, help="Mean simulated SOAP round trip (ms)")
+    parser.add_argument("--soap-jitter", type=float, default=15, help="Std deviation of SOAP round trip (ms)")
+    parser.add_argument("--pan-speed", type=float, default=0.5, help="Pan speed (normalized units/s)")
+    parser.add_argument("--tilt-speed", type=float, default=0.5, help="Tilt speed (normalized units/s)")
+    parser.add_argument("--zoom-speed", type=float, default=0.5, help="Zoom speed (normalized units/s)")
+    parser.add_argument("--telemetry", action="store_true", help="Enable position telemetry on every device")
+    parser.add_argument("--connect-timeout", type=float, default=60, help="Seconds to wait for all devices to connect")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the command stream")
+    parser.add_argument("--report", help="Also write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show subscriber output (very noisy with many devices)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+
+    rss_before = process_rss_kb()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_before = usage.ru_utime + usage.ru_stime
+
+    fleet = Fleet(args)
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    try:
+        with quiet:
+            fleet.create_devices()
+            rss_after_setup = process_rss_kb()
+            connected = fleet.connect()
+        print(f"✅ {connected}/{len(fleet.devices)} virtual devices connected to {args.host}:{args.port}")
+
+        if args.rate > 0:
+            print(f"🚦 Sending {args.rate:g} commands/s for {args.duration:g}s...")
+        else:
+            print(f"⏳ Running devices for {args.duration:g}s...")
+        with quiet:
+            elapsed = drive_load(fleet, args)
+            # Let in-flight commands finish before reporting
+            drain_deadline = time.monotonic() + 10
+            while fleet.stats.completed < fleet.stats.received and time.monotonic() < drain_deadline:
+                time.sleep(0.1)
+
+        report = build_report(fleet, elapsed, rss_before, rss_after_setup, cpu_before)
+        print(json.dumps(report, indent=4))
+        if args.report:
+            with open(args.report, "w") as file:
+                json.dump(report, file, indent=4)
+    finally:
+        fleet.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""HTTP load generator for the backend PTZ routes (backend/routes/ptz.js).
+
+Simulated operators replay joystick bursts, preset jumps and patrol toggles against
+/api/ptz/*. An observer subscribed to {sensor_id}/control timestamps when each command
+reaches the broker's subscribers (where the device would receive it), and {sensor_id}/response
+is watched for device replies. Each operator owns its own sensor IDs and sends one request at a
+time, so control messages are matched to HTTP requests in FIFO order per sensor.
+
+Example (backend started with MQTT_CONNECTION_TYPE=plain against the same local broker):
+    python ptz_load_generator.py --base-url http://127.0.0.1:3000 --operators 20 --duration 60
+
+Run fleet_simulator.py --rate 0 with the same --prefix to have live devices answer get-position.
+"""
+import argparse
+import collections
+import http.client
+import json
+import random
+import threading
+import time
+from threading import Lock
+from urllib.parse import urlparse
+
+import paho.mqtt.client as mqtt
+
+from fleet_simulator import percentiles
+
+# Operator actions and their relative weights
+DEFAULT_ACTION_MIX = {
+    "joystick": 60,    # a burst of /move followed by /stop-ptz
+    "preset": 20,
+    "absolute": 8,
+    "relative": 5,
+    "position": 5,
+    "patrol": 2,       # /start-patrol, a pause, /stop-patrol
+}
+
+PRESET_NAMES = ("gate", "yard", "dock", "road")
+
+# Route -> MQTT command it publishes on {sensor_id}/control
+ROUTE_COMMANDS = {
+    "/move": "move",
+    "/stop-ptz": "stop_ptz",
+    "/go-to-preset": "go-to-preset",
+    "/move-absolute": "move_absolute",
+    "/move-relative": "move_relative",
+    "/get-position": "get_position",
+    "/start-patrol": "start_patrol",
+    "/stop-patrol": "stop_patrol",
+}
+
+
+# ---------------------------------------------------
+# 📊 Correlation and Statistics
+# ---------------------------------------------------
+
+class LoadStats:
+    def __init__(self):
+        self._lock = Lock()
+        self.pending = collections.defaultdict(collections.deque)   # sensor_id -> (command, sent_at)
+        self.position_requests = collections.defaultdict(collections.deque)
+        self.http_latency = collections.defaultdict(list)            # route -> seconds
+        self.http_status = collections.defaultdict(collections.Counter)
+        self.http_errors = collections.Counter()
+        self.mqtt_latency = collections.defaultdict(list)            # command -> HTTP send -> control message seen
+        self.device_latency = []                                     # get-position -> device response
+        self.mismatched = 0
+        self.unexpected = 0
+
+    def expect(self, sensor_id, command, sent_at):
+        with self._lock:
+            self.pending[sensor_id].append((command, sent_at))
+            if command == "get_position":
+                self.position_requests[sensor_id].append(sent_at)
+
+    def cancel(self, sensor_id, command):
+        """The route failed, so nothing was published for the request we registered last."""
+        with self._lock:
+            queue = self.pending[sensor_id]
+            if queue and queue[-1][0] == command:
+                queue.pop()
+                if command == "get_position" and self.position_requests[sensor_id]:
+                    self.position_requests[sensor_id].pop()
+
+    def record_http(self, route, status, latency):
+        with self._lock:
+            self.http_latency[route].append(latency)
+            self.http_status[route][status] += 1
+
+    def record_http_error(self, route, error):
+        with self._lock:
+            self.http_errors[f"{route}: {type(error).__name__}"] += 1
+
+    def record_control(self, sensor_id, command, arrived_at):
+        with self._lock:
+            queue = self.pending.get(sensor_id)
+            if not queue:
+                self.unexpected += 1
+                return
+            # Skip entries whose publish never happened (e.g. dropped by the backend)
+            while queue and queue[0][0] != command:
+                queue.popleft()
+                self.mismatched += 1
+            if queue:
+                _, sent_at = queue.popleft()
+                self.mqtt_latency[command].append(arrived_at - sent_at)
+            else:
+                self.unexpected += 1
+
+    def record_response(self, sensor_id, payload, arrived_at):
+        if payload.get("type") != "position":
+            return
+        with self._lock:
+            queue = self.position_requests.get(sensor_id)
+            if queue:
+                self.device_latency.append(arrived_at - queue.popleft())
+
+    def lost(self):
+        with self._lock:
+            return sum(len(queue) for queue in self.pending.values())
+
+
+# ---------------------------------------------------
+# 👀 MQTT Observer
+# ---------------------------------------------------
+
+def start_observer(args, sensor_ids, stats):
+    """Subscribe to the control and response topics of every sensor under test."""
+    client = mqtt.Client(client_id=f"ptz-load-observer-{random.randint(0, 1 << 30)}")
+    if args.mqtt_username:
+        client.username_pw_set(args.mqtt_username, args.mqtt_password)
+    subscribed = threading.Event()
+
+    def on_connect(client, userdata, flags, rc):
+        topics = [(f"{sensor_id}/control", 0) for sensor_id in sensor_ids]
+        topics += [(f"{sensor_id}/response", 0) for sensor_id in sensor_ids]
+        client.subscribe(topics)
+
+    def on_subscribe(client, userdata, mid, granted_qos):
+        subscribed.set()
+
+    def on_message(client, userdata, msg):
+        arrived_at = time.time()
+        sensor_id, _, kind = msg.topic.rpartition("/")
+        try:
+            payload = json.loads(msg.payload)
+        except ValueError:
+            return
+        if kind == "control":
+            stats.record_control(sensor_id, payload.get("command"), arrived_at)
+        elif kind == "response":
+            stats.record_response(sensor_id, payload, arrived_at)
+
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_message = on_message
+    client.connect(args.mqtt_host, args.mqtt_port, keepalive=60)
+    client.loop_start()
+    if not subscribed.wait(timeout=10):
+        raise TimeoutError("Observer could not subscribe to the control topics")
+    return client
+
+
+# ---------------------------------------------------
+# 🧑‍✈️ Simulated Operators
+# ---------------------------------------------------
+
+class Operator(threading.Thread):
+    """One operator console: sequential requests with think time, on its own sensors."""
+
+    def __init__(self, index, sensor_ids, args, stats, stop_event):
+        super().__init__(name=f"operator-{index}", daemon=True)
+        self.sensor_ids = sensor_ids
+        self.args = args
+        self.stats = stats
+        self.stop_event = stop_event
+        self.rng = random.Random(None if args.seed is None else args.seed + index)
+        url = urlparse(args.base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.prefix = url.path.rstrip("/") + args.route_prefix
+        self.connection = None
+
+    def request(self, method, route, body=None, expect_command=True):
+        sensor_id = body.get("sensor_id") if body else None
+        command = ROUTE_COMMANDS.get(route) if expect_command else None
+        sent_at = time.time()
+        if command:
+            self.stats.expect(sensor_id, command, sent_at)
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.args.timeout)
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            self.connection.request(method, self.prefix + route, json.dumps(body) if body is not None else None, headers)
+            response = self.connection.getresponse()
+            response.read()
+            self.stats.record_http(route, response.status, time.time() - sent_at)
+            if response.status >= 400 and command:
+                self.stats.cancel(sensor_id, command)
+        except Exception as e:
+            self.stats.record_http_error(route, e)
+            if command:
+                self.stats.cancel(sensor_id, command)
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def think(self, mean):
+        self.stop_event.wait(self.rng.expovariate(1.0 / mean) if mean > 0 else 0)
+
+    def run(self):
+        actions, weights = zip(*DEFAULT_ACTION_MIX.items())
+        while not self.stop_event.is_set():
+            sensor_id = self.rng.choice(self.sensor_ids)
+            getattr(self, f"do_{self.rng.choices(actions, weights)[0]}")(sensor_id)
+            self.think(self.args.think_time)
+
+    def do_joystick(self, sensor_id):
+        for _ in range(self.rng.randint(3, 8)):
+            self.request("POST", "/move", {
+                "sensor_id": sensor_id, "pan": self.rng.choice((-1, 0, 1)), "tilt": self.rng.choice((-1, 0, 1)),
+                "zoom": 0, "velocity": round(self.rng.uniform(0.2, 1.0), 2),
+            })
+            self.think(self.args.joystick_interval)
+        self.request("POST", "/stop-ptz", {"sensor_id": sensor_id})
+
+    def do_preset(self, sensor_id):
+        self.request("POST", "/go-to-preset", {"sensor_id": sensor_id, "preset_name": self.rng.choice(PRESET_NAMES)})
+
+    def do_absolute(self, sensor_id):
+        self.request("POST", "/move-absolute", {
+            "sensor_id": sensor_id, "pan": round(self.rng.uniform(-1, 1), 3),
+            "tilt": round(self.rng.uniform(-1, 1), 3), "zoom": round(self.rng.uniform(0, 1), 3),
+        })
+
+    def do_relative(self, sensor_id):
+        self.request("POST", "/move-relative", {
+            "sensor_id": sensor_id, "pan": round(self.rng.uniform(-0.2, 0.2), 3),
+            "tilt": round(self.rng.uniform(-0.2, 0.2), 3), "zoom": 0,
+        })
+
+    def do_position(self, sensor_id):
+        self.request("POST", "/get-position", {"sensor_id": sensor_id, "refresh": self.rng.random() < 0.5})
+        self.request("GET", f"/position/{sensor_id}", expect_command=False)
+
+    def do_patrol(self, sensor_id):
+        self.request("POST", "/start-patrol", {"sensor_id": sensor_id, "presets": list(PRESET_NAMES)})
+        self.think(self.args.think_time * 3)
+        self.request("POST", "/stop-patrol", {"sensor_id": sensor_id})
+
+
+# ---------------------------------------------------
+# 📈 Report
+# ---------------------------------------------------
+
+def build_report(stats, elapsed, operators):
+    http_total = sum(len(values) for values in stats.http_latency.values())
+    error_total = sum(stats.http_errors.values())
+    status_errors = sum(count for statuses in stats.http_status.values()
+                        for status, count in statuses.items() if status >= 400)
+    all_mqtt = [value for values in stats.mqtt_latency.values() for value in values]
+    routes = {}
+    for route in sorted(set(stats.http_latency) | {key.split(":")[0] for key in stats.http_errors}):
+        transport_errors = sum(count for key, count in stats.http_errors.items() if key.split(":")[0] == route)
+        requests = len(stats.http_latency.get(route, [])) + transport_errors
+        failures = transport_errors + sum(count for status, count in stats.http_status[route].items() if status >= 400)
+        routes[route] = {
+            "requests": requests,
+            "error_rate": round(failures / max(1, requests), 4),
+            "status": dict(stats.http_status[route]),
+            "http_ms": percentiles(stats.http_latency.get(route, [])),
+        }
+    return {
+        "operators": operators,
+        "duration_s": round(elapsed, 2),
+        "requests_per_s": round(http_total / elapsed, 1),
+        "http_error_rate": round((error_total + status_errors) / max(1, http_total + error_total), 4),
+        "transport_errors": dict(stats.http_errors),
+        "latency_ms": {
+            "http": percentiles([value for values in stats.http_latency.values() for value in values]),
+            "http_to_mqtt": percentiles(all_mqtt),
+            "http_to_device_response": percentiles(stats.device_latency),
+        },
+        "http_to_mqtt_ms": {command: percentiles(values) for command, values in sorted(stats.mqtt_latency.items())},
+        "mqtt": {
+            "delivered": len(all_mqtt),
+            "lost": stats.lost(),
+            "out_of_order_or_dropped": stats.mismatched,
+            "unexpected": stats.unexpected,
+            "device_responses": len(stats.device_latency),
+        },
+        "routes": routes,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay operator traffic against the PTZ REST routes")
+    parser.add_argument("--base-url", default="http://127.0.0.1:3000", help="Backend base URL")
+    parser.add_argument("--route-prefix", default="/api/ptz", help="Mount point of the PTZ routes")
+    parser.add_argument("--mqtt-host", default="127.0.0.1", help="Broker the backend publishes to (plain TCP)")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--mqtt-username", default="")
+    parser.add_argument("--mqtt-password", default="")
+    parser.add_argument("--operators", type=int, default=10, help="Concurrent simulated operators")
+    parser.add_argument("--sensors-per-operator", type=int, default=1, help="Cameras each operator controls")
+    parser.add_argument("--prefix", default="sim-cam-", help="Sensor ID prefix (matches fleet_simulator.py)")
+    parser.add_argument("--duration", type=float, default=30, help="Test duration in seconds")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean pause between operator actions (s)")
+    parser.add_argument("--joystick-interval", type=float, default=0.1, help="Mean pause between /move calls in a burst (s)")
+    parser.add_argument("--timeout", type=float, default=10, help="HTTP timeout (s)")
+    parser.add_argument("--drain", type=float, default=3, help="Seconds to wait for in-flight MQTT messages")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--report", help="Also write the JSON report to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stats = LoadStats()
+    sensor_groups = [
+        [f"{args.prefix}{index * args.sensors_per_operator + offset:04d}" for offset in range(args.sensors_per_operator)]
+        for index in range(args.operators)
+    ]
+    observer = start_observer(args, [sensor_id for group in sensor_groups for sensor_id in group], stats)
+    print(f"👀 Observing {args.operators * args.sensors_per_operator} sensors on {args.mqtt_host}:{args.mqtt_port}")
+
+    stop_event = threading.Event()
+    operators = [Operator(index, group, args, stats, stop_event) for index, group in enumerate(sensor_groups)]
+    print(f"🚦 {len(operators)} operators against {args.base_url}{args.route_prefix} for {args.duration:g}s...")
+    started = time.monotonic()
+    for operator in operators:
+        operator.start()
+    stop_event.wait(args.duration)
+    stop_event.set()
+    for operator in operators:
+        operator.join(timeout=args.timeout)
+    elapsed = time.monotonic() - started
+
+    # Let the last control messages arrive before counting losses
+    time.sleep(args.drain)
+    observer.loop_stop()
+    observer.disconnect()
+
+    report = build_report(stats, elapsed, len(operators))
+    print(json.dumps(report, indent=4))
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Micro-benchmark: zeep request building/parsing vs the prebuilt SOAP templates in subscriber-raspi5.py.
+
+Measures only the CPU work done on the device for each hot PTZ call (nothing is sent):
+  zeep      create_type + envelope serialization + WS-Security, what ptz_service.<Op>() does before posting
+  prebuilt  WS-Security digest + str.format of the pre-rendered envelope
+and, for GetStatus, parsing of a typical reply with zeep's deserializer vs parse_ptz_status.
+
+Run it on the Pi itself; results on a desktop CPU are not representative:
+    python soap_benchmark.py --iterations 2000
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import time
+from types import SimpleNamespace
+
+SUBSCRIBER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "subscriber-raspi5.py")
+
+GET_STATUS_REPLY = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:tptz="http://www.onvif.org/ver20/ptz/wsdl"'
+    b' xmlns:tt="http://www.onvif.org/ver10/schema"><s:Body><tptz:GetStatusResponse><tptz:PTZStatus>'
+    b'<tt:Position><tt:PanTilt x="0.25" y="-0.5"/><tt:Zoom x="0.1"/></tt:Position>'
+    b'<tt:MoveStatus><tt:PanTilt>IDLE</tt:PanTilt><tt:Zoom>IDLE</tt:Zoom></tt:MoveStatus>'
+    b'<tt:UtcTime>2025-01-01T00:00:00Z</tt:UtcTime></tptz:PTZStatus></tptz:GetStatusResponse></s:Body></s:Envelope>'
+)
+
+
+def load_subscriber():
+    spec = importlib.util.spec_from_file_location("subscriber_raspi5", SUBSCRIBER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def create_ptz_service(xaddr, username, password):
+    """A real onvif-zeep PTZ service built from the bundled WSDL (no camera needed)."""
+    import onvif
+    from onvif import ONVIFService
+
+    wsdl = os.path.join(os.path.dirname(os.path.dirname(onvif.__file__)), "wsdl", "ptz.wsdl")
+    return ONVIFService(xaddr, username, password, wsdl, no_cache=True,
+                        binding_name="{http://www.onvif.org/ver20/ptz/wsdl}PTZBinding")
+
+
+def zeep_envelope(service, operation, request):
+    """What zeep does for ptz_service.<operation>(request) up to the HTTP post."""
+    from zeep.wsdl.utils import etree_to_string
+
+    # onvif-zeep's service wrapper turns the request object back into a dict of keyword arguments
+    envelope, headers = service.ws_client._binding._create(
+        operation, (), service.to_dict(request), client=service.zeep_client, options={"address": service.xaddr}
+    )
+    return etree_to_string(envelope)
+
+
+def zeep_calls(service, profile_token):
+    def continuous_move():
+        request = service.create_type("ContinuousMove")
+        request.ProfileToken = profile_token
+        request.Velocity = {"PanTilt": {"x": 0.5, "y": -0.25}, "Zoom": {"x": 0.0}}
+        return zeep_envelope(service, "ContinuousMove", request)
+
+    def stop():
+        request = service.create_type("Stop")
+        request.ProfileToken = profile_token
+        request.PanTilt = True
+        request.Zoom = True
+        return zeep_envelope(service, "Stop", request)
+
+    def goto_preset():
+        request = service.create_type("GotoPreset")
+        request.ProfileToken = profile_token
+        request.PresetToken = "3"
+        return zeep_envelope(service, "GotoPreset", request)
+
+    def get_status():
+        return zeep_envelope(service, "GetStatus", {"ProfileToken": profile_token})
+
+    return {"ContinuousMove": continuous_move, "Stop": stop, "GotoPreset": goto_preset, "GetStatus": get_status}
+
+
+def prebuilt_calls(prebuilt):
+    def render(operation, shape=None, **values):
+        template = prebuilt._template(operation, shape)
+        return lambda: template.render(**prebuilt._security(), **values)
+
+    return {
+        "ContinuousMove": render("ContinuousMove", ("PanTilt", "Zoom"), pan=0.5, tilt=-0.25, zoom=0.0),
+        "Stop": render("Stop"),
+        "GotoPreset": render("GotoPreset", preset="3"),
+        "GetStatus": render("GetStatus"),
+    }
+
+
+def zeep_parse_status(service):
+    import requests
+
+    operation = service.ws_client._binding.get("GetStatus")
+
+    def parse():
+        response = requests.Response()
+        response.status_code = 200
+        response._content = GET_STATUS_REPLY
+        response.headers["Content-Type"] = "application/soap+xml"
+        return service.ws_client._binding.process_reply(service.zeep_client, operation, response)
+
+    return parse
+
+
+def time_call(function, iterations):
+    """Median and p95 per call in microseconds, after a short warm-up."""
+    for _ in range(min(iterations, 50)):
+        function()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare zeep vs prebuilt SOAP request costs for hot PTZ calls")
+    parser.add_argument("--iterations", type=int, default=2000, help="Timed calls per operation")
+    parser.add_argument("--profile-token", default="Profile_1", help="Media profile token used in the envelopes")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    subscriber = load_subscriber()
+    service = create_ptz_service("http://127.0.0.1/onvif/ptz", "admin", "password")
+    transport = SimpleNamespace(session=None, transport=SimpleNamespace(operation_timeout=None))
+    prebuilt = subscriber.PrebuiltPTZRequests(service, args.profile_token, transport)
+
+    rows = []
+    zeep_ops = zeep_calls(service, args.profile_token)
+    prebuilt_ops = prebuilt_calls(prebuilt)
+    for operation in ("ContinuousMove", "Stop", "GotoPreset", "GetStatus"):
+        rows.append((f"{operation} request", time_call(zeep_ops[operation], args.iterations),
+                     time_call(prebuilt_ops[operation], args.iterations)))
+    rows.append(("GetStatus reply parse", time_call(zeep_parse_status(service), args.iterations),
+                 time_call(lambda: subscriber.parse_ptz_status(GET_STATUS_REPLY), args.iterations)))
+
+    print(f"{'operation':<24}{'zeep p50':>12}{'p95':>10}{'prebuilt p50':>15}{'p95':>10}{'speedup':>10}")
+    for name, (zeep_p50, zeep_p95), (prebuilt_p50, prebuilt_p95) in rows:
+        print(f"{name:<24}{zeep_p50:>10.1f}us{zeep_p95:>8.1f}us{prebuilt_p50:>13.1f}us{prebuilt_p95:>8.1f}us"
+              f"{zeep_p50 / prebuilt_p50:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
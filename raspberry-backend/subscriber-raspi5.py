@@ -2,15 +2,32 @@ import json
 import time
 import threading
 import ssl
-import paho.mqtt.client as mqtt
-from onvif import ONVIFCamera
-import pymongo
 import subprocess
 import os
 import logging
 from logging.handlers import RotatingFileHandler
 import signal
 import sys
+import argparse
+import importlib
+import copy
+import datetime
+import itertools
+import functools
+import asyncio
+import hashlib
+import base64
+import cProfile
+import ctypes
+import ctypes.util
+import select
+import struct
+import queue
+import re
+from collections import Counter, deque
+from types import SimpleNamespace
+from xml.sax.saxutils import escape as xml_escape
+from contextlib import contextmanager
 from threading import Lock
 from pathlib import Path
 
@@ -20,7 +37,8 @@ ROOT_DIR = current_dir  # Changed to use the same directory as the script
 # MQTT Connection Types
 MQTT_CONNECTION_TYPES = {
     "CREDENTIALS": "credentials",
-    "CERTIFICATE": "certificate"
+    "CERTIFICATE": "certificate",
+    "PLAIN": "plain"  # No TLS, optional username/password (local brokers, fleet simulator)
 }
 
 # MQTT Credentials - Default values (will be overridden by environment variables if available)
@@ -37,6 +55,14 @@ MQTT_CA_CERT = os.environ.get("MQTT_CA_CERT", "")
 MQTT_CLIENT_CERT = os.environ.get("MQTT_CLIENT_CERT", "")
 MQTT_CLIENT_KEY = os.environ.get("MQTT_CLIENT_KEY", "")
 
+# Runtime: "threaded" (paho network thread + worker threads) or "asyncio" (one event loop)
+SUBSCRIBER_RUNTIME = os.environ.get("SUBSCRIBER_RUNTIME", "threaded")
+ASYNC_EXECUTOR_WORKERS = int(os.environ.get("ASYNC_EXECUTOR_WORKERS", "8"))
+ASYNC_COMMAND_TIMEOUT = float(os.environ.get("ASYNC_COMMAND_TIMEOUT", "30"))
+
+# Fast-start mode: subscribe first, preload heavy dependencies (onvif/zeep, pymongo) in the background
+FAST_START = os.environ.get("FAST_START", "false").lower() in ("1", "true", "yes")
+
 # Global variables for configurations
 config = None
 camera_details = None
@@ -69,6 +95,96 @@ def setup_logging():
     logger.setLevel(logging.INFO)
     logger.addHandler(handler)
 
+    # Console output used to come from the eager `onvif` import calling logging.basicConfig()
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+
+# ---------------------------------------------------
+# ⏱️ Startup Profiling & Lazy Imports
+# ---------------------------------------------------
+
+class StartupProfiler:
+    """Collect import and initialization timings for the --profile-startup report."""
+
+    def __init__(self):
+        self.enabled = False
+        self.started_at = time.perf_counter()
+        self.stages = []
+        self.reported = False
+        self._lock = Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Time a startup stage (import, config load, connect, ...)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, duration):
+        with self._lock:
+            self.stages.append((name, duration, time.perf_counter() - self.started_at))
+
+    def mark(self, name):
+        """Record a milestone measured from process start."""
+        self.record(name, 0.0)
+
+    def report(self):
+        """Print the timing breakdown once (no-op unless --profile-startup is set)."""
+        with self._lock:
+            if not self.enabled or self.reported:
+                return
+            self.reported = True
+            stages = list(self.stages)
+
+        lines = ["⏱️ Startup profile (duration / elapsed since start):"]
+        for name, duration, elapsed in stages:
+            duration_text = f"{duration * 1000:8.1f} ms" if duration else "       —   "
+            lines.append(f"   {name:<40} {duration_text}   @ {elapsed * 1000:8.1f} ms")
+        report = "\n".join(lines)
+        print(report)
+        logging.info(report)
+
+
+startup_profiler = StartupProfiler()
+_lazy_modules = {}
+_lazy_import_lock = Lock()
+
+
+def lazy_import(module_name):
+    """Import a heavy dependency on first use and cache the module object."""
+    module = _lazy_modules.get(module_name)
+    if module is not None:
+        return module
+
+    with _lazy_import_lock:
+        if module_name not in _lazy_modules:
+            with startup_profiler.stage(f"import {module_name}"):
+                _lazy_modules[module_name] = importlib.import_module(module_name)
+        return _lazy_modules[module_name]
+
+
+def preload_heavy_dependencies():
+    """Import ONVIF (zeep/lxml) and pymongo so the first PTZ command doesn't pay for it."""
+    for module_name in ("onvif", "pymongo"):
+        try:
+            lazy_import(module_name)
+        except Exception as e:
+            logging.error(f"Failed to preload {module_name}: {e}")
+    logging.info("Heavy dependencies preloaded")
+
+
+def preload_heavy_dependencies_in_background():
+    """Start the dependency preload on a daemon thread (fast-start mode)."""
+    def preload():
+        preload_heavy_dependencies()
+        startup_profiler.report()
+
+    threading.Thread(target=preload, name="dependency-preload", daemon=True).start()
+
 
 # ---------------------------------------------------
 # 📄 Configuration Handling
@@ -114,6 +230,2819 @@ def validate_config(config_data):
         return False
 
 
+def save_config(config_data):
+    """Atomically write configuration.json (readers never see a half-written file)."""
+    config_path = f"{ROOT_DIR}/configuration.json"
+    tmp_path = f"{config_path}.tmp"
+    content = json.dumps(config_data, indent=4).encode("utf-8")
+    # Remembered so the config watcher doesn't hot-reload our own writes
+    RECENT_CONFIG_WRITES.append(hashlib.sha1(content).hexdigest())
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+    os.replace(tmp_path, config_path)
+
+
+# ---------------------------------------------------
+# 👀 Configuration Watcher
+# ---------------------------------------------------
+
+DEFAULT_CONFIG_WATCH_SETTINGS = {
+    "enabled": True,
+    "debounce": 0.5,        # seconds without further events before a change is applied
+    "poll_interval": 2.0,   # mtime polling period when inotify is unavailable
+}
+
+# Digests of configuration.json contents written by this process (see save_config)
+RECENT_CONFIG_WRITES = deque(maxlen=16)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (followed by the file name)
+
+
+class InotifyWatch:
+    """Minimal inotify(7) binding through ctypes; watches a directory for files being written or replaced."""
+
+    def __init__(self, directory, mask=IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def read_names(self):
+        """Names of the files with pending events (empty if there are none)."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names, offset = set(), 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            names.add(data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace"))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigWatcher:
+    """Call on_change(content) when a file changes, once writes have settled; our own writes are skipped.
+
+    The parent directory is watched rather than the file, because save_config and most editors replace
+    the file (new inode) instead of writing it in place. Falls back to mtime polling without inotify.
+    """
+
+    def __init__(self, path, on_change, settings=None):
+        self.path = path
+        self.on_change = on_change
+        self.settings = dict(DEFAULT_CONFIG_WATCH_SETTINGS, **(settings or {}))
+        self.last_digest = self._digest(self._read())
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _digest(content):
+        return hashlib.sha1(content).hexdigest() if content is not None else None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        try:
+            watch = InotifyWatch(os.path.dirname(os.path.abspath(self.path)))
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify unavailable ({e}); polling {self.path} every {self.settings['poll_interval']}s")
+            self._poll()
+            return
+
+        logging.info(f"👀 Watching {self.path} for changes")
+        name = os.path.basename(self.path)
+        pending = False
+        try:
+            while not self._stop_event.is_set():
+                # While a change is pending, wait for a quiet period of `debounce` seconds
+                ready, _, _ = select.select([watch.fd], [], [], self.settings["debounce"] if pending else 1.0)
+                if ready:
+                    pending = name in watch.read_names() or pending
+                elif pending:
+                    pending = False
+                    self._check()
+        finally:
+            watch.close()
+
+    def _poll(self):
+        last_stat = None
+        while not self._stop_event.wait(self.settings["poll_interval"]):
+            try:
+                stat = os.stat(self.path)
+                stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            except OSError:
+                continue
+            if last_stat is not None and stat != last_stat:
+                self._check()
+            last_stat = stat
+
+    def _check(self):
+        content = self._read()
+        digest = self._digest(content)
+        if content is None or digest == self.last_digest:
+            return
+        self.last_digest = digest
+        if digest in RECENT_CONFIG_WRITES:
+            logging.debug(f"Ignoring our own write to {self.path}")
+            return
+        try:
+            self.on_change(content)
+        except Exception as e:
+            logging.error(f"Config change handler failed: {e}")
+
+
+# ---------------------------------------------------
+# 🍃 MongoDB Config Push
+# ---------------------------------------------------
+
+DEFAULT_CONFIG_PUSH_SETTINGS = {
+    "enabled": False,
+    "mode": "auto",             # "change_stream", "poll", or "auto" (change stream, polling if the server can't)
+    "poll_interval": 30,        # seconds between version checks in polling mode
+    "version_field": "version", # top-level document field bumped on every edit (polling compares it)
+    "retry_interval": 10,       # seconds before reconnecting after an error
+}
+
+CONFIG_STREAM_CACHE = "config_stream.json"
+CONFIG_CONTENT_FIELD = "config_content"
+
+
+def set_path(document, path, value):
+    """Set a dotted MongoDB field path ("a.b.0.c") inside nested dicts/lists."""
+    *parents, last = path.split(".")
+    for key in parents:
+        document = document[int(key)] if isinstance(document, list) else document.setdefault(key, {})
+    if isinstance(document, list):
+        index = int(last)
+        document.extend([None] * (index + 1 - len(document)))
+        document[index] = value
+    else:
+        document[last] = value
+
+
+def unset_path(document, path):
+    *parents, last = path.split(".")
+    try:
+        for key in parents:
+            document = document[int(key)] if isinstance(document, list) else document[key]
+        if isinstance(document, dict):
+            document.pop(last, None)
+    except (KeyError, IndexError, ValueError, TypeError):
+        pass
+
+
+def config_from_content(content):
+    """config_content may be stored as a document or as a JSON string (see update_local_config)."""
+    return json.loads(content) if isinstance(content, str) else copy.deepcopy(content)
+
+
+def apply_config_update(current_config, update_description):
+    """Apply a change stream updateDescription to the config; None if config_content wasn't touched."""
+    prefix = CONFIG_CONTENT_FIELD + "."
+    updated = update_description.get("updatedFields") or {}
+    removed = update_description.get("removedFields") or []
+    if CONFIG_CONTENT_FIELD in updated:
+        return config_from_content(updated[CONFIG_CONTENT_FIELD])
+    if not any(path.startswith(prefix) for path in itertools.chain(updated, removed)):
+        return None
+
+    new_config = copy.deepcopy(current_config)
+    for path, value in updated.items():
+        if path.startswith(prefix):
+            set_path(new_config, path[len(prefix):], value)
+    for path in removed:
+        if path.startswith(prefix):
+            unset_path(new_config, path[len(prefix):])
+    return new_config
+
+
+class ConfigStream:
+    """Follow this device's config document in MongoDB and hand each new config to on_update(config).
+
+    Holds one change stream filtered on the document _id; updates carry only the changed fields, which
+    are merged into the current config. The resume token is cached so restarts pick up missed edits.
+    Without a replica set (no change streams) it polls the document's version field instead.
+    """
+
+    def __init__(self, sensor_id, mongo_settings, on_update, get_config, settings=None):
+        self.sensor_id = sensor_id
+        self.mongo_settings = mongo_settings
+        self.on_update = on_update
+        self.get_config = get_config  # the running config (it may also change through the file watcher)
+        self.settings = dict(DEFAULT_CONFIG_PUSH_SETTINGS, **(settings or {}))
+        self.mode = None
+        self._client = None
+        self._stream = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_version = None
+        self._resync_pending = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="config-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        # Closing the stream/client unblocks a waiting change stream
+        for closable in (self._stream, self._client):
+            try:
+                if closable is not None:
+                    closable.close()
+            except Exception:
+                pass
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    def _collection(self):
+        if self._client is None:
+            pymongo = lazy_import("pymongo")
+            self._client = pymongo.MongoClient(self.mongo_settings["uri"], tls=True, tlsAllowInvalidCertificates=True)
+        return self._client[self.mongo_settings["database"]][self.mongo_settings["collection"]]
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                collection = self._collection()
+                if self.settings["mode"] == "poll" or self.mode == "poll":
+                    self._poll(collection)
+                else:
+                    self._follow(collection)
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                if self.settings["mode"] == "auto" and self.mode != "poll" and is_change_stream_unsupported(e):
+                    logging.warning(f"[{self.sensor_id}] Change streams unavailable ({e}); polling every {self.settings['poll_interval']}s")
+                    self.mode = "poll"
+                    continue
+                if is_resume_token_lost(e):
+                    # The oplog rolled past our token: start a fresh stream and re-read the document once
+                    logging.warning(f"[{self.sensor_id}] Config change stream history lost ({e}); resynchronising")
+                    self._forget_resume_token()
+                    self._resync_pending = True
+                    continue
+                logging.error(f"[{self.sensor_id}] Config push error: {e}")
+                self._stop_event.wait(self.settings["retry_interval"])
+
+    def _follow(self, collection):
+        cached = load_json_cache(CONFIG_STREAM_CACHE).get(self.sensor_id) or {}
+        pipeline = [{"$match": {"documentKey._id": self.sensor_id}}]
+        options = {"start_after": cached["resume_token"]} if cached.get("resume_token") else {}
+        with collection.watch(pipeline, **options) as stream:
+            self._stream = stream
+            self.mode = "change_stream"
+            logging.info(f"🍃 [{self.sensor_id}] Following config changes (change stream)")
+            if self._resync_pending:
+                # Read after the stream is open, so edits made meanwhile arrive on the stream
+                self._resync(collection)
+                self._resync_pending = False
+            for change in stream:
+                if self._stop_event.is_set():
+                    return
+                self._handle_change(change)
+                save_json_cache(CONFIG_STREAM_CACHE, dict(
+                    load_json_cache(CONFIG_STREAM_CACHE), **{self.sensor_id: {"resume_token": stream.resume_token}}
+                ))
+
+    def _handle_change(self, change):
+        operation = change.get("operationType")
+        if operation == "update":
+            description = change.get("updateDescription") or {}
+            if description.get("truncatedArrays"):
+                # Array truncations can't be replayed from the delta; take the whole document
+                self._resync(self._collection())
+                return
+            new_config = apply_config_update(self.get_config(), description)
+        elif operation in ("insert", "replace"):
+            content = (change.get("fullDocument") or {}).get(CONFIG_CONTENT_FIELD)
+            new_config = config_from_content(content) if content is not None else None
+        else:
+            logging.warning(f"[{self.sensor_id}] Ignoring config document {operation}")
+            return
+        if new_config is not None:
+            self._deliver(new_config)
+
+    def _resync(self, collection):
+        """Fetch the whole config document once and deliver it."""
+        document = collection.find_one({"_id": self.sensor_id}, {CONFIG_CONTENT_FIELD: 1})
+        content = (document or {}).get(CONFIG_CONTENT_FIELD)
+        if content is not None:
+            self._deliver(config_from_content(content))
+
+    def _forget_resume_token(self):
+        caches = load_json_cache(CONFIG_STREAM_CACHE)
+        if caches.pop(self.sensor_id, None) is not None:
+            save_json_cache(CONFIG_STREAM_CACHE, caches)
+
+    def _poll(self, collection):
+        version_field = self.settings["version_field"]
+        logging.info(f"🍃 [{self.sensor_id}] Polling config document every {self.settings['poll_interval']}s")
+        while not self._stop_event.is_set():
+            # Only the version field travels unless it changed
+            marker = collection.find_one({"_id": self.sensor_id}, {version_field: 1})
+            version = (marker or {}).get(version_field)
+            if marker and (version is None or version != self._last_version):
+                # Documents without a version field are fetched (and compared) on every poll
+                document = collection.find_one({"_id": self.sensor_id}, {CONFIG_CONTENT_FIELD: 1})
+                content = (document or {}).get(CONFIG_CONTENT_FIELD)
+                if content is not None:
+                    self._deliver(config_from_content(content))
+                self._last_version = version
+            self._stop_event.wait(self.settings["poll_interval"])
+
+    def _deliver(self, new_config):
+        if new_config != self.get_config():
+            self.on_update(new_config)
+
+
+def is_change_stream_unsupported(error):
+    """Standalone servers answer $changeStream with code 40573 (or a message saying replica sets are needed)."""
+    return getattr(error, "code", None) == 40573 or "replica set" in str(error).lower()
+
+
+def is_resume_token_lost(error):
+    """ChangeStreamHistoryLost (286): the resume token is older than anything left in the oplog."""
+    return getattr(error, "code", None) == 286
+
+
+# ---------------------------------------------------
+# 📡 Position Telemetry
+# ---------------------------------------------------
+
+DEFAULT_TELEMETRY_SETTINGS = {
+    "enabled": False,
+    "moving_interval": 0.2,   # seconds between GetStatus samples while the camera moves
+    "idle_interval": 5.0,     # seconds between samples while idle
+    "publish_interval": 1.0,  # samples are batched into one message per interval
+    "epsilon": 0.005,         # minimum change on any axis before a sample is kept
+}
+
+
+class PositionTelemetry:
+    """Sample PTZ position (fast while moving, slow while idle) and publish batched deltas."""
+
+    def __init__(self, sample, publish, settings=None):
+        self.sample = sample
+        self.publish = publish
+        self.settings = dict(DEFAULT_TELEMETRY_SETTINGS, **(settings or {}))
+        self._buffer = []
+        self._last_kept = None
+        self._last_flush = time.monotonic()
+        self._moving = False
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="position-telemetry", daemon=True)
+        self._thread.start()
+        logging.info(f"Position telemetry started: {self.settings}")
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        self.flush()
+
+    def wake(self):
+        """Switch to the fast sampling rate right away (a move command was sent)."""
+        self._moving = True
+        self._wake_event.set()
+
+    def _changed(self, position):
+        if self._last_kept is None:
+            return True
+        return any(abs(position[axis] - self._last_kept[axis]) > self.settings["epsilon"] for axis in PTZ_AXES)
+
+    def record(self, position):
+        """Keep a sample if it moved more than epsilon since the last kept one."""
+        changed = self._changed(position)
+        # "moving" is the camera's MoveStatus when GetStatus reports one; a position that is still
+        # changing counts too, for cameras without it (the model never sees preset or tour moves)
+        self._moving = bool(position.get("moving")) or (changed and self._last_kept is not None)
+        if changed:
+            self._last_kept = position
+            self._buffer.append([round(time.time(), 3)] + [round(position[axis], 4) for axis in PTZ_AXES])
+
+    def flush(self):
+        """Publish buffered samples as a single message."""
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        samples, self._buffer = self._buffer, []
+        self.publish({"type": "position_telemetry", "fields": ["t", "pan", "tilt", "zoom"], "samples": samples})
+
+    def step(self):
+        """Take one sample and flush if due; returns the seconds until the next sample."""
+        try:
+            position = self.sample()
+            if position is not None:
+                self.record(position)
+            if time.monotonic() - self._last_flush >= self.settings["publish_interval"]:
+                self.flush()
+        except Exception as e:
+            logging.error(f"Position telemetry error: {e}")
+        return self.settings["moving_interval"] if self._moving else self.settings["idle_interval"]
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            interval = self.step()
+            self._wake_event.wait(timeout=interval)
+            self._wake_event.clear()
+
+
+# ---------------------------------------------------
+# 💾 Local Cache Files
+# ---------------------------------------------------
+
+def cache_file_path(name):
+    """Return the path of a cache file under ROOT_DIR/cache, creating the folder if needed."""
+    cache_dir = os.path.join(ROOT_DIR, "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, name)
+
+
+def load_json_cache(name):
+    """Load a JSON cache file, returning an empty dict if it is missing or corrupt."""
+    try:
+        with open(cache_file_path(name), "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable cache file {name}: {e}")
+        return {}
+
+
+def save_json_cache(name, data):
+    """Atomically write a JSON cache file."""
+    path = cache_file_path(name)
+    # Unique per writer thread, so subscribers sharing a process never clobber each other's temp file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w") as file:
+            json.dump(data, file, indent=4)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error(f"Failed to write cache file {name}: {e}")
+
+
+# ---------------------------------------------------
+# 🎞️ Media Cache
+# ---------------------------------------------------
+
+DEFAULT_MEDIA_CACHE_SETTINGS = {
+    "enabled": True,
+    "directory": "media",      # renditions live in ROOT_DIR/cache/<directory>
+    "max_size_mb": 2048,       # least recently played renditions are evicted beyond this
+    "nice": 10,                # background transcodes yield the CPU to live streams and PTZ commands
+    "prewarm": [],             # video files (or folders of them) transcoded in the background at startup
+    "encoding": {},            # overrides of MEDIA_RENDITION_PARAMS (part of the cache key)
+}
+
+MEDIA_CACHE_INDEX = "media_cache.json"
+MEDIA_EXTENSIONS = (".mp4", ".mkv", ".mov", ".avi", ".flv", ".ts", ".webm")
+
+# What start_on_demand_stream used to encode live on every play; a remux of the rendition looks the same to viewers
+MEDIA_RENDITION_PARAMS = {
+    "width": 1280,
+    "height": 720,
+    "video_bitrate": "800k",
+    "maxrate": "800k",
+    "bufsize": "1600k",
+    "preset": "veryfast",      # encoded once, so a slower preset than the live "ultrafast" buys quality at the same bitrate
+    "keyint": 50,              # regular keyframes, so viewers joining a remuxed stream don't wait for one
+    "audio_bitrate": "128k",
+}
+
+
+def encode_arguments(params):
+    """ffmpeg output options for H.264/AAC with the given rendition parameters."""
+    return [
+        "-c:v", "libx264", "-preset", params["preset"], "-b:v", params["video_bitrate"],
+        "-maxrate", params["maxrate"], "-bufsize", params["bufsize"], "-g", str(params["keyint"]),
+        "-vf", f"scale={params['width']}:{params['height']}", "-c:a", "aac", "-b:a", params["audio_bitrate"],
+    ] + (["-r", str(params["fps"])] if params.get("fps") else [])
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def rendition_key(source_sha256, params):
+    """Cache key: the source content plus every encoding parameter, so changed settings never reuse old files."""
+    material = json.dumps({"source": source_sha256, "params": params}, sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()[:32]
+
+
+def lower_process_priority(pid, nice):
+    """Renice a child from the parent (preexec_fn isn't safe in a process that runs threads)."""
+    if not nice:
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + int(nice))
+    except OSError as e:
+        logging.debug(f"Could not renice process {pid}: {e}")  # already exited, or not permitted
+
+
+class MediaCache:
+    """Content-addressed store of stream-ready renditions, so replaying a clip is a remux instead of an encode."""
+
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_MEDIA_CACHE_SETTINGS, **(settings or {}))
+        self.params = dict(MEDIA_RENDITION_PARAMS, **(self.settings.get("encoding") or {}))
+        self.directory = os.path.join(ROOT_DIR, "cache", self.settings["directory"])
+        self._lock = Lock()
+        self._index = None  # loaded on first use, keeps startup free of filesystem work
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._worker = None
+        self._process = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.transcodes = 0
+        self.failures = 0
+        self.evictions = 0
+
+    def _load(self):
+        """Index of source hashes and renditions; entries whose files are gone are dropped. Call with the lock held."""
+        if self._index is not None:
+            return self._index
+        os.makedirs(self.directory, exist_ok=True)
+        index = load_json_cache(MEDIA_CACHE_INDEX)
+        sources = {path: memo for path, memo in index.get("sources", {}).items() if os.path.exists(path)}
+        renditions = {
+            key: entry for key, entry in index.get("renditions", {}).items()
+            if os.path.exists(os.path.join(self.directory, entry["file"]))
+        }
+        # Leftovers of transcodes interrupted by a restart
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        self._index = {"sources": sources, "renditions": renditions}
+        return self._index
+
+    def _save(self):
+        save_json_cache(MEDIA_CACHE_INDEX, self._index)
+
+    def _source_hash(self, path, stat=None):
+        """SHA-256 remembered for this path, if the file hasn't changed since it was hashed. Call with the lock held."""
+        stat = stat or os.stat(path)
+        memo = self._index["sources"].get(path)
+        if memo and (memo["size"], memo["mtime_ns"], memo["inode"]) == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return memo["sha256"]
+        return None
+
+    def lookup(self, video_file):
+        """Path of a ready rendition of video_file, or None after queueing one. Never hashes or encodes inline."""
+        path = os.path.abspath(video_file)
+        with self._lock:
+            self._load()
+            digest = self._source_hash(path)
+            key = rendition_key(digest, self.params) if digest else None
+            entry = self._index["renditions"].get(key)
+            if entry:
+                rendition = os.path.join(self.directory, entry["file"])
+                if os.path.exists(rendition):
+                    entry["last_used"] = time.time()
+                    entry["plays"] = entry.get("plays", 0) + 1
+                    self.hits += 1
+                    self._save()
+                    return rendition
+                del self._index["renditions"][key]
+            self.misses += 1
+        self.schedule(path)
+        return None
+
+    def schedule(self, video_file):
+        """Queue a background transcode of video_file (no-op if one is already queued)."""
+        path = os.path.abspath(video_file)
+        with self._lock:
+            if path in self._pending:
+                return False
+            self._pending.add(path)
+        self._queue.put(path)
+        self.start()
+        return True
+
+    def prewarm(self, paths):
+        """Queue every video file among paths (folders are scanned one level deep)."""
+        scheduled = 0
+        for path in paths:
+            if os.path.isdir(path):
+                files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(MEDIA_EXTENSIONS))
+            else:
+                files = [path]
+            for file in files:
+                if os.path.isfile(file) and self.schedule(file):
+                    scheduled += 1
+        return scheduled
+
+    def start(self):
+        if self._worker and self._worker.is_alive():
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run, daemon=True, name="media-cache")
+        self._worker.start()
+
+    def stop(self, grace=3.0):
+        """Abort the running transcode (SIGKILL after grace seconds); its partial file is removed."""
+        self._stop.set()
+        self._queue.put(None)
+        terminate_processes([self._process], grace)
+
+    def _run(self):
+        while not self._stop.is_set():
+            path = self._queue.get()
+            if path is None:
+                break
+            try:
+                self._populate(path)
+            except Exception as e:
+                self.failures += 1
+                logging.error(f"Media cache: failed to prepare {path}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(path)
+
+    def _populate(self, path):
+        if not os.path.isfile(path):
+            return
+        stat = os.stat(path)
+        with self._lock:
+            self._load()
+            digest = self._source_hash(path, stat)
+        if digest is None:
+            digest = file_sha256(path)
+            with self._lock:
+                self._index["sources"][path] = {
+                    "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino, "sha256": digest,
+                }
+                self._save()
+
+        params = dict(self.params)
+        key = rendition_key(digest, params)
+        with self._lock:
+            # Same content under another name, or encoded while this was queued
+            if key in self._index["renditions"]:
+                return
+
+        output = os.path.join(self.directory, f"{key}.mp4")
+        tmp_output = f"{output}.{os.getpid()}.tmp"
+        ffmpeg_cmd = (
+            ["ffmpeg", "-nostdin", "-y", "-loglevel", "error", "-i", path] + encode_arguments(params)
+            + ["-movflags", "+faststart", "-f", "mp4", tmp_output]
+        )
+        print(f"🎞️ Media cache: transcoding {path}")
+        started = time.time()
+        self._process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        lower_process_priority(self._process.pid, max(0, int(self.settings["nice"])))
+        _, stderr = self._process.communicate()
+        returncode = self._process.returncode
+        self._process = None
+        if returncode != 0 or self._stop.is_set():
+            if os.path.exists(tmp_output):
+                os.remove(tmp_output)
+            if not self._stop.is_set():
+                self.failures += 1
+                logging.error(f"Media cache: ffmpeg failed for {path} ({returncode}): {stderr.decode(errors='replace').strip()[-500:]}")
+            return
+        os.replace(tmp_output, output)
+
+        size = os.path.getsize(output)
+        with self._lock:
+            self._index["renditions"][key] = {
+                "file": os.path.basename(output),
+                "size": size,
+                "source": path,
+                "source_sha256": digest,
+                "params": params,
+                "created": time.time(),
+                "last_used": time.time(),
+                "plays": 0,
+            }
+            self.transcodes += 1
+            self._evict(keep=key)
+            self._save()
+        print(f"✅ Media cache: {os.path.basename(path)} ready ({size / 1e6:.1f} MB, encoded in {time.time() - started:.0f}s)")
+
+    def _evict(self, keep=None):
+        """Remove least recently played renditions until the cache fits max_size_mb. Call with the lock held."""
+        budget = float(self.settings["max_size_mb"]) * 1024 * 1024
+        renditions = self._index["renditions"]
+        total = sum(entry["size"] for entry in renditions.values())
+        for key, entry in sorted(renditions.items(), key=lambda item: item[1]["last_used"]):
+            if total <= budget:
+                break
+            if key == keep:
+                continue
+            # A stream still playing it keeps its open file descriptor, so unlinking is safe
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except FileNotFoundError:
+                pass
+            del renditions[key]
+            total -= entry["size"]
+            self.evictions += 1
+            logging.info(f"Media cache: evicted rendition of {entry['source']} ({entry['size'] / 1e6:.1f} MB)")
+
+    def configure(self, settings):
+        """Apply new service_settings.media_cache; renditions made with other encoding settings age out via LRU."""
+        with self._lock:
+            self.settings = dict(DEFAULT_MEDIA_CACHE_SETTINGS, **(settings or {}))
+            self.params = dict(MEDIA_RENDITION_PARAMS, **(self.settings.get("encoding") or {}))
+            if self._index is not None:
+                self._evict()
+                self._save()
+
+    def snapshot(self):
+        with self._lock:
+            renditions = (self._index or {}).get("renditions", {})
+            return {
+                "renditions": len(renditions),
+                "size_mb": round(sum(entry["size"] for entry in renditions.values()) / 1024 / 1024, 1),
+                "max_size_mb": self.settings["max_size_mb"],
+                "pending": len(self._pending),
+                "hits": self.hits,
+                "misses": self.misses,
+                "transcodes": self.transcodes,
+                "failures": self.failures,
+                "evictions": self.evictions,
+            }
+
+
+# ---------------------------------------------------
+# 📺 On-demand Stream Slots
+# ---------------------------------------------------
+
+DEFAULT_STREAM_SLOT_SETTINGS = {
+    "max_streams": None,       # hard cap on concurrent on-demand streams; None = limited by CPU only
+    "reserved_cores": 1,       # cores left to this service, the camera service and the OS
+    "encode_cost": 1.0,        # cores a live libx264 encode needs
+    "remux_cost": 0.25,        # cores a remux of a cached rendition needs
+    "nice": 5,                 # encodes run below the subscriber so PTZ commands stay responsive
+    "pin_cores": True,         # give each encode its own core(s) instead of letting them pile onto one
+}
+
+
+def available_cores():
+    """CPUs this process may run on (cgroup/taskset aware where the platform supports it)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def process_cpu_seconds(pid):
+    """user+system CPU time of a child process from /proc, or None if unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+        return round((int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK"), 2)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StreamSlots:
+    """Admission and CPU placement for concurrent on-demand streams.
+
+    Capacity is the usable cores minus reserved_cores; an encode costs encode_cost cores and a remux
+    remux_cost, so a 4-core Pi runs three encodes (or many remuxes) side by side. Each encode is pinned
+    to the least loaded cores and all run at the same nice level, so the kernel shares CPU evenly.
+    """
+
+    def __init__(self, settings=None, cores=None):
+        self.configure(settings, cores)
+        self._slots = {}  # stream_id -> {"kind", "cost", "cores"}
+
+    def configure(self, settings=None, cores=None):
+        self.settings = dict(DEFAULT_STREAM_SLOT_SETTINGS, **(settings or {}))
+        cores = list(cores) if cores is not None else available_cores()
+        reserved = min(int(self.settings["reserved_cores"]), len(cores) - 1)
+        self.reserved = cores[:max(reserved, 0)]
+        self.pool = cores[len(self.reserved):]
+        # Always room for one encode, even on a single core
+        self.capacity = max(float(len(self.pool)), float(self.settings["encode_cost"]))
+
+    def used(self):
+        return sum(slot["cost"] for slot in self._slots.values())
+
+    def reserve(self, stream_id, kind):
+        """Claim a slot for a "encode" or "remux" stream; returns the slot, or None if the device is full."""
+        cost = float(self.settings["encode_cost"] if kind == "encode" else self.settings["remux_cost"])
+        max_streams = self.settings["max_streams"]
+        if max_streams is not None and len(self._slots) >= int(max_streams):
+            return None
+        if self.used() + cost > self.capacity + 1e-9:
+            return None
+
+        cores = None
+        if self.settings["pin_cores"] and kind == "encode" and self.pool:
+            load = {core: 0.0 for core in self.pool}
+            for slot in self._slots.values():
+                for core in slot["cores"] or self.pool:
+                    load[core] += slot["cost"] / len(slot["cores"] or self.pool)
+            count = min(len(self.pool), max(1, int(round(cost))))
+            cores = sorted(sorted(self.pool, key=lambda core: load[core])[:count])
+        elif self.settings["pin_cores"] and self.pool:
+            cores = list(self.pool)
+
+        slot = {"kind": kind, "cost": cost, "cores": cores, "nice": int(self.settings["nice"]) if kind == "encode" else 0}
+        self._slots[stream_id] = slot
+        return slot
+
+    def get(self, stream_id):
+        return self._slots.get(stream_id)
+
+    def release(self, stream_id):
+        self._slots.pop(stream_id, None)
+
+    def apply(self, slot, pid):
+        """Give a started ffmpeg its slot's nice level and CPU affinity (from the parent, not preexec_fn)."""
+        lower_process_priority(pid, slot["nice"])
+        if slot["cores"] and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(pid, slot["cores"])
+            except OSError as e:
+                # Already exited, or a core went offline since startup: it runs unpinned rather than not at all
+                logging.debug(f"Could not pin process {pid} to cores {slot['cores']}: {e}")
+
+    def snapshot(self):
+        return {
+            "capacity": self.capacity,
+            "used": round(self.used(), 2),
+            "streams": len(self._slots),
+            "max_streams": self.settings["max_streams"],
+            "reserved_cores": self.reserved,
+        }
+
+
+# ---------------------------------------------------
+# 🌡️ Streaming Governor
+# ---------------------------------------------------
+
+# Quality ladder, best first; fps None keeps the source/requested rate
+STREAM_QUALITY_LEVELS = [
+    {"name": "720p", "width": 1280, "height": 720, "fps": None, "video_bitrate": "800k"},
+    {"name": "540p", "width": 960, "height": 540, "fps": 15, "video_bitrate": "600k"},
+    {"name": "360p", "width": 640, "height": 360, "fps": 10, "video_bitrate": "350k"},
+]
+
+DEFAULT_STREAM_GOVERNOR_SETTINGS = {
+    "enabled": True,
+    "root": "/",                    # proc/stat and sys/class/thermal are read under this directory (a fake tree for tests)
+    "interval": 5.0,                # seconds between samples
+    "temp_high": 75.0,              # °C: step down at or above (the Pi firmware soft-throttles at 80)
+    "temp_low": 65.0,               # °C: step up only at or below
+    "temp_critical": 80.0,          # °C: drop straight to the lowest level
+    "cpu_high": 0.90,               # busy fraction of all cores: step down at or above
+    "cpu_low": 0.60,                # step up only at or below
+    "down_samples": 2,              # consecutive hot samples before stepping down
+    "up_samples": 6,                # consecutive cool samples before stepping up (slower, so it doesn't flap)
+    "min_hold": 30.0,               # seconds between two level changes
+    "levels": STREAM_QUALITY_LEVELS,
+    "restart_encodes": True,        # relaunch running live encodes at the new level, resuming where they were
+    "apply_to_live_streaming": True,  # cap streaming_fps of the camera stream service (restarts it)
+}
+
+
+def read_cpu_times(root="/"):
+    """(idle, total) jiffies of all CPUs from proc/stat."""
+    with open(os.path.join(root, "proc", "stat")) as file:
+        values = [int(value) for value in file.readline().split()[1:9]]
+    return values[3] + values[4], sum(values)
+
+
+def read_temperatures(root="/"):
+    """Temperature in °C of every thermal zone under sys/class/thermal, keyed by zone type."""
+    thermal_dir = os.path.join(root, "sys", "class", "thermal")
+    temperatures = {}
+    try:
+        zones = sorted(name for name in os.listdir(thermal_dir) if name.startswith("thermal_zone"))
+    except OSError:
+        return temperatures
+    for zone in zones:
+        try:
+            with open(os.path.join(thermal_dir, zone, "temp")) as file:
+                temperature = int(file.read().strip()) / 1000
+        except (OSError, ValueError):
+            continue
+        try:
+            with open(os.path.join(thermal_dir, zone, "type")) as file:
+                name = file.read().strip() or zone
+        except OSError:
+            name = zone
+        temperatures[name] = temperature
+    return temperatures
+
+
+class StreamGovernor:
+    """Step streaming quality down when the Pi runs hot or out of CPU, and back up once it has cooled.
+
+    Separate high/low thresholds, a number of consecutive samples and a minimum hold time between
+    changes keep it from flapping. Every change is passed to on_change(change).
+    """
+
+    def __init__(self, on_change, settings=None):
+        self.on_change = on_change
+        self.settings = dict(DEFAULT_STREAM_GOVERNOR_SETTINGS, **(settings or {}))
+        self.levels = self.settings["levels"]
+        self.level = 0
+        self.last_sample = None
+        self.changes = 0
+        self._hot = 0
+        self._cool = 0
+        self._last_change = 0.0
+        self._cpu_times = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def current(self):
+        return self.levels[self.level]
+
+    def apply(self, params):
+        """Encoding params (see encode_arguments) limited to the current level."""
+        level = self.current()
+        bitrate = level["video_bitrate"]
+        bufsize = f"{int(bitrate.rstrip('k')) * 2}k" if bitrate.endswith("k") else params["bufsize"]
+        return dict(params, width=level["width"], height=level["height"], fps=level["fps"],
+                    video_bitrate=bitrate, maxrate=bitrate, bufsize=bufsize)
+
+    def live_fps(self, requested_fps):
+        fps = self.current()["fps"]
+        return min(requested_fps, fps) if fps else requested_fps
+
+    def sample(self):
+        root = self.settings["root"]
+        cpu = None
+        try:
+            idle, total = read_cpu_times(root)
+            if self._cpu_times and total > self._cpu_times[1]:
+                cpu = round(1 - (idle - self._cpu_times[0]) / (total - self._cpu_times[1]), 3)
+            self._cpu_times = (idle, total)
+        except (OSError, ValueError, IndexError):
+            pass
+        temperatures = read_temperatures(root)
+        self.last_sample = {
+            "cpu": cpu,
+            "temperature": max(temperatures.values()) if temperatures else None,
+            "zones": temperatures,
+        }
+        return self.last_sample
+
+    def evaluate(self, sample, now=None):
+        """Feed one sample; returns the change dict if the level moved, else None."""
+        now = time.time() if now is None else now
+        settings = self.settings
+        temperature, cpu = sample["temperature"], sample["cpu"]
+        lowest = len(self.levels) - 1
+
+        reasons = []
+        if temperature is not None and temperature >= settings["temp_high"]:
+            reasons.append(f"temperature {temperature:.1f}°C")
+        if cpu is not None and cpu >= settings["cpu_high"]:
+            reasons.append(f"cpu {cpu:.0%}")
+        cool = (temperature is None or temperature <= settings["temp_low"]) and (cpu is None or cpu <= settings["cpu_low"])
+        self._hot = self._hot + 1 if reasons else 0
+        self._cool = self._cool + 1 if cool else 0
+
+        if temperature is not None and temperature >= settings["temp_critical"] and self.level < lowest:
+            return self._change(lowest, f"critical temperature {temperature:.1f}°C", sample, now)
+        if now - self._last_change < settings["min_hold"]:
+            return None
+        if reasons and self._hot >= settings["down_samples"] and self.level < lowest:
+            return self._change(self.level + 1, ", ".join(reasons), sample, now)
+        if cool and self._cool >= settings["up_samples"] and self.level > 0:
+            return self._change(self.level - 1, "cooled down", sample, now)
+        return None
+
+    def _change(self, level, reason, sample, now):
+        previous = self.current()["name"]
+        self.level = level
+        self.changes += 1
+        self._last_change = now
+        self._hot = self._cool = 0
+        return {"level": level, "previous": previous, "reason": reason, "cpu": sample["cpu"],
+                "temperature": sample["temperature"], **self.current()}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stream-governor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        self.sample()  # CPU load needs two readings
+        while not self._stop_event.wait(self.settings["interval"]):
+            change = self.evaluate(self.sample())
+            if change:
+                try:
+                    self.on_change(change)
+                except Exception as e:
+                    logging.error(f"Streaming governor change handler failed: {e}")
+
+    def snapshot(self):
+        return {"level": self.level, **self.current(), "changes": self.changes, "sample": self.last_sample}
+
+
+# ---------------------------------------------------
+# 🩺 RTSP Stream Probing
+# ---------------------------------------------------
+
+DEFAULT_STREAM_PROBE_SETTINGS = {
+    "enabled": True,
+    "interval": 300,           # seconds between scheduled probes of every source
+    "duration": 5,             # seconds of stream sampled per probe
+    "open_timeout": 10,        # extra seconds allowed to connect before the probe counts as failed
+    "rtsp_transport": "tcp",
+    "nice": 10,
+    "history": 12,             # results kept per source for get_stream_probes
+    "verify_delay": 10,        # seconds after set_fpsbr before probing (cameras restart the encoder)
+    "sources": {},             # extra name -> URL to probe besides default_arguments.default_video_source
+}
+
+
+def redact_url(url):
+    """URL with the password replaced, safe to log and publish."""
+    return re.sub(r"//([^/:@]*):[^/]*@", r"//\1:***@", url or "")
+
+
+def frame_rate(value):
+    """ffprobe's "25/1" -> 25.0"""
+    try:
+        numerator, _, denominator = str(value).partition("/")
+        return round(float(numerator) / float(denominator or 1), 2)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def summarize_probe(data, wall_time):
+    """Measured fps, bitrate and keyframe interval from ffprobe's packet list (video packets only).
+
+    ffprobe doesn't decode, so this is cheap. Packets of a live source arrive in real time, so wall
+    time not covered by packet timestamps is the startup latency (connect, DESCRIBE/SETUP, first keyframe).
+    """
+    stream = (data.get("streams") or [{}])[0]
+    packets = [packet for packet in data.get("packets", []) if packet.get("pts_time") not in (None, "N/A")]
+    times = sorted(float(packet["pts_time"]) for packet in packets)
+    span = times[-1] - times[0] if len(times) > 1 else 0.0
+    keyframes = sorted(float(packet["pts_time"]) for packet in packets if "K" in packet.get("flags", ""))
+    keyframe_gaps = [later - earlier for earlier, later in zip(keyframes, keyframes[1:])]
+
+    result = {
+        "codec": stream.get("codec_name"),
+        "width": stream.get("width"),
+        "height": stream.get("height"),
+        "nominal_fps": frame_rate(stream.get("avg_frame_rate") or stream.get("r_frame_rate")),
+        "frames": len(packets),
+        "fps": round((len(times) - 1) / span, 2) if span else None,
+        "bitrate_kbps": round(sum(int(packet.get("size", 0)) for packet in packets) * 8 / span / 1000, 1) if span else None,
+        "keyframe_interval": round(sum(keyframe_gaps) / len(keyframe_gaps), 2) if keyframe_gaps else None,
+        "startup_s": round(max(0.0, wall_time - span), 2),
+    }
+    if result["keyframe_interval"] and result["fps"]:
+        result["gop_frames"] = round(result["keyframe_interval"] * result["fps"])
+    return result
+
+
+def check_probe(result, expected):
+    """Compare a probe with what the encoder is configured for; {check: passed}."""
+    checks = {}
+    if expected.get("fps") and result.get("fps"):
+        checks["fps"] = abs(result["fps"] - expected["fps"]) <= max(1.0, 0.1 * expected["fps"])
+    if expected.get("width") and result.get("width"):
+        checks["resolution"] = (result["width"], result["height"]) == (expected["width"], expected["height"])
+    if expected.get("bitrate_kbps") and result.get("bitrate_kbps"):
+        # VBR overshoots briefly; a stream well above the limit means the SET didn't take
+        checks["bitrate"] = result["bitrate_kbps"] <= expected["bitrate_kbps"] * 1.25
+    if expected.get("gop_frames") and result.get("gop_frames"):
+        checks["keyframe_interval"] = abs(result["gop_frames"] - expected["gop_frames"]) <= 1
+    return checks
+
+
+class StreamProber:
+    """Sample each camera stream with ffprobe on a schedule (or on request) and keep the results in memory.
+
+    get_sources() returns {name: url} and get_expected(name) the configured encoder values (or None),
+    both read on every probe so config reloads and set_fpsbr are picked up. on_result(name, result, reason)
+    is called after every probe.
+    """
+
+    def __init__(self, get_sources, get_expected, on_result, settings=None):
+        self.get_sources = get_sources
+        self.get_expected = get_expected
+        self.on_result = on_result
+        self.settings = dict(DEFAULT_STREAM_PROBE_SETTINGS, **(settings or {}))
+        self.latest = {}
+        self.history = {}
+        self.probes = 0
+        self.failures = 0
+        self._requests = []  # (due, name or None for all, reason)
+        self._lock = Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._process = None
+
+    def request(self, name=None, reason="command", delay=0):
+        """Probe one source (or all) from the prober thread, `delay` seconds from now."""
+        with self._lock:
+            self._requests.append((time.time() + delay, name, reason))
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stream-prober", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        self._wake.set()
+        process = self._process
+        if process and process.poll() is None:
+            process.kill()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        next_scheduled = time.time()
+        while not self._stop_event.is_set():
+            now = time.time()
+            with self._lock:
+                due = [request for request in self._requests if request[0] <= now]
+                self._requests = [request for request in self._requests if request[0] > now]
+                next_request = min((request[0] for request in self._requests), default=None)
+            if now >= next_scheduled:
+                due.append((now, None, "scheduled"))
+                next_scheduled = now + float(self.settings["interval"])
+
+            for _, name, reason in due:
+                sources = self.get_sources()
+                for source_name, url in sources.items():
+                    if self._stop_event.is_set():
+                        return
+                    if name is None or name == source_name:
+                        self._probe_source(source_name, url, reason)
+
+            wake_at = min(next_scheduled, next_request) if next_request else next_scheduled
+            self._wake.wait(max(0.0, wake_at - time.time()))
+            self._wake.clear()
+
+    def probe(self, url):
+        """Run ffprobe on url for `duration` seconds; returns the summary, or {"error": ...}."""
+        duration = float(self.settings["duration"])
+        ffprobe_cmd = ["ffprobe", "-v", "error"]
+        if url.startswith("rtsp"):
+            ffprobe_cmd += ["-rtsp_transport", self.settings["rtsp_transport"]]
+        ffprobe_cmd += [
+            "-read_intervals", f"%+{duration:g}", "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,size,flags:stream=codec_name,width,height,avg_frame_rate,r_frame_rate",
+            "-of", "json", url,
+        ]
+        started = time.monotonic()
+        try:
+            self._process = subprocess.Popen(ffprobe_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            lower_process_priority(self._process.pid, max(0, int(self.settings["nice"])))
+            stdout, stderr = self._process.communicate(timeout=duration + float(self.settings["open_timeout"]))
+        except FileNotFoundError:
+            return {"error": "ffprobe not installed"}
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.communicate()
+            return {"error": f"no data within {duration + float(self.settings['open_timeout']):g}s"}
+        finally:
+            wall_time = time.monotonic() - started
+        returncode, self._process = self._process.returncode, None
+
+        try:
+            data = json.loads(stdout or b"{}")
+        except ValueError:
+            data = {}
+        if not data.get("packets"):
+            message = stderr.decode(errors="replace").strip().replace(url, redact_url(url))
+            return {"error": message[-300:] or f"ffprobe exited with code {returncode}"}
+        return summarize_probe(data, wall_time)
+
+    def _probe_source(self, name, url, reason):
+        result = dict(self.probe(url), source=redact_url(url), at=time.time(), reason=reason)
+        if self._stop_event.is_set():
+            return  # killed by stop(), not a camera problem
+        expected = self.get_expected(name) if not result.get("error") else None
+        if expected:
+            result["expected"] = expected
+            result["checks"] = check_probe(result, expected)
+        result["ok"] = not result.get("error") and all(result.get("checks", {}).values())
+
+        with self._lock:
+            self.probes += 1
+            if result.get("error"):
+                self.failures += 1
+            self.latest[name] = result
+            self.history.setdefault(name, deque(maxlen=int(self.settings["history"]))).append(result)
+        try:
+            self.on_result(name, result, reason)
+        except Exception as e:
+            logging.error(f"Stream probe handler failed: {e}")
+
+    def snapshot(self):
+        """Latest result per source, without the per-probe details (for the status snapshot)."""
+        keys = ("ok", "error", "fps", "bitrate_kbps", "keyframe_interval", "startup_s", "width", "height", "at")
+        with self._lock:
+            return {name: {key: result[key] for key in keys if key in result} for name, result in self.latest.items()}
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "probes": self.probes,
+                "failures": self.failures,
+                "sources": {name: list(results) for name, results in self.history.items()},
+            }
+
+
+# ---------------------------------------------------
+# 🧭 PTZ Capability Discovery
+# ---------------------------------------------------
+
+PTZ_CAPABILITIES_CACHE = "ptz_capabilities.json"
+
+# ONVIF space element -> key used in the capability dict
+PTZ_SPACE_KEYS = {
+    "ContinuousPanTiltVelocitySpace": "continuous_pan_tilt",
+    "ContinuousZoomVelocitySpace": "continuous_zoom",
+    "AbsolutePanTiltPositionSpace": "absolute_pan_tilt",
+    "AbsoluteZoomPositionSpace": "absolute_zoom",
+    "RelativePanTiltTranslationSpace": "relative_pan_tilt",
+    "RelativeZoomTranslationSpace": "relative_zoom",
+    "PanTiltSpeedSpace": "pan_tilt_speed",
+    "ZoomSpeedSpace": "zoom_speed",
+}
+
+
+def _range_to_list(value_range):
+    """Convert an ONVIF FloatRange/DurationRange into a JSON friendly [min, max]."""
+    if value_range is None:
+        return None
+    bounds = []
+    for bound in (value_range.Min, value_range.Max):
+        bounds.append(bound.total_seconds() if hasattr(bound, "total_seconds") else float(bound))
+    return bounds
+
+
+def _parse_ptz_spaces(spaces):
+    """Extract the first space of each kind with its ranges from a PTZSpaces object."""
+    parsed = {}
+    if spaces is None:
+        return parsed
+
+    for element, key in PTZ_SPACE_KEYS.items():
+        space_list = getattr(spaces, element, None)
+        if not space_list:
+            continue
+        space = space_list[0]
+        parsed[key] = {
+            "uri": getattr(space, "URI", None),
+            "x": _range_to_list(getattr(space, "XRange", None)),
+            "y": _range_to_list(getattr(space, "YRange", None)),
+        }
+    return parsed
+
+
+def discover_ptz_capabilities(ptz_service, media_profile):
+    """Query GetNodes, GetConfigurationOptions and GetServiceCapabilities once and summarize them."""
+    ptz_configuration = getattr(media_profile, "PTZConfiguration", None)
+    node_token = getattr(ptz_configuration, "NodeToken", None)
+
+    nodes = ptz_service.GetNodes() or []
+    node = next((n for n in nodes if n.token == node_token), nodes[0] if nodes else None)
+    spaces = _parse_ptz_spaces(getattr(node, "SupportedPTZSpaces", None))
+
+    timeout_range = None
+    if ptz_configuration is not None:
+        try:
+            options = ptz_service.GetConfigurationOptions({"ConfigurationToken": ptz_configuration.token})
+            # The configuration may narrow what the node supports
+            spaces.update(_parse_ptz_spaces(getattr(options, "Spaces", None)))
+            timeout_range = _range_to_list(getattr(options, "PTZTimeout", None))
+        except Exception as e:
+            logging.warning(f"GetConfigurationOptions failed, using node spaces only: {e}")
+
+    service = {}
+    try:
+        service_capabilities = ptz_service.GetServiceCapabilities()
+        for attribute in ("EFlip", "Reverse", "GetCompatibleConfigurations", "MoveStatus", "StatusPosition"):
+            service[attribute] = bool(getattr(service_capabilities, attribute, False))
+    except Exception as e:
+        logging.warning(f"GetServiceCapabilities failed: {e}")
+
+    move_types = [
+        move_type for move_type in ("continuous", "absolute", "relative")
+        if f"{move_type}_pan_tilt" in spaces or f"{move_type}_zoom" in spaces
+    ]
+
+    preset_tour = getattr(getattr(node, "Extension", None), "SupportedPresetTour", None)
+
+    return {
+        "node_token": getattr(node, "token", None),
+        "spaces": spaces,
+        "move_types": move_types,
+        "max_presets": getattr(node, "MaximumNumberOfPresets", None),
+        "home_supported": bool(getattr(node, "HomeSupported", False)),
+        "preset_tours": {
+            "max": getattr(preset_tour, "MaximumNumberOfPresetTours", 0) or 0,
+            "operations": list(getattr(preset_tour, "PTZPresetTourOperation", None) or []),
+        },
+        "timeout_range": timeout_range,
+        "service": service,
+        "discovered_at": time.time(),
+    }
+
+
+def clamp(value, value_range):
+    """Clamp a value to a [min, max] range (no-op when the range is unknown)."""
+    if not value_range:
+        return value
+    return max(value_range[0], min(value, value_range[1]))
+
+
+def scale_to_range(fraction, value_range):
+    """Map a -1..1 fraction onto a camera's [min, max] range, keeping 0 at 0."""
+    fraction = max(-1.0, min(fraction, 1.0))
+    if not value_range:
+        return fraction
+    return fraction * value_range[1] if fraction >= 0 else -fraction * value_range[0]
+
+
+# ---------------------------------------------------
+# 📍 PTZ Position Model
+# ---------------------------------------------------
+
+PTZ_AXES = ("pan", "tilt", "zoom")
+
+# Default travel speed (normalized units per second at full velocity) used for dead reckoning
+DEFAULT_PTZ_SPEED = {"pan": 0.5, "tilt": 0.5, "zoom": 0.5}
+
+
+class PositionModel:
+    """Last known PTZ position, anchored by GetStatus and dead-reckoned between polls."""
+
+    def __init__(self, speeds=None, limits=None):
+        self._lock = Lock()
+        self.speeds = dict(DEFAULT_PTZ_SPEED, **(speeds or {}))
+        self.limits = limits or {}
+        self.anchor = None          # position reported by the camera (or last estimate)
+        self.anchored_at = None     # time.monotonic() of the anchor
+        self.velocity = None        # continuous move, fraction of full speed per axis
+        self.target = None          # absolute/relative move destination
+        self.target_speed = 1.0
+        self.source = None          # "status" or "estimate"
+
+    def _advance(self, now):
+        """Project the anchor forward to `now` (caller holds the lock)."""
+        if self.anchor is None:
+            return None
+        elapsed = now - self.anchored_at
+        position = dict(self.anchor)
+
+        for axis in PTZ_AXES:
+            if self.velocity:
+                position[axis] += self.velocity.get(axis, 0.0) * self.speeds[axis] * elapsed
+            elif self.target and self.target.get(axis) is not None:
+                step = self.speeds[axis] * self.target_speed * elapsed
+                delta = self.target[axis] - position[axis]
+                position[axis] += max(-step, min(delta, step))
+            position[axis] = clamp(position[axis], self.limits.get(axis))
+        return position
+
+    def _rebase(self, now):
+        """Fold the projected movement into the anchor before changing motion state."""
+        position = self._advance(now)
+        if position is not None:
+            self.anchor = position
+            self.anchored_at = now
+            self.source = "estimate"
+
+    def update_from_status(self, pan, tilt, zoom, moving=None):
+        """Anchor the model to a position reported by GetStatus (moving=None: camera didn't say)."""
+        with self._lock:
+            self.anchor = {"pan": pan, "tilt": tilt, "zoom": zoom}
+            self.anchored_at = time.monotonic()
+            self.source = "status"
+            if moving is False:
+                self.velocity = None
+                self.target = None
+
+    def start_continuous(self, pan, tilt, zoom):
+        """Record a ContinuousMove with per-axis velocity fractions."""
+        with self._lock:
+            self._rebase(time.monotonic())
+            self.velocity = {"pan": pan, "tilt": tilt, "zoom": zoom}
+            self.target = None
+
+    def move_to(self, pan=None, tilt=None, zoom=None, speed=1.0):
+        """Record an absolute move towards a target (None keeps the axis where it is)."""
+        with self._lock:
+            self._rebase(time.monotonic())
+            self.velocity = None
+            self.target = {"pan": pan, "tilt": tilt, "zoom": zoom}
+            self.target_speed = speed or 1.0
+
+    def stop(self):
+        """Freeze the estimate where the camera is expected to have stopped."""
+        with self._lock:
+            self._rebase(time.monotonic())
+            self.velocity = None
+            self.target = None
+
+    def invalidate(self):
+        """Forget the position (e.g. after GotoPreset to an unknown location)."""
+        with self._lock:
+            self.anchor = None
+            self.velocity = None
+            self.target = None
+            self.source = None
+
+    def estimate(self):
+        """Return the current position estimate without touching the camera (None if unknown)."""
+        with self._lock:
+            now = time.monotonic()
+            position = self._advance(now)
+            if position is None:
+                return None
+            moving = bool(self.velocity and any(self.velocity.values()))
+            if self.target:
+                moving = any(
+                    self.target.get(axis) is not None and abs(self.target[axis] - position[axis]) > 1e-3
+                    for axis in PTZ_AXES
+                )
+            position.update({
+                "moving": moving,
+                "source": self.source if not moving else "estimate",
+                "age": round(now - self.anchored_at, 3),
+            })
+            return position
+
+
+# ---------------------------------------------------
+# 📌 Preset Table
+# ---------------------------------------------------
+
+DEFAULT_PRESET_RECONCILE_INTERVAL = 3600  # seconds between scheduled GetPresets reconciliations
+
+
+def _preset_position(preset):
+    """Extract {"pan", "tilt", "zoom"} from an ONVIF PTZPreset, or None."""
+    position = getattr(preset, "PTZPosition", None)
+    if position is None:
+        return None
+    pan_tilt = getattr(position, "PanTilt", None)
+    zoom = getattr(position, "Zoom", None)
+    return {
+        "pan": float(pan_tilt.x) if pan_tilt is not None else 0.0,
+        "tilt": float(pan_tilt.y) if pan_tilt is not None else 0.0,
+        "zoom": float(zoom.x) if zoom is not None else 0.0,
+    }
+
+
+class PresetTable:
+    """Cached name -> token table for one camera, reconciled with GetPresets incrementally."""
+
+    def __init__(self, saved_presets=None):
+        self._lock = Lock()
+        # Local presets in configuration order: name -> token
+        self.presets = {p["name"]: str(p["token"]) for p in (saved_presets or []) if "name" in p and "token" in p}
+        # What the camera reported last time: token -> {"name", "position"}
+        self.camera_presets = {}
+        self.reconciled_at = None
+
+    def token_for(self, name):
+        with self._lock:
+            return self.presets.get(name)
+
+    def names(self):
+        with self._lock:
+            return list(self.presets)
+
+    def position_for(self, name):
+        """PTZ coordinates of a preset as last reported by the camera (None if unknown)."""
+        with self._lock:
+            token = self.presets.get(name)
+            entry = self.camera_presets.get(token)
+            return entry["position"] if entry else None
+
+    def camera_token_for(self, name):
+        """Token of a preset that exists on the camera under this name (even if not saved locally)."""
+        with self._lock:
+            # Tokens already bound to another local name are not up for adoption
+            bound = set(self.presets.values())
+            return next((token for token, entry in self.camera_presets.items()
+                         if entry["name"] == name and token not in bound), None)
+
+    def as_list(self):
+        with self._lock:
+            return [{"name": name, "token": token} for name, token in self.presets.items()]
+
+    def reconcile(self, camera_presets):
+        """Apply a GetPresets result. Drops local presets whose token vanished; returns True if changed."""
+        with self._lock:
+            self.camera_presets = {
+                str(p.token): {"name": p.Name, "position": _preset_position(p)} for p in camera_presets or []
+            }
+            self.reconciled_at = time.monotonic()
+            # Tokens are the identity on the camera, local names may differ after a rename
+            kept = {name: token for name, token in self.presets.items() if token in self.camera_presets}
+            changed = len(kept) != len(self.presets)
+            self.presets = kept
+            return changed
+
+    def add(self, name, token, position=None):
+        with self._lock:
+            token = str(token)
+            self.presets[name] = token
+            entry = self.camera_presets.setdefault(token, {"name": name, "position": position})
+            if position is not None:
+                entry["position"] = position
+
+    def remove(self, name):
+        with self._lock:
+            token = self.presets.pop(name, None)
+            if token is not None:
+                self.camera_presets.pop(token, None)
+            return token
+
+    def rename(self, old_name, new_name):
+        with self._lock:
+            if old_name not in self.presets or new_name in self.presets:
+                return False
+            # Rebuild to keep configuration order stable
+            self.presets = {new_name if name == old_name else name: token for name, token in self.presets.items()}
+            entry = self.camera_presets.get(self.presets[new_name])
+            if entry is not None:
+                entry["name"] = new_name
+            return True
+
+    def is_due(self, interval):
+        return self.reconciled_at is None or time.monotonic() - self.reconciled_at >= interval
+
+
+# ---------------------------------------------------
+# 🚦 Command Rate Limiting
+# ---------------------------------------------------
+
+# Rate limit class of every command; "priority" commands bypass queues and limits
+COMMAND_CLASSES = {
+    "stop_ptz": "priority",
+    "stop_patrol": "priority",
+    "stop_stream": "priority",
+    "stop_on_demand_stream": "priority",
+    "move": "motion",
+    "move_absolute": "motion",
+    "move_relative": "motion",
+    "go-to-preset": "motion",
+    "create_preset": "presets",
+    "create_presets": "presets",
+    "delete_presets": "presets",
+    "rename_presets": "presets",
+    "start_patrol": "patrol",
+    "set_fpsbr": "encoder",
+    "set_time": "encoder",
+    "start_stream": "streams",
+    "start_on_demand_stream": "streams",
+    "cache_media": "streams",
+    "update_configuration": "system",
+    "test": "query",
+    "get_position": "query",
+    "refresh_ptz_capabilities": "query",
+    "get_command_metrics": "query",
+    "profile": "query",
+    "get_on_demand_streams": "query",
+    "probe_stream": "query",
+    "get_stream_probes": "query",
+    "get_status": "priority",   # answered from memory, never worth queueing
+}
+
+# Queued commands a priority command makes obsolete (a move queued before a stop must not run after it)
+PRIORITY_CANCELS = {
+    "stop_ptz": ["motion"],
+    "stop_patrol": ["patrol"],
+}
+
+DEFAULT_COMMAND_LIMITS = {
+    "enabled": False,
+    "queue_size": 50,     # pending commands per camera before new ones are rejected
+    "max_delay": 2.0,     # seconds a command may wait for a token before it is rejected instead
+    "ack": "limited",     # "limited": ack delayed/rejected commands only, "all": every command, "none"
+    "classes": {
+        "motion": {"rate": 10, "burst": 20},
+        "presets": {"rate": 1, "burst": 5},
+        "patrol": {"rate": 0.5, "burst": 2},
+        "encoder": {"rate": 0.2, "burst": 2},
+        "streams": {"rate": 0.5, "burst": 4},
+        "query": {"rate": 5, "burst": 10},
+        "system": {"rate": 0.1, "burst": 2},
+    },
+}
+
+
+def merge_command_limits(*overrides):
+    """Merge command limit settings (service-wide, then per camera) over the defaults."""
+    limits = copy.deepcopy(DEFAULT_COMMAND_LIMITS)
+    for override in overrides:
+        for key, value in (override or {}).items():
+            if key == "classes":
+                for command_class, bucket in value.items():
+                    limits["classes"][command_class] = dict(limits["classes"].get(command_class, {}), **bucket)
+            else:
+                limits[key] = value
+    return limits
+
+
+class TokenBucket:
+    """Token bucket that hands out future tokens, so callers learn how long to wait."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+
+    def reserve(self, max_delay):
+        """Take a token; return the delay before it may be used, or None if that exceeds max_delay."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        delay = (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+        if delay > max_delay:
+            return None
+        self.tokens -= 1
+        return delay
+
+
+class CommandScheduler:
+    """Per-camera command queue with token-bucket limits per command class and a priority lane.
+
+    Queued commands run one at a time on a worker thread, or on an AsyncRuntime's event loop once
+    use_runtime() is called (then every command is queued, even with limits disabled).
+    """
+
+    def __init__(self, settings, publish_ack):
+        self.settings = settings
+        self.publish_ack = publish_ack
+        self.enabled = bool(settings.get("enabled"))
+        self.buckets = {
+            command_class: TokenBucket(bucket["rate"], bucket["burst"])
+            for command_class, bucket in settings["classes"].items()
+        }
+        self._lock = Lock()
+        self._queue = []            # [(due, sequence, command, command_class, handler)] in arrival order
+        self._sequence = itertools.count()
+        self._in_flight = None      # queue item the worker is executing right now
+        self._repeat = []           # [(command, handler)] priority commands to run again once it returns
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.runtime = None         # AsyncRuntime whose loop runs the commands instead of _thread
+        self._task = None
+        self._loop_wake = None
+        self.metrics = {}
+        self.queue_high_watermark = 0
+
+    def use_runtime(self, runtime):
+        """Run commands on an AsyncRuntime: priority ones as loop tasks, the queue as one task per camera."""
+        self.runtime = runtime
+        self._loop_wake = asyncio.Event()
+
+    def configure(self, settings):
+        """Swap in new limits (config hot reload); queued commands keep their reserved slots."""
+        with self._lock:
+            self.settings = settings
+            self.enabled = bool(settings.get("enabled"))
+            self.buckets = {
+                command_class: TokenBucket(bucket["rate"], bucket["burst"])
+                for command_class, bucket in settings["classes"].items()
+            }
+
+    def _count(self, command_class, outcome, amount=1):
+        counters = self.metrics.setdefault(command_class, {})
+        counters[outcome] = counters.get(outcome, 0) + amount
+
+    def _ack(self, command, command_class, status, **details):
+        ack_mode = self.settings.get("ack", "limited")
+        if ack_mode == "none" or (ack_mode == "limited" and status in ("accepted", "bypassed")):
+            return
+        self.publish_ack(dict({"type": "command_ack", "command": command, "class": command_class, "status": status}, **details))
+
+    def submit(self, command, handler):
+        """Run, queue, delay or reject a command according to its class limits."""
+        command_class = COMMAND_CLASSES.get(command, "system")
+
+        if command_class == "priority":
+            cancels = PRIORITY_CANCELS.get(command, [])
+            with self._lock:
+                self._count(command_class, "bypassed")
+                cancelled = self._cancel_queued(cancels)
+                if self._in_flight and self._in_flight[3] in cancels:
+                    # The running command may still send its request after ours (e.g. a move stuck in a
+                    # slow SOAP call would land after the Stop), so run this again once it returns
+                    self._repeat.append((command, handler))
+            if cancelled:
+                logging.info(f"🚦 {command} cancelled {len(cancelled)} queued command(s)")
+                for queued_command, queued_class in cancelled:
+                    self._ack(queued_command, queued_class, "cancelled", reason=f"superseded by {command}")
+            self._ack(command, command_class, "bypassed")
+            if self.runtime:
+                self.runtime.spawn_command(command, handler)
+            else:
+                handler()
+            return
+
+        if not self.enabled:
+            if self.runtime is None:
+                handler()
+                return
+            # On the event loop, commands still run one at a time per camera, in arrival order
+            with self._lock:
+                self._queue.append((time.monotonic(), next(self._sequence), command, command_class, handler))
+                self._ensure_worker()
+            self._notify()
+            return
+
+        with self._lock:
+            if len(self._queue) >= self.settings["queue_size"]:
+                self._count(command_class, "rejected")
+                rejection = {"reason": "queue_full"}
+            else:
+                bucket = self.buckets.get(command_class)
+                delay = bucket.reserve(self.settings["max_delay"]) if bucket else 0.0
+                if delay is None:
+                    self._count(command_class, "rejected")
+                    rejection = {"reason": "rate_limited", "retry_after": round(1 / bucket.rate, 3) if bucket.rate else None}
+                else:
+                    rejection = None
+                    self._count(command_class, "delayed" if delay > 0 else "accepted")
+                    self._queue.append((time.monotonic() + delay, next(self._sequence), command, command_class, handler))
+                    self.queue_high_watermark = max(self.queue_high_watermark, len(self._queue))
+                    self._ensure_worker()
+
+        if rejection:
+            logging.warning(f"🚦 Rejected {command} ({command_class}): {rejection['reason']}")
+            self._ack(command, command_class, "rejected", **rejection)
+            return
+        self._notify()
+        self._ack(command, command_class, "delayed" if delay > 0 else "accepted", delay=round(delay, 3))
+
+    def _cancel_queued(self, command_classes):
+        """Drop queued commands of the given classes (caller holds the lock)."""
+        if not command_classes:
+            return []
+        kept, cancelled = [], []
+        for item in self._queue:
+            (cancelled if item[3] in command_classes else kept).append(item)
+        self._queue = kept
+        for item in cancelled:
+            self._count(item[3], "cancelled")
+        return [(item[2], item[3]) for item in cancelled]
+
+    def _notify(self):
+        self._wake_event.set()
+        if self.runtime:
+            self.runtime.call_in_loop(self._loop_wake.set)
+
+    def _ensure_worker(self):
+        if self.runtime:
+            # submit() runs on the loop thread in this mode (paho's callbacks are driven by the loop)
+            if self._task is None or self._task.done():
+                self._stop_event.clear()
+                self._task = self.runtime.spawn(self._run_async())
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="command-worker", daemon=True)
+        self._thread.start()
+
+    def _next_item(self):
+        """The oldest due command, FIFO within each class (caller holds the lock).
+
+        Returns (item, None), or (None, seconds until the next one is due). A class waiting for its
+        token doesn't hold back the others.
+        """
+        heads, seen = [], set()
+        for item in self._queue:
+            if item[3] not in seen:
+                seen.add(item[3])
+                heads.append(item)
+        if not heads:
+            return None, 1.0
+        now = time.monotonic()
+        due = [item for item in heads if item[0] <= now]
+        if due:
+            return min(due, key=lambda item: item[1]), None
+        return None, min(item[0] for item in heads) - now
+
+    def _take(self):
+        """Claim the next due command as in flight; returns (item, None) or (None, seconds to wait)."""
+        with self._lock:
+            item, wait = self._next_item()
+            if item is not None:
+                self._queue.remove(item)
+                self._in_flight = item
+            return item, wait
+
+    def _finish(self):
+        """Clear the in-flight command; returns the priority commands to repeat after it."""
+        with self._lock:
+            self._in_flight = None
+            repeat, self._repeat = self._repeat, []
+        for command, _ in repeat:
+            logging.info(f"🚦 Repeating {command} after the in-flight command")
+        return repeat
+
+    def _run(self):
+        """Execute queued commands one at a time, in arrival order among those whose token is due."""
+        while not self._stop_event.is_set():
+            item, wait = self._take()
+            if item is None:
+                # Woken early by new commands, or when a priority command cancels queued ones
+                self._wake_event.wait(timeout=wait)
+                self._wake_event.clear()
+                continue
+
+            try:
+                item[4]()
+            except Exception as e:
+                logging.error(f"Error executing {item[2]}: {e}")
+            finally:
+                repeat = self._finish()
+            for command, handler in repeat:
+                try:
+                    handler()
+                except Exception as e:
+                    logging.error(f"Error executing {command}: {e}")
+
+    async def _run_async(self):
+        """_run for the event loop: handlers go to the runtime's executor, one at a time per camera."""
+        while not self._stop_event.is_set():
+            self._loop_wake.clear()
+            item, wait = self._take()
+            if item is None:
+                try:
+                    await asyncio.wait_for(self._loop_wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                # Returns only once the handler has really finished, even past the command timeout
+                await self.runtime.execute(item[2], item[4])
+            finally:
+                repeat = self._finish()
+            for command, handler in repeat:
+                await self.runtime.execute(command, handler)
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._task is not None:
+            try:
+                self.runtime.call_in_loop(self._task.cancel)
+            except RuntimeError:
+                pass  # event loop already closed
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    def queued(self):
+        with self._lock:
+            return len(self._queue)
+
+    def snapshot(self):
+        """Counters per command class plus queue state."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "queued": len(self._queue),
+                "in_flight": self._in_flight[2] if self._in_flight else None,
+                "queue_high_watermark": self.queue_high_watermark,
+                "classes": copy.deepcopy(self.metrics),
+            }
+
+
+# ---------------------------------------------------
+# 🗂️ Command Registry
+# ---------------------------------------------------
+
+NUMBER = "number"          # int/float or a numeric string, handed over as int when integral, else float
+BOOLEAN = "boolean"        # true/false or 0/1
+NAME = "name"              # preset/profile names and tokens: string or integer
+REQUIRED = object()        # default marker for parameters that must be present
+WHOLE_PAYLOAD = None       # the handler takes the payload dict itself
+
+# command -> (MQTTSubscriber method, [(parameter, type, default)]); a missing parameter gets its default,
+# an explicit null is passed through as None like before
+COMMAND_SPECS = {
+    "move": ("move_camera", [("pan", NUMBER, 0), ("tilt", NUMBER, 0), ("zoom", NUMBER, 0), ("velocity", NUMBER, 0.5)]),
+    "stop_ptz": ("stop_camera", []),
+    "test": ("testing_function", []),
+    "create_preset": ("create_preset", [("preset_name", NAME, REQUIRED)]),
+    "go-to-preset": ("move_to_preset", [("preset_name", NAME, REQUIRED)]),
+    "start_patrol": ("start_patrol", [("presets", list, []), ("dwell_time", NUMBER, None),
+                                      ("use_camera_tour", BOOLEAN, True), ("optimize_route", BOOLEAN, False)]),
+    "stop_patrol": ("stop_patrol", []),
+    "set_fpsbr": ("set_fpsbr", [("fps", NUMBER, None), ("width", NUMBER, None), ("height", NUMBER, None),
+                                ("BitrateLimit", NUMBER, None)]),
+    "set_time": ("set_time", [("timezone", str, "UTC"), ("ntp_server", str, "pool.ntp.org")]),
+    "update_configuration": ("update_local_config", [("sensor_id", NAME, None)]),
+    "refresh_ptz_capabilities": ("refresh_ptz_capabilities", []),
+    "move_absolute": ("move_absolute", [("pan", NUMBER, None), ("tilt", NUMBER, None), ("zoom", NUMBER, None),
+                                        ("speed", NUMBER, None)]),
+    "move_relative": ("move_relative", [("pan", NUMBER, None), ("tilt", NUMBER, None), ("zoom", NUMBER, None),
+                                        ("speed", NUMBER, None)]),
+    "get_position": ("report_position", [("refresh", BOOLEAN, False)]),
+    "get_status": ("report_status", []),
+    "get_command_metrics": ("report_command_metrics", []),
+    "profile": ("start_profiling", WHOLE_PAYLOAD),
+    "create_presets": ("create_presets", [("presets", list, [])]),
+    "delete_presets": ("delete_presets", [("presets", list, [])]),
+    "rename_presets": ("rename_presets", [("renames", list, []), ("sync_camera", BOOLEAN, False)]),
+    "start_stream": ("start_streaming", [("rtmp_url", str, REQUIRED), ("stream_timer", None, None),
+                                         ("streaming_fps", NUMBER, None)]),
+    "stop_stream": ("stop_streaming", []),
+    "start_on_demand_stream": ("start_on_demand_stream", [("rtmp_url", str, REQUIRED), ("video_file", str, REQUIRED),
+                                                          ("stream_id", NAME, None)]),
+    "stop_on_demand_stream": ("stop_on_demand_stream", [("stream_id", NAME, None)]),
+    "get_on_demand_streams": ("report_on_demand_streams", [("stream_id", NAME, None)]),
+    "probe_stream": ("probe_stream", [("source", NAME, None)]),
+    "get_stream_probes": ("report_stream_probes", []),
+    "cache_media": ("cache_media", [("video_files", list, REQUIRED)]),
+}
+
+
+class CommandError(ValueError):
+    """A command payload that doesn't match its declared parameters."""
+
+
+def check_parameter(command, name, kind, value):
+    """Validate one parameter value; returns it as the handler should get it (NUMBER -> int or float)."""
+    if value is None or kind is None:
+        return value
+    if kind == NUMBER:
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise CommandError(f"{command}.{name} must be a number")
+        if isinstance(value, int):
+            return value
+        try:
+            number = float(value)
+        except ValueError:
+            raise CommandError(f"{command}.{name} must be a number, got {value!r}")
+        if number != number or number in (float("inf"), float("-inf")):
+            raise CommandError(f"{command}.{name} must be a finite number, got {value!r}")
+        return int(number) if number.is_integer() else number
+    elif kind == BOOLEAN:
+        if value not in (True, False, 0, 1):
+            raise CommandError(f"{command}.{name} must be true or false")
+    elif kind == NAME:
+        if isinstance(value, bool) or not isinstance(value, (str, int)):
+            raise CommandError(f"{command}.{name} must be a string")
+    elif not isinstance(value, kind):
+        raise CommandError(f"{command}.{name} must be a {kind.__name__}")
+    return value
+
+
+class CommandRegistry:
+    """Command name -> bound handler and parameter schema, built once per subscriber.
+
+    prepare() validates a payload and returns a ready-to-run handler; timing hooks are called after
+    every command with (command, seconds, error).
+    """
+
+    def __init__(self, target, specs=None):
+        self.commands = {
+            command: (getattr(target, method), parameters)
+            for command, (method, parameters) in (specs or COMMAND_SPECS).items()
+        }
+        self.hooks = [self._record]
+        self.timings = {}
+        self._lock = Lock()
+
+    def __contains__(self, command):
+        return command in self.commands
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def arguments(self, command, payload):
+        """Positional arguments for the handler; raises CommandError if the payload doesn't validate."""
+        parameters = self.commands[command][1]
+        if parameters is WHOLE_PAYLOAD:
+            return (payload,)
+        arguments = []
+        for name, kind, default in parameters:
+            if name in payload:
+                value = check_parameter(command, name, kind, payload[name])
+            elif default is REQUIRED:
+                raise CommandError(f"{command}.{name} is required")
+            else:
+                value = default
+            arguments.append(value)
+        return arguments
+
+    def prepare(self, command, payload):
+        """Validated handler for a command, or None if the command is unknown."""
+        entry = self.commands.get(command)
+        if entry is None:
+            return None
+        method = entry[0]
+        arguments = self.arguments(command, payload)
+
+        def handler():
+            started = time.perf_counter()
+            error = None
+            try:
+                return method(*arguments)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                for hook in self.hooks:
+                    hook(command, elapsed, error)
+
+        return handler
+
+    def _record(self, command, elapsed, error):
+        with self._lock:
+            timing = self.timings.get(command)
+            if timing is None:
+                timing = self.timings[command] = [0, 0, 0.0, 0.0]   # count, errors, total s, max s
+            timing[0] += 1
+            if error is not None:
+                timing[1] += 1
+            timing[2] += elapsed
+            if elapsed > timing[3]:
+                timing[3] = elapsed
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                command: {"count": count, "errors": errors, "total_ms": round(total * 1000, 3),
+                          "avg_ms": round(total / count * 1000, 3), "max_ms": round(longest * 1000, 3)}
+                for command, (count, errors, total, longest) in self.timings.items()
+            }
+
+
+# ---------------------------------------------------
+# 🔬 On-demand Profiling
+# ---------------------------------------------------
+
+PROFILE_MAX_DURATION = 300    # seconds
+PROFILE_MAX_COMMANDS = 1000
+
+# Where time goes, by the file a function lives in
+PROFILE_CATEGORIES = (
+    ("onvif", ("/onvif/", "/zeep/", "/requests/", "/urllib3/", "/lxml/", "http/client", "/ssl.py", "socket.py")),
+    ("mqtt", ("/paho/",)),
+    ("json", ("/json/",)),
+    ("logging", ("/logging/",)),
+    ("mongodb", ("/pymongo/", "/bson/")),
+    ("subscriber", ("subscriber-raspi5.py",)),
+)
+
+
+# Leaf frames of threads that are just waiting (Event.wait, paho's select loop); not counted as work
+PROFILE_IDLE_FRAMES = (
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("paho/mqtt/client.py", "_loop"),
+)
+
+
+def profile_category(filename):
+    for category, markers in PROFILE_CATEGORIES:
+        if any(marker in filename for marker in markers):
+            return category
+    return "other"
+
+
+def short_function_name(filename, line, function):
+    """'package/module.py:42(func)' instead of a full site-packages path."""
+    if "site-packages/" in filename:
+        filename = filename.split("site-packages/", 1)[1]
+    elif "/lib/python" in filename:
+        filename = filename.split("/lib/python", 1)[1].split("/", 1)[-1]
+    else:
+        filename = os.path.basename(filename)
+    return f"{filename}:{line}({function})"
+
+
+class ProfilingSession:
+    """Profile the subscriber for a number of seconds or commands, then report a compact summary.
+
+    "cprofile" mode profiles command handlers deterministically; "sampling" mode takes stack
+    samples of every thread (MQTT network thread, command worker, patrols) at a fixed interval.
+    """
+
+    def __init__(self, mode="sampling", duration=None, commands=None, top=15, interval=0.005):
+        self.mode = mode if mode in ("sampling", "cprofile") else "sampling"
+        self.commands = min(int(commands), PROFILE_MAX_COMMANDS) if commands else None
+        if duration is None and self.commands is None:
+            duration = 10
+        self.duration = min(float(duration), PROFILE_MAX_DURATION) if duration is not None else PROFILE_MAX_DURATION
+        self.top = int(top)
+        self.interval = max(0.001, float(interval))
+        self.started_at = time.time()
+        self.command_times = {}
+        self.commands_seen = 0
+        self.finished = threading.Event()
+        self._lock = Lock()
+        self._profiler = cProfile.Profile() if self.mode == "cprofile" else None
+        self._profiler_lock = Lock()   # a Profile object can only be active in one thread at a time
+        self._samples = 0
+        self._idle_samples = 0
+        self._self_counts = Counter()
+        self._total_counts = Counter()
+        self._category_counts = Counter()
+
+    def start(self, on_finish):
+        """Run until the duration elapses (or finish() is called from the command counter)."""
+        def run():
+            if self.mode == "sampling":
+                while not self.finished.wait(timeout=self.interval):
+                    self._sample()
+                    if time.time() - self.started_at >= self.duration:
+                        break
+            else:
+                self.finished.wait(timeout=self.duration)
+            self.finished.set()
+            on_finish(self.report())
+
+        threading.Thread(target=run, name="profiler", daemon=True).start()
+
+    def finish(self):
+        self.finished.set()
+
+    def _sample(self):
+        skipped_threads = (threading.get_ident(), threading.main_thread().ident)
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in skipped_threads:
+                continue
+            leaf = frame.f_code
+            if any(leaf.co_filename.endswith(filename) and leaf.co_name == function
+                   for filename, function in PROFILE_IDLE_FRAMES):
+                self._idle_samples += 1
+                continue
+            self._samples += 1
+            self._self_counts[(leaf.co_filename, leaf.co_firstlineno, leaf.co_name)] += 1
+            self._category_counts[profile_category(leaf.co_filename)] += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if key not in seen:
+                    seen.add(key)
+                    self._total_counts[key] += 1
+                frame = frame.f_back
+
+    def wrap(self, command, handler):
+        """Time (and in cprofile mode, profile) one command handler."""
+        def profiled():
+            profiler_active = self._profiler is not None and self._profiler_lock.acquire(blocking=False)
+            started = time.perf_counter()
+            try:
+                if profiler_active:
+                    self._profiler.enable()
+                return handler()
+            finally:
+                if profiler_active:
+                    self._profiler.disable()
+                    self._profiler_lock.release()
+                self._record(command, time.perf_counter() - started)
+        return profiled
+
+    def _record(self, command, elapsed):
+        with self._lock:
+            stats = self.command_times.setdefault(command, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["count"] += 1
+            stats["total_ms"] += elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+            self.commands_seen += 1
+            if self.commands and self.commands_seen >= self.commands:
+                self.finish()
+
+    def report(self):
+        summary = {
+            "type": "profile_report",
+            "mode": self.mode,
+            "duration": round(time.time() - self.started_at, 3),
+            "commands": {
+                command: {
+                    "count": stats["count"],
+                    "mean_ms": round(stats["total_ms"] / stats["count"], 3),
+                    "max_ms": round(stats["max_ms"], 3),
+                    "total_ms": round(stats["total_ms"], 3),
+                }
+                for command, stats in self.command_times.items()
+            },
+        }
+        if self.mode == "sampling":
+            summary.update(self._sampling_summary())
+        else:
+            summary.update(self._cprofile_summary())
+        return summary
+
+    def _sampling_summary(self):
+        def top(counts):
+            return [
+                {"function": short_function_name(*key), "samples": count, "percent": round(100 * count / max(1, self._samples), 1)}
+                for key, count in counts.most_common(self.top)
+            ]
+        return {
+            "interval": self.interval,
+            "samples": self._samples,
+            "idle_samples": self._idle_samples,
+            "categories_percent": {
+                category: round(100 * count / max(1, self._samples), 1) for category, count in self._category_counts.most_common()
+            },
+            "hot_self": top(self._self_counts),
+            "hot_cumulative": top(self._total_counts),
+        }
+
+    def _cprofile_summary(self):
+        pstats = lazy_import("pstats")
+        try:
+            stats = pstats.Stats(self._profiler).stats
+        except TypeError:
+            # Nothing was profiled (no commands arrived)
+            return {"total_ms": 0.0, "categories_ms": {}, "hot_self": [], "hot_cumulative": []}
+        categories = Counter()
+        rows = []
+        for (filename, line, function), (_, calls, own_time, cumulative_time, _) in stats.items():
+            categories[profile_category(filename)] += own_time
+            rows.append((short_function_name(filename, line, function), calls, own_time, cumulative_time))
+
+        def top(index):
+            return [
+                {"function": name, "calls": calls, "self_ms": round(own * 1000, 3), "cumulative_ms": round(cumulative * 1000, 3)}
+                for name, calls, own, cumulative in sorted(rows, key=lambda row: row[index], reverse=True)[:self.top]
+            ]
+        return {
+            "total_ms": round(sum(categories.values()) * 1000, 3),
+            "categories_ms": {category: round(seconds * 1000, 3) for category, seconds in categories.most_common()},
+            "hot_self": top(2),
+            "hot_cumulative": top(3),
+        }
+
+
+# ---------------------------------------------------
+# 🔌 ONVIF HTTP Transport
+# ---------------------------------------------------
+
+DEFAULT_ONVIF_TRANSPORT_SETTINGS = {
+    "connect_timeout": 3.0,    # seconds to open the TCP connection
+    "read_timeout": 10.0,      # seconds to wait for a SOAP response
+    "pool_maxsize": 4,         # keep-alive connections kept per camera (patrol, worker, telemetry, ...)
+    "http_auth": "digest",     # "digest" answers HTTP 401 challenges and reuses the nonce; "none" relies on WS-Security only
+    "prebuilt_requests": True, # send ContinuousMove/Stop/GotoPreset/GetStatus from pre-rendered envelopes
+}
+
+
+class ONVIFTransport:
+    """Keep-alive requests.Session + zeep Transport for one camera, kept across ONVIFCamera re-inits."""
+
+    def __init__(self, host, port, username, password, settings=None):
+        requests = lazy_import("requests")
+        transports = lazy_import("zeep.transports")
+
+        self.settings = dict(DEFAULT_ONVIF_TRANSPORT_SETTINGS, **(settings or {}))
+        self.key = (host, int(port), username, password)
+        self.session = requests.Session()
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=int(self.settings["pool_maxsize"]), max_retries=0
+        )
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        if self.settings["http_auth"] == "digest":
+            # HTTPDigestAuth keeps the server nonce, so only the first request per thread pays for the 401 round trip
+            self.session.auth = requests.auth.HTTPDigestAuth(username, password)
+        self.session.hooks["response"].append(self._record)
+
+        timeout = (float(self.settings["connect_timeout"]), float(self.settings["read_timeout"]))
+        self.transport = transports.Transport(session=self.session, timeout=sum(timeout), operation_timeout=timeout)
+
+        self._lock = Lock()
+        self.calls = 0
+        self.requests = 0
+        self.challenges = 0
+        self.errors = 0
+        self.elapsed_total = 0.0
+        self.elapsed_max = 0.0
+
+    def matches(self, host, port, username, password):
+        return self.key == (host, int(port), username, password)
+
+    def _record(self, response, *args, **kwargs):
+        # A digest challenge shows up as a 401 in the history of the retried response
+        elapsed = sum(r.elapsed.total_seconds() for r in response.history) + response.elapsed.total_seconds()
+        with self._lock:
+            self.calls += 1
+            self.requests += 1 + len(response.history)
+            self.challenges += sum(1 for r in response.history if r.status_code == 401)
+            self.elapsed_total += elapsed
+            self.elapsed_max = max(self.elapsed_max, elapsed)
+            if response.status_code >= 400:
+                self.errors += 1
+
+    def connections_opened(self):
+        """TCP connections opened so far (urllib3 counts them per pool)."""
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def snapshot(self):
+        opened = self.connections_opened()
+        with self._lock:
+            requests_sent = self.requests
+            return {
+                "calls": self.calls,
+                "requests": requests_sent,
+                "connections_opened": opened,
+                "reuse_ratio": round(1 - opened / requests_sent, 3) if requests_sent else None,
+                "auth_challenges": self.challenges,
+                "http_errors": self.errors,
+                "avg_ms": round(self.elapsed_total / self.calls * 1000, 1) if self.calls else None,
+                "max_ms": round(self.elapsed_max * 1000, 1),
+            }
+
+    def close(self):
+        self.session.close()
+
+
+# ---------------------------------------------------
+# 🧾 Prebuilt SOAP Requests
+# ---------------------------------------------------
+
+# Element local name -> [(attribute or None for text, slot name)]
+WSSE_SLOTS = {"Password": [(None, "digest")], "Nonce": [(None, "nonce")], "Created": [(None, "created")]}
+VELOCITY_SLOTS = {"PanTilt": [("x", "pan"), ("y", "tilt")], "Zoom": [("x", "zoom")]}
+PRESET_SLOTS = {"PresetToken": [(None, "preset")]}
+
+
+class SOAPTemplate:
+    """A SOAP envelope rendered once by zeep, with str.format slots for the values that change per call."""
+
+    def __init__(self, service, operation, arguments, slots):
+        etree = lazy_import("lxml.etree")
+        envelope, self.headers = service.ws_client._binding._create(
+            operation, (), arguments, client=service.zeep_client, options={"address": service.xaddr}
+        )
+        slots = dict(WSSE_SLOTS, **slots)
+        for element in envelope.iter():
+            for attribute, name in slots.get(etree.QName(element).localname, ()):
+                if attribute:
+                    element.set(attribute, f"@@{name}@@")
+                else:
+                    element.text = f"@@{name}@@"
+        text = etree.tostring(envelope, encoding="unicode").replace("{", "{{").replace("}", "}}")
+        for name in {name for entries in slots.values() for _, name in entries}:
+            text = text.replace(f"@@{name}@@", "{" + name + "}")
+        self.operation = operation
+        self.text = text
+
+    def render(self, **values):
+        return self.text.format(**values).encode("utf-8")
+
+
+class PrebuiltPTZRequests:
+    """Pre-rendered ContinuousMove/Stop/GotoPreset/GetStatus envelopes for one PTZ service and profile.
+
+    Only the WS-Security digest and the velocity/preset values are filled in per call, and the
+    envelope is posted on the camera's pooled session. Replies are read with lxml; zeep's
+    deserializer is skipped.
+    """
+
+    def __init__(self, ptz_service, profile_token, transport):
+        wsse = ptz_service.zeep_client.wsse
+        if not getattr(wsse, "use_digest", False):
+            raise ValueError("prebuilt requests need WS-Security password digest")
+        self.service = ptz_service
+        self.profile_token = profile_token
+        self.address = ptz_service.xaddr
+        self.session = transport.session
+        self.timeout = transport.transport.operation_timeout
+        self.password = wsse.password.encode("utf-8")
+        self.dt_diff = wsse.dt_diff
+        self._templates = {}
+        self._lock = Lock()
+        # Build the fixed-shape envelopes now so the first joystick command doesn't pay for it
+        self._template("Stop")
+        self._template("GetStatus")
+        self._template("GotoPreset")
+
+    def _template(self, operation, shape=None):
+        key = (operation, shape)
+        template = self._templates.get(key)
+        if template is None:
+            with self._lock:
+                template = self._templates.get(key)
+                if template is None:
+                    template = self._templates[key] = self._build(operation, shape)
+        return template
+
+    def _build(self, operation, shape):
+        arguments = {"ProfileToken": self.profile_token}
+        slots = {}
+        if operation == "ContinuousMove":
+            velocity = {}
+            if "PanTilt" in shape:
+                velocity["PanTilt"] = {"x": 0.0, "y": 0.0}
+            if "Zoom" in shape:
+                velocity["Zoom"] = {"x": 0.0}
+            arguments["Velocity"] = velocity
+            slots = VELOCITY_SLOTS
+        elif operation == "Stop":
+            arguments.update(PanTilt=True, Zoom=True)
+        elif operation == "GotoPreset":
+            arguments["PresetToken"] = "0"
+            slots = PRESET_SLOTS
+        return SOAPTemplate(self.service, operation, arguments, slots)
+
+    def _security(self):
+        # Same digest as zeep's UsernameToken: Base64(SHA-1(nonce + created + password))
+        nonce = os.urandom(16)
+        created = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+        if self.dt_diff is not None:
+            created += self.dt_diff
+        created = created.isoformat() + "+00:00"
+        digest = base64.b64encode(hashlib.sha1(nonce + created.encode("utf-8") + self.password).digest())
+        return {"nonce": base64.b64encode(nonce).decode("ascii"), "created": created, "digest": digest.decode("ascii")}
+
+    def _post(self, template, **values):
+        response = self.session.post(
+            self.address, data=template.render(**self._security(), **values),
+            headers=template.headers, timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"{template.operation} failed: HTTP {response.status_code} {soap_fault_reason(response.content)}")
+        return response.content
+
+    def continuous_move(self, velocity_vector):
+        shape = tuple(axis for axis in ("PanTilt", "Zoom") if axis in velocity_vector)
+        pan_tilt = velocity_vector.get("PanTilt") or {}
+        self._post(
+            self._template("ContinuousMove", shape),
+            pan=float(pan_tilt.get("x", 0.0)), tilt=float(pan_tilt.get("y", 0.0)),
+            zoom=float((velocity_vector.get("Zoom") or {}).get("x", 0.0)),
+        )
+
+    def stop(self):
+        self._post(self._template("Stop"))
+
+    def goto_preset(self, preset_token):
+        self._post(self._template("GotoPreset"), preset=xml_escape(str(preset_token)))
+
+    def get_status(self):
+        """GetStatus parsed into the attribute shape zeep returns (Position.PanTilt.x, MoveStatus.Zoom, ...)."""
+        return parse_ptz_status(self._post(self._template("GetStatus")))
+
+
+def soap_fault_reason(content):
+    """Text of a SOAP 1.1/1.2 fault, or the start of the body if it isn't one."""
+    etree = lazy_import("lxml.etree")
+    try:
+        root = etree.fromstring(content)
+    except Exception:
+        return content[:200].decode("utf-8", "replace")
+    for element in root.iter():
+        if etree.QName(element).localname in ("Text", "faultstring") and element.text:
+            return element.text.strip()
+    return ""
+
+
+def parse_ptz_status(content):
+    etree = lazy_import("lxml.etree")
+    status = SimpleNamespace(Position=None, MoveStatus=None, UtcTime=None)
+    for element in etree.fromstring(content).iter():
+        name = etree.QName(element).localname
+        if name == "Position":
+            status.Position = SimpleNamespace(PanTilt=None, Zoom=None)
+            for child in element:
+                axis = etree.QName(child).localname
+                if axis in ("PanTilt", "Zoom"):
+                    setattr(status.Position, axis, SimpleNamespace(
+                        x=float(child.get("x", 0.0)), y=float(child.get("y", 0.0)), space=child.get("space")
+                    ))
+        elif name == "MoveStatus":
+            status.MoveStatus = SimpleNamespace(PanTilt=None, Zoom=None)
+            for child in element:
+                axis = etree.QName(child).localname
+                if axis in ("PanTilt", "Zoom"):
+                    setattr(status.MoveStatus, axis, (child.text or "").strip())
+        elif name == "UtcTime":
+            status.UtcTime = element.text
+    return status
+
+
+# ---------------------------------------------------
+# 📋 Device Status Snapshot
+# ---------------------------------------------------
+
+DEFAULT_STATUS_SETTINGS = {
+    "min_publish_interval": 1.0,   # seconds between retained status publishes (changes are coalesced)
+    "include_position": True,      # republish when GetStatus reports a new position
+}
+
+
+def start_timer(delay, callback):
+    """Run callback after delay seconds on a daemon timer thread; returns a handle with cancel()."""
+    timer = threading.Timer(delay, callback)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def config_version(config_data):
+    """Short content hash of the loaded configuration (plus its own "version" field, if any)."""
+    if not config_data:
+        return None
+    digest = hashlib.sha1(json.dumps(config_data, sort_keys=True, default=str).encode()).hexdigest()[:12]
+    return f"{config_data['version']}-{digest}" if "version" in config_data else digest
+
+
+class StatusSnapshot:
+    """Device status kept in memory: answered without I/O, published (retained) when it changes."""
+
+    def __init__(self, publish, settings=None, call_later=None):
+        self.publish = publish
+        self.settings = dict(DEFAULT_STATUS_SETTINGS, **(settings or {}))
+        self.call_later = call_later or start_timer
+        self.fields = {}
+        self.revision = 0
+        self.updated_at = None
+        self._lock = Lock()
+        self._timer = None
+        self._last_publish = 0.0
+        self._closed = False
+
+    def update(self, **fields):
+        """Merge fields; schedule a retained publish if anything actually changed."""
+        with self._lock:
+            if all(self.fields.get(key) == value for key, value in fields.items()):
+                return
+            self.fields.update(fields)
+            self.revision += 1
+            self.updated_at = time.time()
+            if self._timer is not None:
+                return
+            delay = self.settings["min_publish_interval"] - (time.monotonic() - self._last_publish)
+            if delay > 0:
+                self._timer = self.call_later(delay, self.flush)
+                return
+        self.flush()
+
+    def put(self, **fields):
+        """Merge fields without publishing (e.g. while offline; they go out with the next update)."""
+        with self._lock:
+            self.fields.update(fields)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(copy.deepcopy(self.fields), revision=self.revision, updated_at=self.updated_at)
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            self._last_publish = time.monotonic()
+            if self._closed:
+                return
+        try:
+            self.publish(self.snapshot())
+        except Exception as e:
+            logging.error(f"Failed to publish status: {e}")
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def close(self):
+        """Stop publishing for good, so nothing overwrites the final offline status."""
+        with self._lock:
+            self._closed = True
+        self.cancel()
+
+
+PATROL_STATE_CACHE = "patrol_state.json"
+DEFAULT_PATROL_DWELL_TIME = 5  # seconds spent at each preset
+
+
+def build_preset_tour(tour_token, name, preset_tokens, dwell_time):
+    """Compile a patrol into an ONVIF PresetTour (loops until stopped)."""
+    return {
+        "token": tour_token,
+        "Name": name,
+        "Status": {"State": "Idle"},
+        "AutoStart": False,
+        "StartingCondition": {"Direction": "Forward"},
+        "TourSpot": [
+            {"PresetDetail": {"PresetToken": token}, "StayTime": datetime.timedelta(seconds=dwell_time)}
+            for token in preset_tokens
+        ],
+    }
+
+
+def travel_time_matrix(coords, speeds):
+    """Pairwise travel time (seconds) between PTZ positions given per-axis speeds."""
+    np = lazy_import("numpy")
+    # Axes move simultaneously, so each hop takes as long as its slowest axis
+    return (np.abs(coords[:, None, :] - coords[None, :, :]) / speeds).max(axis=2)
+
+
+def optimize_patrol_route(positions, speeds):
+    """Order presets to minimise the travel time of a closed patrol loop.
+
+    positions: ordered {name: {"pan", "tilt", "zoom"}}; the first preset stays first.
+    Nearest-neighbour tour refined with 2-opt. Returns (names, cycle_time_before, cycle_time_after).
+    """
+    np = lazy_import("numpy")
+    names = list(positions)
+    coords = np.array([[positions[name][axis] for axis in PTZ_AXES] for name in names], dtype=float)
+    matrix = travel_time_matrix(coords, np.array([speeds[axis] for axis in PTZ_AXES], dtype=float))
+    count = len(names)
+
+    def cycle_time(route):
+        return float(matrix[route, np.roll(route, -1)].sum())
+
+    original = np.arange(count)
+    if count < 4:
+        # Every closed loop over three or fewer presets has the same length
+        return names, cycle_time(original), cycle_time(original)
+
+    route = [0]
+    unvisited = np.ones(count, dtype=bool)
+    unvisited[0] = False
+    while unvisited.any():
+        candidates = np.where(unvisited, matrix[route[-1]], np.inf)
+        route.append(int(candidates.argmin()))
+        unvisited[route[-1]] = False
+    route = np.array(route)
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, count - 1):
+            successors = np.roll(route, -1)
+            a, b = route[i - 1], route[i]
+            c, d = route[i + 1:], successors[i + 1:]
+            # Gain of reversing route[i..j] for every j at once
+            gain = matrix[a, b] + matrix[c, d] - matrix[a, c] - matrix[b, d]
+            j = int(gain.argmax())
+            if gain[j] > 1e-9:
+                j += i + 1
+                route[i:j + 1] = route[i:j + 1][::-1].copy()
+                improved = True
+
+    if cycle_time(route) >= cycle_time(original):
+        route = original
+    return [names[index] for index in route], cycle_time(original), cycle_time(route)
+
+
+# ---------------------------------------------------
+# 🧹 Shutdown
+# ---------------------------------------------------
+
+DEFAULT_SHUTDOWN_SETTINGS = {
+    "deadline": 8.0,       # seconds for the whole teardown; every component shares the same budget
+    "term_grace": 3.0,     # seconds a child process gets after SIGTERM before SIGKILL
+}
+
+LAST_SHUTDOWN_CACHE = "last_shutdown.json"
+
+
+def terminate_processes(processes, grace):
+    """SIGTERM every running process at once, then SIGKILL those still running after grace seconds."""
+    processes = [process for process in processes if process and process.poll() is None]
+    for process in processes:
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            pass
+    end = time.monotonic() + max(0.0, grace)
+    killed = 0
+    for process in processes:
+        try:
+            process.wait(timeout=max(0.0, end - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            killed += 1
+            try:
+                process.wait(timeout=1.0)
+            except subprocess.TimeoutExpired:
+                pass  # stuck in the kernel (D state); nothing more we can do
+    return killed
+
+
+def previous_shutdown_summary():
+    """How long the previous process took to stop, per component (from cache/last_shutdown.json)."""
+    report = load_json_cache(LAST_SHUTDOWN_CACHE)
+    if not report:
+        return None
+    return {
+        "total_seconds": report.get("total_seconds"),
+        "steps": {name: timing["seconds"] for name, timing in report.get("steps", {}).items()},
+    }
+
+
+class ShutdownCoordinator:
+    """Run teardown steps in parallel threads against one deadline, timing each of them.
+
+    A step may name steps it has to wait for (e.g. the MQTT disconnect waits for the final telemetry
+    flush); it waits at most until the deadline. Steps still running at the deadline are reported
+    as timed out and abandoned (their threads are daemons).
+    """
+
+    def __init__(self, deadline):
+        self.started = time.monotonic()
+        self.deadline = self.started + deadline
+        self.timings = {}
+        self._threads = {}
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def run(self, name, function, after=()):
+        def step():
+            for dependency in after:
+                if dependency in self._threads:
+                    self._threads[dependency].join(self.remaining())
+            started = time.monotonic()
+            try:
+                function()
+                result = "ok"
+            except Exception as e:
+                logging.error(f"Shutdown step {name} failed: {e}")
+                result = f"error: {e}"
+            self.timings.setdefault(name, {"seconds": round(time.monotonic() - started, 3), "result": result})
+
+        thread = threading.Thread(target=step, name=f"shutdown-{name}", daemon=True)
+        self._threads[name] = thread
+        thread.start()
+
+    def wait(self):
+        """Join every step until the deadline; returns {step: {"seconds", "result"}} plus the total."""
+        for name, thread in self._threads.items():
+            thread.join(self.remaining())
+            if thread.is_alive():
+                self.timings.setdefault(name, {"seconds": None, "result": "timed out"})
+        return {
+            "total_seconds": round(time.monotonic() - self.started, 3),
+            "steps": {name: self.timings[name] for name in self._threads},
+        }
+
+
 # ---------------------------------------------------
 # 🌐 MQTT Subscriber Class
 # ---------------------------------------------------
@@ -121,11 +3050,18 @@ def validate_config(config_data):
 class MQTTSubscriber:
     """Handles MQTT connection, message processing, and camera control."""
 
-    def __init__(self, sensor_id):
-        """Initialize MQTT client and other components."""
+    def __init__(self, sensor_id, camera_config=None, client_id=None):
+        """Initialize MQTT client and other components.
+
+        camera_config and client_id default to the service configuration; passing them lets
+        several subscribers share one process (see fleet_simulator.py).
+        """
         self.sensor_id = sensor_id
+        self.camera_details = camera_config if camera_config is not None else camera_details
+        self.client_id = client_id or MQTT_CLIENT_ID
         # Create MQTT client with client ID
-        self.client = mqtt.Client(client_id=MQTT_CLIENT_ID)
+        mqtt = lazy_import("paho.mqtt.client")
+        self.client = mqtt.Client(client_id=self.client_id)
         
         # Set up MQTT connection based on connection type
         self._setup_mqtt_connection()
@@ -137,23 +3073,139 @@ class MQTTSubscriber:
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
-        
-        # Set connection parameters
-        self.client.connect(MQTT_HOST, MQTT_PORT, keepalive=MQTT_KEEPALIVE)
+        self.client.on_subscribe = self.on_subscribe
+
+        # Set by on_connect, cleared by on_disconnect (start() waits on it instead of polling)
+        self._connected_event = threading.Event()
+        self._startup_subscribed = False
+
+        # Status snapshot, retained on {sensor_id}/status; the broker marks us offline if we vanish
+        self.started_at = time.time()
+        # Set by AsyncRuntime.attach when running on an asyncio event loop
+        self.runtime = None
+        # Pending call_later handles (streaming auto-stop, status flushes), cancelled on shutdown
+        self._timers = set()
+        self._timers_lock = Lock()
+        # Set once cleanup starts: no reconnects, and a second signal doesn't run it twice
+        self._shutting_down = False
+        self.last_shutdown = None
+        self.status = StatusSnapshot(
+            self.publish_status,
+            ((config or {}).get("service_settings", {}).get("status") or {}),
+            call_later=lambda delay, callback: self.call_later(delay, callback),
+        )
+        self.client.will_set(self.status_topic(), self.offline_status(), qos=1, retain=True)
+        self.status.fields.update({
+            "sensor_id": self.sensor_id,
+            "mqtt": "connecting",
+            "onvif": {"state": "not_initialized"},
+            "patrol": None,
+            "config_version": config_version(config),
+            "runtime": "threaded",
+            "last_shutdown": previous_shutdown_summary(),
+        })
         
         #camera state
         self.camera = None
         self.ptz_service = None
         self.profile_token = None
+        self.media_service = None
+        self.media_profile = None
         self.camera_auth_check=None
 
+        # Pooled SOAP transport; survives re-inits so reconnecting keeps warm connections and digest state
+        self.onvif_transport = None
+        self.onvif_transport_settings = dict(
+            (config or {}).get("service_settings", {}).get("onvif_transport") or {},
+            **((self.camera_details or {}).get("onvif_transport") or {}),
+        )
+        # Pre-rendered envelopes for the hot PTZ calls; rebuilt after every re-init, False if unsupported
+        self._prebuilt_requests = None
+
+        # Video encoder configuration + options cache, keyed by media profile token
+        self._encoder_cache = {}
+
+        # PTZ nodes/spaces/limits, discovered once and persisted in cache/ptz_capabilities.json
+        self.ptz_capabilities = None
+
+        # Preset table cached from configuration.json, reconciled with the camera on a schedule
+        self.presets = PresetTable((self.camera_details or {}).get("presets", []))
+        self._presets_need_reconcile = True
+        self._preset_lock = Lock()
+        self._preset_reconciler_stop = threading.Event()
+        self.preset_reconcile_interval = (self.camera_details or {}).get(
+            "preset_reconcile_interval", DEFAULT_PRESET_RECONCILE_INTERVAL
+        )
+
+        # Where the camera is, answered from memory (GetStatus anchors + dead reckoning)
+        self.position_model = PositionModel(speeds=(self.camera_details or {}).get("ptz_speed"))
+
+        # Optional live position stream on {sensor_id}/telemetry
+        self.telemetry = None
+        telemetry_settings = (config or {}).get("service_settings", {}).get("telemetry") or {}
+        if telemetry_settings.get("enabled"):
+            self.telemetry = PositionTelemetry(self.refresh_position, self.publish_telemetry, telemetry_settings)
+
+        # Per-camera command limits (service-wide settings, overridable in camera_details)
+        self.command_scheduler = CommandScheduler(
+            merge_command_limits(
+                (config or {}).get("service_settings", {}).get("command_limits"),
+                (self.camera_details or {}).get("command_limits"),
+            ),
+            self.publish_response,
+        )
+
+        # Active `profile` command session, if any
+        self.profiling = None
+
+        # Stream-ready renditions of on-demand video files, so replays are remuxed instead of re-encoded
+        self.media_cache = None
+        media_settings = dict(DEFAULT_MEDIA_CACHE_SETTINGS, **((config or {}).get("service_settings", {}).get("media_cache") or {}))
+        if media_settings["enabled"]:
+            self.media_cache = MediaCache(media_settings)
+
+        # Hot reload of configuration.json and config pushed from MongoDB (started from the main block)
+        self.config_watcher = None
+        self.config_stream = None
+
+        # Command dispatch table, built once (see COMMAND_SPECS)
+        self.commands = CommandRegistry(self)
+
+        # Steps streaming quality down/up with CPU load and temperature (started from the main block)
+        self.stream_governor = None
+        governor_settings = (config or {}).get("service_settings", {}).get("stream_governor") or {}
+        if dict(DEFAULT_STREAM_GOVERNOR_SETTINGS, **governor_settings)["enabled"]:
+            self.stream_governor = StreamGovernor(self.on_stream_quality_change, governor_settings)
+
+        # Periodic ffprobe samples of the camera stream(s) (started from the main block)
+        self.stream_prober = None
+        probe_settings = (config or {}).get("service_settings", {}).get("stream_probe") or {}
+        if dict(DEFAULT_STREAM_PROBE_SETTINGS, **probe_settings)["enabled"]:
+            self.stream_prober = StreamProber(self.stream_sources, self.expected_stream, self.on_stream_probe, probe_settings)
+
         # Threading and process management
-        self.ffmpeg_processes = {}
+        self.ffmpeg_processes = {}  # on-demand stream_id -> ffmpeg process
+        self._stream_info = {}
+        self._stream_ids = itertools.count(1)
+        self.stream_slots = StreamSlots(
+            dict((config or {}).get("service_settings", {}).get("on_demand_streams") or {},
+                 **((self.camera_details or {}).get("on_demand_streams") or {}))
+        )
         self._shutdown_events = {}
         self._patrol_threads = {}
         self._patrol_lock = Lock()
         self._ffmpeg_lock = Lock()
         self._active_patrols = {}
+        self._patrol_modes = {}
+
+        # On-camera preset tours survive our restarts, so remember them across restarts
+        self._camera_tours = {}
+        patrol_state = load_json_cache(PATROL_STATE_CACHE).get(self.sensor_id)
+        if patrol_state and patrol_state.get("mode") == "camera_tour":
+            self._camera_tours[self.sensor_id] = patrol_state["tour_token"]
+            self._patrol_modes[self.sensor_id] = "camera_tour"
+            self._active_patrols[self.sensor_id] = True
+            self.status.put(patrol=dict(patrol_state))
         
     def _setup_mqtt_connection(self):
         """Set up MQTT connection based on the connection type."""
@@ -179,6 +3231,11 @@ class MQTTSubscriber:
                 cert_reqs=ssl.CERT_REQUIRED
             )
             self.client.tls_insecure_set(False)  # Enforce certificate verification
+
+        elif MQTT_CONNECTION_TYPE == MQTT_CONNECTION_TYPES["PLAIN"]:
+            # Plain TCP, for brokers on localhost or a trusted LAN
+            if MQTT_USERNAME:
+                self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
             
         else:
             # Default to username/password authentication
@@ -195,6 +3252,10 @@ class MQTTSubscriber:
         """Handle successful connection to MQTT broker."""
         if rc == 0:
             print("✅ Connected to MQTT broker")
+            self._connected_event.set()
+            self.status.update(mqtt="connected")
+            if not self._startup_subscribed:
+                startup_profiler.mark("MQTT connected")
             control_topic = mqtt_topics["control"].format(sensor_id=self.sensor_id)
             response_topic = mqtt_topics["response"].format(sensor_id=self.sensor_id)
 
@@ -205,6 +3266,12 @@ class MQTTSubscriber:
 
     def on_disconnect(self, client, userdata, rc):
         """Handle unexpected disconnections and attempt full reconnection."""
+        self._connected_event.clear()
+        # Can't be published while offline; goes out with the next change after reconnecting
+        self.status.put(mqtt="disconnected")
+        if self._shutting_down:
+            print("🔌 Disconnected from MQTT broker.")
+            return
         print("❌ Disconnected from MQTT broker. Attempting to reconnect...")
 
         # Properly disconnect and clean up
@@ -229,6 +3296,84 @@ class MQTTSubscriber:
 
         print("🚨 Could not reconnect after multiple attempts. Manual intervention required.")
 
+    def on_subscribe(self, client, userdata, mid, granted_qos):
+        """Record the first subscription and kick off the deferred dependency preload."""
+        if self._startup_subscribed:
+            return
+        self._startup_subscribed = True
+        startup_profiler.mark("subscribed to control topic")
+
+        if self.telemetry:
+            self.telemetry.start()
+        self.start_preset_reconciler()
+
+        if FAST_START:
+            preload_heavy_dependencies_in_background()
+        else:
+            startup_profiler.report()
+
+    def publish_response(self, payload):
+        """Publish a JSON payload on this sensor's response topic."""
+        response_topic = mqtt_topics["response"].format(sensor_id=self.sensor_id)
+        payload = dict(payload, sensor_id=self.sensor_id, timestamp=time.time())
+        try:
+            self.client.publish(response_topic, json.dumps(payload))
+        except Exception as e:
+            logging.error(f"[{self.sensor_id}] Failed to publish response: {e}")
+
+    def call_later(self, delay, callback):
+        """Schedule callback on the runtime's timers (event loop or timer thread); returns a cancellable handle."""
+        timer = self.runtime.call_later(delay, callback) if self.runtime else start_timer(delay, callback)
+        # Kept so shutdown can cancel whatever is still pending (e.g. a streaming auto-stop)
+        with self._timers_lock:
+            self._timers = {pending for pending in self._timers if not pending.finished.is_set()}
+            self._timers.add(timer)
+        return timer
+
+    def status_topic(self):
+        return (mqtt_topics or {}).get("status", "{sensor_id}/status").format(sensor_id=self.sensor_id)
+
+    def offline_status(self):
+        """Retained status left behind when we go away (clean stop, or the broker's last will)."""
+        return json.dumps({"sensor_id": self.sensor_id, "mqtt": "offline"})
+
+    def publish_status(self, snapshot):
+        """Publish the status snapshot as a retained message (dashboards get it on subscribe)."""
+        self.client.publish(self.status_topic(), json.dumps(snapshot), qos=1, retain=True)
+
+    def get_status(self):
+        """Current status from memory only: no ONVIF, MongoDB or filesystem access."""
+        status = self.status.snapshot()
+        status["position"] = self.position_model.estimate() or status.get("position")
+        status["streams"] = {
+            stream_id: {"pid": process.pid, "running": process.poll() is None, "returncode": process.returncode,
+                        "mode": self._stream_info.get(stream_id, {}).get("mode")}
+            for stream_id, process in list(self.ffmpeg_processes.items())
+        }
+        status["stream_slots"] = self.stream_slots.snapshot()
+        status["commands"] = {"queued": self.command_scheduler.queued(), "enabled": self.command_scheduler.enabled}
+        status["uptime"] = round(time.time() - self.started_at, 1)
+        if self.onvif_transport:
+            status["onvif_transport"] = self.onvif_transport.snapshot()
+        if self.media_cache:
+            status["media_cache"] = self.media_cache.snapshot()
+        if self.stream_governor:
+            status["stream_governor"] = self.stream_governor.snapshot()
+        return status
+
+    def publish_telemetry(self, payload):
+        """Publish a telemetry batch on the telemetry topic (defaults to {sensor_id}/telemetry)."""
+        telemetry_topic = mqtt_topics.get("telemetry", "{sensor_id}/telemetry").format(sensor_id=self.sensor_id)
+        payload = dict(payload, sensor_id=self.sensor_id)
+        try:
+            self.client.publish(telemetry_topic, json.dumps(payload, separators=(",", ":")))
+        except Exception as e:
+            logging.error(f"[{self.sensor_id}] Failed to publish telemetry: {e}")
+
+    def _wake_telemetry(self):
+        if self.telemetry:
+            self.telemetry.wake()
+
     def on_log(self, client, userdata, level, buf):
         """Callback for MQTT client logging."""
         logging.info(f"MQTT Log: {buf}")
@@ -236,39 +3381,72 @@ class MQTTSubscriber:
     def on_message(self, client, userdata, msg):
         """Handle incoming MQTT messages."""
         try:
-            topic = msg.topic
-            payload = json.loads(msg.payload.decode())
-            command = payload.get("command")
-
-            logging.info(f"[{self.sensor_id}] Received command: {command}")
-
-            command_methods = {
-                "move": lambda: self.move_camera(payload.get("pan", 0), payload.get("tilt", 0), payload.get("zoom", 0), payload.get("velocity", 0.5)),
-                "stop_ptz": lambda: self.stop_camera(),
-                "test": lambda: self.testing_function(),
-                "create_preset": lambda: self.create_preset(payload.get("preset_name")),
-                "go-to-preset": lambda: self.move_to_preset(payload.get("preset_name")),
-                "start_patrol": lambda: self.start_patrol(payload.get("presets", [])),
-                "stop_patrol": self.stop_patrol(),
-                "set_fpsbr": lambda: self.set_fpsbr(payload.get("fps", None),payload.get("width", None),payload.get("height", None),payload.get("BitrateLimit", None)),
-                "set_time": lambda: self.set_time(payload.get("timezone", "UTC"), payload.get("ntp_server", "pool.ntp.org")),
-                "update_configuration": lambda: self.update_local_config(payload.get("sensor_id")),
-                "start_stream": lambda: self.start_streaming(payload.get("rtmp_url"), payload.get("stream_timer"), payload.get("streaming_fps")),
-                "stop_stream": self.stop_streaming,
-                "start_on_demand_stream": lambda: self.start_on_demand_stream(payload.get("rtmp_url"), payload.get("video_file")),
-                "stop_on_demand_stream": self.stop_on_demand_stream
-                # ,
-                # "update_model": lambda: self.update_model(payload.get("model_url"), payload.get("type"))
-            }
-
-            if command in command_methods:
-                command_methods[command]()
-            else:
-                logging.warning(f"Unknown command received: {command}")
-
+            prepared = self.prepare_command(msg)
+            if prepared:
+                self.command_scheduler.submit(*prepared)
         except Exception as e:
             logging.error(f"Error processing message: {e}")
+
+    def prepare_command(self, msg):
+        """Parse and validate a control message; returns (command, handler), or None if there is nothing to run."""
+        topic = msg.topic
+        payload = json.loads(msg.payload.decode())
+        command = payload.get("command")
+
+        # Our own replies come back on the response topic; only commands are handled.
+        # Replies always carry a "type" (acks and bulk results also echo the command name).
+        if topic == mqtt_topics["response"].format(sensor_id=self.sensor_id) and (command is None or "type" in payload):
+            return None
+
+        logging.info(f"[{self.sensor_id}] Received command: {command}")
+
+        try:
+            handler = self.commands.prepare(command, payload)
+        except CommandError as e:
+            logging.warning(f"[{self.sensor_id}] Rejected {command}: {e}")
+            self.publish_response({"type": "command_error", "command": command, "error": str(e)})
+            return None
+
+        if handler is None:
+            logging.warning(f"Unknown command received: {command}")
+            return None
+
+        profiling = self.profiling
+        if profiling and command != "profile" and not profiling.finished.is_set():
+            handler = profiling.wrap(command, handler)
+        return command, handler
     
+    def start_profiling(self, payload):
+        """Handle the `profile` command: start (or stop) a profiling session and report on the response topic."""
+        if payload.get("action") == "stop":
+            if self.profiling:
+                self.profiling.finish()
+            return
+
+        if self.profiling and not self.profiling.finished.is_set():
+            self.publish_response({"type": "profile_report", "error": "A profiling session is already running"})
+            return
+
+        try:
+            session = ProfilingSession(
+                mode=payload.get("mode", "sampling"),
+                duration=payload.get("duration"),
+                commands=payload.get("commands"),
+                top=payload.get("top", 15),
+                interval=payload.get("interval", 0.005),
+            )
+        except (TypeError, ValueError) as e:
+            self.publish_response({"type": "profile_report", "error": f"Invalid profile parameters: {e}"})
+            return
+
+        def finished(report):
+            logging.info(f"[{self.sensor_id}] Profiling finished after {report['duration']}s")
+            self.publish_response(report)
+
+        self.profiling = session
+        logging.info(f"[{self.sensor_id}] Profiling started: mode={session.mode}, duration={session.duration}s, commands={session.commands}")
+        session.start(finished)
+
     def testing_function(self):
         print ("successfull")
 
@@ -276,99 +3454,180 @@ class MQTTSubscriber:
     def init_camera(self):
         """Initialize ONVIF Camera and return PTZ & media services."""
         try:
-            cam_config = camera_details
+            cam_config = self.camera_details
             if not cam_config:
                 print(f"⚠️ Camera {self.sensor_id} not found in configuration.")
                 return None, None, None
 
-            print(f"🎥 Initializing ONVIF Camera: {self.sensor_id} ({cam_config['host']})...")
-            
             if (self.camera == None or self.ptz_service == None or self.profile_token == None):
+                print(f"🎥 Initializing ONVIF Camera: {self.sensor_id} ({cam_config['host']})...")
                 
                 host=str(cam_config["host"])
                 http_port=cam_config["http_port"]
                 username=cam_config["onvifusername"]
                 password=cam_config["onvifpassword"]
                 # Connect to camera
-                self.camera = ONVIFCamera(str(host),int(http_port),str(username),str(password),no_cache=True)
+                ONVIFCamera = lazy_import("onvif").ONVIFCamera
+                transport = self._get_onvif_transport(host, http_port, str(username), str(password))
+                self.camera = ONVIFCamera(str(host),int(http_port),str(username),str(password),no_cache=True,
+                                          transport=transport.transport)
                 time.sleep(1)
 
                 # Create PTZ and media services
                 self.ptz_service = self.camera.create_ptz_service()
-                media_service = self.camera.create_media_service()
+                self.media_service = self.camera.create_media_service()
                 
                 # Fetch media profile
-                profiles = media_service.GetProfiles()
+                profiles = self.media_service.GetProfiles()
                 if not profiles:
                     print(f"⚠️ No media profiles found for {self.sensor_id}.")
                     return None, None, None
+                self.media_profile = profiles[0]
                 self.profile_token = profiles[0].token
 
-                print("Yes Bro")
+                # A new session may mean the camera was reconfigured or rebooted
+                self._encoder_cache.clear()
+                self._prebuilt_requests = None
+                self._presets_need_reconcile = True
+
                 # media_profile = profiles[0].token  # Use the first profile
+                print(f"✅ ONVIF Camera initialized: {self.sensor_id} (Profile: {self.profile_token})")
+                self.status.update(onvif={"state": "connected", "profile": self.profile_token, "since": time.time()})
             
-            
-            print(f"✅ ONVIF Camera initialized: {self.sensor_id} (Profile: {self.profile_token})")
             return self.camera, self.ptz_service, self.profile_token
 
         except Exception as e:
             print(f"❌ Error initializing camera {self.sensor_id}: {e}")
+            self.status.update(onvif={"state": "error", "error": str(e)[:200], "at": time.time()})
             self.camera = None 
             self.ptz_service = None 
             self.profile_token = None
+            self.media_service = None
+            self.media_profile = None
             return None, None, None
 
 
+    def prebuilt_requests(self):
+        """Prebuilt PTZ requests for the current session, or None to go through zeep."""
+        if self._prebuilt_requests is None:
+            if not self.onvif_transport or not self.onvif_transport.settings["prebuilt_requests"]:
+                return None
+            try:
+                self._prebuilt_requests = PrebuiltPTZRequests(self.ptz_service, self.profile_token, self.onvif_transport)
+            except Exception as e:
+                logging.warning(f"[{self.sensor_id}] Prebuilt PTZ requests unavailable, using zeep: {e}")
+                self._prebuilt_requests = False
+        return self._prebuilt_requests or None
+
+    def _get_onvif_transport(self, host, port, username, password):
+        """Reuse the pooled transport unless the camera address or credentials changed."""
+        if self.onvif_transport and self.onvif_transport.matches(host, port, username, password):
+            return self.onvif_transport
+        if self.onvif_transport:
+            self.onvif_transport.close()
+        self.onvif_transport = ONVIFTransport(host, port, username, password, self.onvif_transport_settings)
+        return self.onvif_transport
+
     def cleanup(self):
-        """Enhanced cleanup with timeout and error handling."""
-        try:
-            logging.info(f"[{self.sensor_id}] Starting cleanup...")
-            cleanup_timeout = 10  # seconds
-            cleanup_start = time.time()
-            
-            # Set shutdown event
-            for sensor_id in self._shutdown_events.keys():
-                self._shutdown_events[sensor_id].set()
-            
-            # Stop all patrols
-            with self._patrol_lock:
-                self._active_patrols[self.sensor_id] = False
-                
-                for thread in self._patrol_threads.values():
-                    thread_timeout = max(0, cleanup_timeout - (time.time() - cleanup_start))
-                    if thread.is_alive():
-                        thread.join(timeout=thread_timeout)
-            
-            # Stop all streams
-            with self._ffmpeg_lock:
-                for sensor_id in list(self.ffmpeg_processes.keys()):
-                    try:
-                        logging.info(f"Stopping stream for {sensor_id}")
-                        stop_on_demand_stream()
-                    except Exception as e:
-                        logging.error(f"Error stopping stream for {sensor_id}: {e}")
-            
-            # Stop MQTT client
+        """Tear everything down in parallel against one deadline (service_settings.shutdown); returns the timings."""
+        if self._shutting_down:
+            return self.last_shutdown
+        self._shutting_down = True
+
+        settings = dict(DEFAULT_SHUTDOWN_SETTINGS, **((config or {}).get("service_settings", {}).get("shutdown") or {}))
+        logging.info(f"[{self.sensor_id}] Starting cleanup (deadline {settings['deadline']}s)...")
+        coordinator = ShutdownCoordinator(float(settings["deadline"]))
+
+        def grace():
+            # SIGTERM right away; SIGKILL early enough that the kill still fits in the deadline
+            return min(float(settings["term_grace"]), max(0.0, coordinator.remaining() - 1.0))
+
+        coordinator.run("patrols", lambda: self._stop_patrol_threads(coordinator))
+        coordinator.run("streams", lambda: self._stop_all_streams(grace()))
+        if self.media_cache:
+            coordinator.run("media_cache", lambda: self.media_cache.stop(grace()))
+        coordinator.run("timers", self._cancel_timers)
+        coordinator.run("command_queue", self.command_scheduler.stop)
+        for name in ("telemetry", "config_watcher", "config_stream", "stream_governor", "stream_prober"):
+            component = getattr(self, name)
+            if component:
+                coordinator.run(name, component.stop)
+        if self.onvif_transport:
+            coordinator.run("onvif_transport", self.onvif_transport.close)
+        if self.profiling:
+            coordinator.run("profiling", self.profiling.finish)
+        # The last telemetry samples and the profiling report go out before the disconnect
+        coordinator.run("mqtt", lambda: self._disconnect_mqtt(coordinator.remaining() - 0.5),
+                        after=("telemetry", "profiling"))
+
+        report = coordinator.wait()
+        self.last_shutdown = dict(report, sensor_id=self.sensor_id, at=time.time())
+        save_json_cache(LAST_SHUTDOWN_CACHE, self.last_shutdown)
+        steps = ", ".join(
+            f"{name} {timing['seconds']}s" if timing["seconds"] is not None else f"{name} TIMED OUT"
+            for name, timing in sorted(report["steps"].items(), key=lambda item: -(item[1]["seconds"] or float("inf")))
+        )
+        logging.info(f"[{self.sensor_id}] Cleanup finished in {report['total_seconds']}s ({steps})")
+
+        # Handlers are closed by logging's own atexit hook; just make sure nothing is left in a buffer
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+        return self.last_shutdown
+
+    def _stop_patrol_threads(self, coordinator):
+        """Signal every patrol at once, then join them against the shared deadline."""
+        with self._patrol_lock:
+            for event in self._shutdown_events.values():
+                event.set()
+            self._active_patrols[self.sensor_id] = False
+            threads = list(self._patrol_threads.values())
+        # On-camera tours keep running on the camera, as they do across restarts
+        for thread in threads:
+            if thread.is_alive():
+                thread.join(timeout=coordinator.remaining())
+
+    def _stop_all_streams(self, grace):
+        with self._ffmpeg_lock:
+            processes = dict(self.ffmpeg_processes)
+            self.ffmpeg_processes.clear()
+            for stream_id in processes:
+                self._stream_info.pop(stream_id, None)
+                self.stream_slots.release(stream_id)
+        if processes:
+            logging.info(f"[{self.sensor_id}] Stopping streams: {', '.join(sorted(processes))}")
+            killed = terminate_processes(processes.values(), grace)
+            if killed:
+                logging.warning(f"[{self.sensor_id}] {killed} ffmpeg process(es) ignored SIGTERM and were killed")
+
+    def _cancel_timers(self):
+        self._preset_reconciler_stop.set()
+        # Pending status publish would race the disconnect
+        self.status.cancel()
+        with self._timers_lock:
+            timers, self._timers = self._timers, set()
+        for timer in timers:
             try:
-                logging.info("Stopping MQTT client...")
-                self.client.loop_stop()
-                self.client.disconnect()
+                timer.cancel()
+            except RuntimeError:
+                pass  # event loop already closed
+
+    def _disconnect_mqtt(self, timeout=2.0):
+        logging.info("Stopping MQTT client...")
+        # A clean DISCONNECT discards the last will, so leave the offline status ourselves
+        self.status.close()
+        if self._connected_event.is_set():
+            try:
+                message = self.client.publish(self.status_topic(), self.offline_status(), qos=1, retain=True)
+                message.wait_for_publish(timeout=max(0.1, timeout))
             except Exception as e:
-                logging.error(f"Error disconnecting MQTT client: {e}")
-            
-            logging.info("Cleanup completed successfully")
-            
-        except Exception as e:
-            logging.error(f"Error during cleanup: {e}")
-        finally:
-            # Ensure all handlers are closed
-            for handler in logging.handlers[:]:
-                handler.close()
-                logging.removeHandler(handler)
+                logging.warning(f"[{self.sensor_id}] Could not publish offline status: {e}")
+        self.client.disconnect()
+        self.client.loop_stop()
 
     # MongoDB Connection
     def get_mongo_client_setup(self):
         try:
+            pymongo = lazy_import("pymongo")
             client = pymongo.MongoClient(mongo_db_client["uri"], tls=True, tlsAllowInvalidCertificates=True)
             logging.info("MongoDB connection established")
             return client
@@ -401,6 +3660,163 @@ class MQTTSubscriber:
             logging.error(f"Error fetching config: {e}")
             return None
 
+    # Hot Reload Local Config File
+    def reload_config_file(self, content):
+        """Config watcher callback: parse configuration.json and apply it, keeping the old one if it's invalid."""
+        try:
+            new_config = json.loads(content)
+        except ValueError as e:
+            logging.error(f"[{self.sensor_id}] Ignoring unparsable configuration.json: {e}")
+            self.status.update(config_reload={"state": "rejected", "error": f"invalid JSON: {e}", "at": time.time()})
+            return False
+        return self.apply_config(new_config)
+
+    def apply_config(self, new_config):
+        """Apply a new configuration to the running subscriber; roll back to the current one on failure."""
+        if not validate_config(new_config):
+            self.status.update(config_reload={"state": "rejected", "error": "validation failed", "at": time.time()})
+            return False
+
+        previous = config
+        try:
+            restart_required = self._apply_config(new_config)
+        except Exception as e:
+            logging.error(f"[{self.sensor_id}] Failed to apply configuration, rolling back: {e}")
+            try:
+                self._apply_config(previous)
+            except Exception as rollback_error:
+                logging.error(f"[{self.sensor_id}] Rollback failed: {rollback_error}")
+            self.status.update(config_reload={"state": "rolled_back", "error": str(e)[:200], "at": time.time()})
+            return False
+
+        if restart_required:
+            logging.warning(f"[{self.sensor_id}] Changes to {', '.join(restart_required)} take effect after a restart")
+        logging.info(f"🔁 [{self.sensor_id}] Configuration reloaded ({config_version(new_config)})")
+        self.status.update(
+            config_version=config_version(new_config),
+            config_reload={"state": "applied", "restart_required": restart_required, "at": time.time()},
+        )
+        return True
+
+    def _apply_config(self, new_config):
+        """Swap the parts of the configuration that can change at runtime; returns what needs a restart."""
+        global config, camera_details, mqtt_topics, mongo_db_client, system_settings
+
+        old_settings = (config or {}).get("service_settings", {})
+        settings = new_config["service_settings"]
+        old_details = self.camera_details or {}
+        new_details = settings["camera_details"]
+
+        restart_required = []
+        if new_config.get("sensor_id") != (config or {}).get("sensor_id"):
+            restart_required.append("sensor_id")
+        if settings.get("mqtt_settings") != old_settings.get("mqtt_settings"):
+            restart_required.append("mqtt_settings")
+
+        # Camera address, credentials or transport: reconnect on the next command, keeping everything else warm
+        transport_settings = dict(settings.get("onvif_transport") or {}, **(new_details.get("onvif_transport") or {}))
+        connection_keys = ("host", "http_port", "onvifusername", "onvifpassword")
+        if transport_settings != self.onvif_transport_settings:
+            self.onvif_transport_settings = transport_settings
+            if self.onvif_transport:
+                self.onvif_transport.close()
+                self.onvif_transport = None
+            self.camera = None
+        if any(new_details.get(key) != old_details.get(key) for key in connection_keys):
+            self.camera = None
+        if self.camera is None:
+            self.ptz_service = self.profile_token = self.media_service = self.media_profile = None
+            self.status.update(onvif={"state": "not_initialized"})
+
+        if new_details.get("presets", []) != old_details.get("presets", []):
+            with self._preset_lock:
+                self.presets = PresetTable(new_details.get("presets", []))
+                self._presets_need_reconcile = True
+        self.preset_reconcile_interval = new_details.get("preset_reconcile_interval", DEFAULT_PRESET_RECONCILE_INTERVAL)
+        self.position_model.speeds = dict(DEFAULT_PTZ_SPEED, **(new_details.get("ptz_speed") or {}))
+
+        limits = merge_command_limits(settings.get("command_limits"), new_details.get("command_limits"))
+        if limits != self.command_scheduler.settings:
+            self.command_scheduler.configure(limits)
+
+        self.status.settings = dict(DEFAULT_STATUS_SETTINGS, **(settings.get("status") or {}))
+
+        media_settings = dict(DEFAULT_MEDIA_CACHE_SETTINGS, **(settings.get("media_cache") or {}))
+        if not media_settings["enabled"]:
+            if self.media_cache:
+                self.media_cache.stop()
+            self.media_cache = None
+        elif self.media_cache:
+            self.media_cache.configure(media_settings)
+        else:
+            self.media_cache = MediaCache(media_settings)
+
+        governor_settings = settings.get("stream_governor") or {}
+        if governor_settings != (old_settings.get("stream_governor") or {}):
+            # Starts again at the best level and steps down from there if still hot
+            if self.stream_governor:
+                self.stream_governor.stop()
+            self.stream_governor = None
+            if dict(DEFAULT_STREAM_GOVERNOR_SETTINGS, **governor_settings)["enabled"]:
+                self.stream_governor = StreamGovernor(self.on_stream_quality_change, governor_settings)
+                self.stream_governor.start()
+
+        probe_settings = settings.get("stream_probe") or {}
+        if probe_settings != (old_settings.get("stream_probe") or {}):
+            if self.stream_prober:
+                self.stream_prober.stop()
+            self.stream_prober = None
+            if dict(DEFAULT_STREAM_PROBE_SETTINGS, **probe_settings)["enabled"]:
+                self.stream_prober = StreamProber(self.stream_sources, self.expected_stream, self.on_stream_probe, probe_settings)
+                self.stream_prober.start()
+
+        # Running streams keep their slots; the new limits apply to the next start
+        with self._ffmpeg_lock:
+            self.stream_slots.configure(dict(settings.get("on_demand_streams") or {}, **(new_details.get("on_demand_streams") or {})))
+
+        telemetry_settings = settings.get("telemetry") or {}
+        if telemetry_settings != (old_settings.get("telemetry") or {}):
+            if self.telemetry:
+                self.telemetry.stop()
+            self.telemetry = None
+            if telemetry_settings.get("enabled"):
+                self.telemetry = PositionTelemetry(self.refresh_position, self.publish_telemetry, telemetry_settings)
+                if self._startup_subscribed:
+                    self.telemetry.start()
+
+        # Topics last, once everything they lead to is in place
+        old_topics = mqtt_topics
+        config = new_config
+        camera_details = self.camera_details = new_details
+        mqtt_topics = settings["mqtt_topics"]
+        mongo_db_client = settings["mongo_db_client"]
+        system_settings = settings["system"]
+        if old_topics and (old_topics["control"], old_topics["response"]) != (mqtt_topics["control"], mqtt_topics["response"]):
+            self.client.unsubscribe([topic.format(sensor_id=self.sensor_id) for topic in (old_topics["control"], old_topics["response"])])
+            topics = [topic.format(sensor_id=self.sensor_id) for topic in (mqtt_topics["control"], mqtt_topics["response"])]
+            self.client.subscribe([(topic, 0) for topic in topics])
+            print(f"📡 Subscribed to topics: {', '.join(topics)}")
+
+        return restart_required
+
+    # Config Pushed From MongoDB
+    def apply_pushed_config(self, new_config):
+        """ConfigStream callback: apply through the normal path, then persist it as configuration.json."""
+        if not self.apply_config(new_config):
+            return False
+        try:
+            save_config(new_config)
+        except Exception as e:
+            logging.error(f"[{self.sensor_id}] Applied pushed config but failed to save it: {e}")
+        return True
+
+    def start_config_stream(self, settings):
+        """Follow this device's config document in MongoDB (service_settings.config_push)."""
+        self.config_stream = ConfigStream(
+            self.sensor_id, mongo_db_client, self.apply_pushed_config, lambda: config, settings
+        )
+        self.config_stream.start()
+
     # Update Local Config File
     def update_local_config(self,sensor_id):
         global camera_details
@@ -416,11 +3832,10 @@ class MQTTSubscriber:
             return
 
         try:
-            config_path = f"{ROOT_DIR}/configuration.json"  
-            with open(config_path, "w") as file:
-                json.dump(new_config, file, indent=4)
+            # Atomic, and skipped by the config watcher: the restart below applies it
+            save_config(new_config)
 
-            logging.info(f"Configuration updated at {config_path}")
+            logging.info(f"Configuration updated at {ROOT_DIR}/configuration.json")
 
             # camera_details = new_config.get("camera_details", {})
             self.restart_services()
@@ -447,8 +3862,13 @@ class MQTTSubscriber:
         except Exception as e:
             logging.error(f"Unexpected error during service restart: {e}")
     def start_streaming(self, rtmp_url, stream_timer, fps=15):
-        if not isinstance(fps, int):
+        if fps is None:
             fps = 15
+        elif isinstance(fps, bool) or not isinstance(fps, (int, float)):
+            print(f"⚠️ [{self.sensor_id}] Invalid streaming FPS {fps!r}, using 15.")
+            fps = 15
+        elif not isinstance(fps, int):
+            fps = round(fps)
         if not isinstance(stream_timer, int):
             stream_timer = 5
         """Update config with RTMP URL, FPS, Timer, and restart streaming service."""
@@ -458,20 +3878,23 @@ class MQTTSubscriber:
             with open(config_path, "r") as file:
                 config_data = json.load(file)
 
+            # A hot Pi streams at the governor's fps cap; the requested fps comes back when it cools down
+            streaming_fps = self.stream_governor.live_fps(fps) if self.stream_governor else fps
             config_data["service_settings"]["camera_details"]["RTMP_URL"] = rtmp_url
             config_data["streaming_service"]["live_streaming"] = "True"
             config_data["streaming_service"]["stream_timer"] = stream_timer
-            config_data["streaming_service"]["streaming_fps"] = fps
+            config_data["streaming_service"]["streaming_fps"] = streaming_fps
 
-            with open(config_path, "w") as file:
-                json.dump(config_data, file, indent=4)
+            save_config(config_data)
 
-            print(f"✅ [{self.sensor_id}] Streaming started. RTMP: {rtmp_url}, FPS: {fps}, Duration: {stream_timer} mins")
+            print(f"✅ [{self.sensor_id}] Streaming started. RTMP: {rtmp_url}, FPS: {streaming_fps}, Duration: {stream_timer} mins")
+            self.status.update(live_streaming={"rtmp_url": rtmp_url, "fps": fps, "streaming_fps": streaming_fps,
+                                               "stream_timer": stream_timer})
             self.restart_services("cam_stream.service")
 
             # Schedule auto-stop if not "always"
             if isinstance(stream_timer, int):
-                threading.Timer(stream_timer * 60, self.stop_streaming).start()
+                self.call_later(stream_timer * 60, self.stop_streaming)
 
         except Exception as e:
             print(f"❌ [{self.sensor_id}] Error updating RTMP config: {e}")
@@ -488,55 +3911,264 @@ class MQTTSubscriber:
             config_data["streaming_service"]["stream_timer"] = 5
             config_data["streaming_service"]["streaming_fps"] = 15
 
-            with open(config_path, "w") as file:
-                json.dump(config_data, file, indent=4)
+            save_config(config_data)
 
             print(f"🛑 [{self.sensor_id}] Stopping RTMP stream...")
+            self.status.update(live_streaming=None)
             restart_services("cam_stream.service")
 
         except Exception as e:
             print(f"❌ [{self.sensor_id}] Error stopping stream: {e}")
 
-    def start_on_demand_stream(self, rtmp_url, video_file):
-        """Start streaming video to RTMP using FFmpeg."""
-        if self.sensor_id in self.ffmpeg_processes:
-            print(f"⚠️ [{self.sensor_id}] Stream already running. Stop it first!")
-            return
-
+    def start_on_demand_stream(self, rtmp_url, video_file, stream_id=None):
+        """Start streaming video to RTMP using FFmpeg, as one of possibly several streams on this device."""
+        stream_id = str(stream_id) if stream_id is not None else f"stream-{next(self._stream_ids)}"
         if not os.path.exists(video_file):
             print(f"❌ [{self.sensor_id}] Video file not found: {video_file}")
+            self.publish_response({"type": "on_demand_stream", "stream_id": stream_id, "error": "video file not found"})
             return
 
-        ffmpeg_cmd = [
-            "ffmpeg", "-re", "-i", video_file, "-c:v", "libx264", "-preset", "ultrafast",
-            "-tune", "zerolatency", "-b:v", "800k", "-maxrate", "800k", "-bufsize", "1600k",
-            "-vf", "scale=1280:720", "-c:a", "aac", "-b:a", "128k", "-f", "flv", rtmp_url
-        ]
+        rendition = self.media_cache.lookup(video_file) if self.media_cache else None
+        ffmpeg_cmd = self.on_demand_command(video_file, rtmp_url, rendition)
 
-        try:
-            process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            self.ffmpeg_processes[self.sensor_id] = process
-            print(f"🎥 [{self.sensor_id}] Started streaming {video_file} to {rtmp_url}")
+        with self._ffmpeg_lock:
+            # Streams that ended on their own give their slot back first
+            self.reap_on_demand_streams()
+            if stream_id in self.ffmpeg_processes:
+                print(f"⚠️ [{self.sensor_id}] Stream {stream_id} already running. Stop it first!")
+                self.publish_response({"type": "on_demand_stream", "stream_id": stream_id, "error": "already running"})
+                return
 
+            slot = self.stream_slots.reserve(stream_id, "remux" if rendition else "encode")
+            if slot is None:
+                print(f"⚠️ [{self.sensor_id}] No free stream slot for {stream_id} ({len(self.ffmpeg_processes)} running)")
+                self.publish_response({"type": "on_demand_stream", "stream_id": stream_id, "error": "no free stream slot",
+                                       "slots": self.stream_slots.snapshot()})
+                return
+
+            try:
+                process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except Exception as e:
+                self.stream_slots.release(stream_id)
+                print(f"❌ [{self.sensor_id}] Error starting stream: {e}")
+                self.publish_response({"type": "on_demand_stream", "stream_id": stream_id, "error": str(e)})
+                return
+
+            self.stream_slots.apply(slot, process.pid)
+            self.ffmpeg_processes[stream_id] = process
+            self._stream_info[stream_id] = {
+                "video_file": video_file,
+                "rtmp_url": rtmp_url,
+                "mode": "remux" if rendition else "encode",
+                "quality": None if rendition else self.stream_quality()["name"],
+                "cores": slot["cores"],
+                "nice": slot["nice"],
+                "started_at": time.time(),
+            }
+            self.status.update(on_demand_streams=sorted(self.ffmpeg_processes))
+        print(f"🎥 [{self.sensor_id}] Started stream {stream_id}: {video_file} to {rtmp_url} ({'cached rendition' if rendition else 'live encode'})")
+        self.publish_response({"type": "on_demand_stream", "event": "started", **self.stream_status(stream_id)})
+
+    def stream_quality(self):
+        return self.stream_governor.current() if self.stream_governor else STREAM_QUALITY_LEVELS[0]
+
+    def on_demand_command(self, video_file, rtmp_url, rendition=None, offset=0):
+        """ffmpeg command for an on-demand stream, starting `offset` seconds into the file."""
+        seek = ["-ss", f"{offset:.1f}"] if offset else []
+        # A cached rendition is already H.264/AAC at the streaming size: remux it. Otherwise encode live
+        # (at the governor's current level) while the cache prepares a rendition for the next play.
+        if rendition:
+            return ["ffmpeg", "-re"] + seek + ["-i", rendition, "-c", "copy", "-f", "flv", rtmp_url]
+        params = dict(self.media_cache.params if self.media_cache else MEDIA_RENDITION_PARAMS, preset="ultrafast")
+        if self.stream_governor:
+            params = self.stream_governor.apply(params)
+        return ["ffmpeg", "-re"] + seek + ["-i", video_file] + encode_arguments(params) + ["-tune", "zerolatency", "-f", "flv", rtmp_url]
+
+    def on_stream_quality_change(self, change):
+        """StreamGovernor callback: report the new level and move running encodes and the live stream to it."""
+        print(f"🌡️ [{self.sensor_id}] Streaming quality {change['previous']} -> {change['name']} ({change['reason']})")
+        self.status.update(stream_governor=self.stream_governor.snapshot() if self.stream_governor else change)
+        self.publish_response({"type": "stream_governor", **change})
+        settings = self.stream_governor.settings if self.stream_governor else DEFAULT_STREAM_GOVERNOR_SETTINGS
+        if settings["restart_encodes"]:
+            self._restart_encode_streams()
+        if settings["apply_to_live_streaming"] and self.status.fields.get("live_streaming"):
+            self._apply_live_streaming_fps()
+
+    def _restart_encode_streams(self):
+        """Relaunch running live encodes at the current level, resuming about where each one was."""
+        quality = self.stream_quality()["name"]
+        with self._ffmpeg_lock:
+            restarts = []
+            for stream_id, info in list(self._stream_info.items()):
+                process = self.ffmpeg_processes.get(stream_id)
+                slot = self.stream_slots.get(stream_id)
+                if info["mode"] != "encode" or info.get("quality") == quality or not process or not slot or process.poll() is not None:
+                    continue
+                restarts.append((stream_id, process, info.get("offset", 0) + time.time() - info["started_at"]))
+
+        # One grace period for all of them, not one per stream; without the lock, so stream commands
+        # aren't held up meanwhile
+        terminate_processes([process for _, process, _ in restarts], grace=5)
+
+        with self._ffmpeg_lock:
+            quality = self.stream_quality()["name"]
+            for stream_id, old_process, offset in restarts:
+                info = self._stream_info.get(stream_id)
+                slot = self.stream_slots.get(stream_id)
+                # Stopped (or stopped and started again) while the old ffmpeg was exiting
+                if info is None or slot is None or self.ffmpeg_processes.get(stream_id) is not old_process:
+                    continue
+                ffmpeg_cmd = self.on_demand_command(info["video_file"], info["rtmp_url"], offset=offset)
+                try:
+                    process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                    self.stream_slots.apply(slot, process.pid)
+                    self.ffmpeg_processes[stream_id] = process
+                except Exception as e:
+                    logging.error(f"[{self.sensor_id}] Could not restart stream {stream_id} at {quality}: {e}")
+                    self.ffmpeg_processes.pop(stream_id, None)
+                    self._stream_info.pop(stream_id, None)
+                    self.stream_slots.release(stream_id)
+                    continue
+                info.update(quality=quality, offset=offset, started_at=time.time())
+                print(f"🔁 [{self.sensor_id}] Stream {stream_id} continues at {quality} from {offset:.0f}s")
+            self.status.update(on_demand_streams=sorted(self.ffmpeg_processes))
+
+    def _apply_live_streaming_fps(self):
+        """Rewrite streaming_fps for the camera stream service if the governor's cap changed it."""
+        live = self.status.fields["live_streaming"]
+        streaming_fps = self.stream_governor.live_fps(live["fps"]) if self.stream_governor else live["fps"]
+        if streaming_fps == live.get("streaming_fps"):
+            return
+        try:
+            with open(f"{ROOT_DIR}/configuration.json", "r") as file:
+                config_data = json.load(file)
+            config_data["streaming_service"]["streaming_fps"] = streaming_fps
+            save_config(config_data)
         except Exception as e:
-            print(f"❌ [{self.sensor_id}] Error starting stream: {e}")
+            logging.error(f"[{self.sensor_id}] Could not update streaming_fps: {e}")
+            return
+        self.status.update(live_streaming=dict(live, streaming_fps=streaming_fps))
+        self.restart_services("cam_stream.service")
+
+    def cache_media(self, video_files):
+        """Prepare renditions of video_files in the background, ahead of their first play."""
+        if not self.media_cache:
+            self.publish_response({"type": "media_cache", "error": "media cache disabled"})
+            return
+        scheduled = self.media_cache.prewarm(video_files)
+        self.publish_response({"type": "media_cache", "scheduled": scheduled, **self.media_cache.snapshot()})
+
+    def stop_on_demand_stream(self, stream_id=None):
+        """Stop one on-demand stream, or all of them when no stream_id is given."""
+        with self._ffmpeg_lock:
+            stream_ids = [str(stream_id)] if stream_id is not None else list(self.ffmpeg_processes)
+            stream_ids = [sid for sid in stream_ids if sid in self.ffmpeg_processes]
+            if not stream_ids:
+                print(f"⚠️ [{self.sensor_id}] No active stream to stop.")
+                return
 
-    def stop_on_demand_stream(self):
-        """Stop FFmpeg streaming for this camera."""
-        if self.sensor_id in self.ffmpeg_processes:
-            process = self.ffmpeg_processes[self.sensor_id]
-            process.terminate()  # Send SIGTERM to stop FFmpeg
-            process.wait()
-            del self.ffmpeg_processes[self.sensor_id]
-            print(f"🛑 [{self.sensor_id}] Stopped video stream.")
+            processes = [self.ffmpeg_processes.pop(sid) for sid in stream_ids]
+            for sid in stream_ids:
+                self._stream_info.pop(sid, None)
+                self.stream_slots.release(sid)
+            self.status.update(on_demand_streams=sorted(self.ffmpeg_processes))
+
+        # SIGTERM all of them at once, SIGKILL any that are still running 5s later; without the lock,
+        # so other streams can start or stop meanwhile
+        terminate_processes(processes, grace=5)
+        for sid in stream_ids:
+            print(f"🛑 [{self.sensor_id}] Stopped video stream {sid}.")
+        self.publish_response({"type": "on_demand_stream", "event": "stopped", "stream_ids": stream_ids})
+
+    def reap_on_demand_streams(self):
+        """Forget streams whose ffmpeg exited on its own and free their slots; returns [(stream_id, returncode)]."""
+        exited = [(sid, process.returncode) for sid, process in list(self.ffmpeg_processes.items()) if process.poll() is not None]
+        for sid, _ in exited:
+            self.ffmpeg_processes.pop(sid, None)
+            self._stream_info.pop(sid, None)
+            self.stream_slots.release(sid)
+        if exited:
+            self.status.update(on_demand_streams=sorted(self.ffmpeg_processes))
+        return exited
+
+    def stream_status(self, stream_id):
+        process = self.ffmpeg_processes.get(stream_id)
+        info = self._stream_info.get(stream_id, {})
+        status = {"stream_id": stream_id, **info}
+        if process:
+            status.update(pid=process.pid, running=process.poll() is None, returncode=process.returncode,
+                          cpu_seconds=process_cpu_seconds(process.pid))
+        if "started_at" in info:
+            status["uptime"] = round(time.time() - info["started_at"], 1)
+        return status
+
+    def report_on_demand_streams(self, stream_id=None):
+        """Answer a get_on_demand_streams command: one stream, or all of them plus free capacity."""
+        with self._ffmpeg_lock:
+            stream_ids = [str(stream_id)] if stream_id is not None else sorted(self.ffmpeg_processes)
+            streams = [self.stream_status(sid) for sid in stream_ids if sid in self.ffmpeg_processes]
+            slots = self.stream_slots.snapshot()
+        self.publish_response({"type": "on_demand_streams", "streams": streams, "slots": slots})
+
+    def get_ptz_capabilities(self, refresh=False):
+        """Return PTZ capabilities, discovering them once per camera and persisting the result."""
+        if self.ptz_capabilities is not None and not refresh:
+            return self.ptz_capabilities
+
+        host = str(self.camera_details.get("host")) if self.camera_details else None
+        cache = load_json_cache(PTZ_CAPABILITIES_CACHE)
+        cached = cache.get(self.sensor_id)
+        if cached and cached.get("host") == host and not refresh:
+            self.ptz_capabilities = cached["capabilities"]
+            self._apply_position_limits()
+            return self.ptz_capabilities
+
+        camera, ptz_service, profile_token = self.init_camera()
+        if not ptz_service:
+            return None
+
+        try:
+            capabilities = discover_ptz_capabilities(ptz_service, self.media_profile)
+        except Exception as e:
+            logging.error(f"[{self.sensor_id}] PTZ capability discovery failed: {e}")
+            return None
 
-        else:
-            print(f"⚠️ [{self.sensor_id}] No active stream to stop.")
+        cache[self.sensor_id] = {"host": host, "capabilities": capabilities}
+        save_json_cache(PTZ_CAPABILITIES_CACHE, cache)
+        self.ptz_capabilities = capabilities
+        self._apply_position_limits()
+        logging.info(f"[{self.sensor_id}] PTZ capabilities discovered: move types {capabilities['move_types']}")
+        return capabilities
+
+    def _apply_position_limits(self):
+        """Bound the position model by the camera's absolute position spaces."""
+        spaces = self.ptz_capabilities["spaces"]
+        pan_tilt = spaces.get("absolute_pan_tilt") or {}
+        zoom = spaces.get("absolute_zoom") or {}
+        self.position_model.limits = {"pan": pan_tilt.get("x"), "tilt": pan_tilt.get("y"), "zoom": zoom.get("x")}
+
+    def refresh_ptz_capabilities(self):
+        """Force a new capability discovery (e.g. after a firmware update)."""
+        self.ptz_capabilities = None
+        capabilities = self.get_ptz_capabilities(refresh=True)
+        print(f"🧭 [{self.sensor_id}] PTZ capabilities: {json.dumps(capabilities)}")
+
+    def supports_move(self, move_type):
+        """Check whether the camera supports a move type; unknown capabilities allow everything."""
+        capabilities = self.get_ptz_capabilities()
+        return capabilities is None or move_type in capabilities["move_types"]
 
     def move_camera(self, pan, tilt, zoom, velocity=0.5):
         """Move PTZ camera with velocity indefinitely until a stop command is received."""
         print(f"🎥 Moving {self.sensor_id} - Pan: {pan}, Tilt: {tilt}, Zoom: {zoom}, Velocity: {velocity}")
 
+        try:
+            pan, tilt, zoom, velocity = float(pan), float(tilt), float(zoom), float(velocity)
+        except (TypeError, ValueError):
+            print(f"❌ [{self.sensor_id}] Invalid move parameters: pan={pan}, tilt={tilt}, zoom={zoom}, velocity={velocity}")
+            return
+
         # Ensure velocity is within safe limits
         velocity = max(0.1, min(velocity, 1.0))
 
@@ -545,18 +4177,41 @@ class MQTTSubscriber:
         if not ptz_service:
             print(f"⚠️ PTZ service unavailable. Cannot move camera.")
             return
-        print(camera,ptz_service,profile_token)
-        # Create movement request
-        move_request = ptz_service.create_type("ContinuousMove")
-        move_request.ProfileToken = profile_token
-        move_request.Velocity = {
-            "PanTilt": {"x": pan * velocity, "y": tilt * velocity},
-            "Zoom": {"x": zoom * velocity}
-        }
+
+        # Validate against the camera's velocity spaces instead of waiting for a SOAP fault
+        capabilities = self.get_ptz_capabilities()
+        spaces = capabilities["spaces"] if capabilities else {}
+        if capabilities and "continuous" not in capabilities["move_types"]:
+            print(f"⚠️ [{self.sensor_id}] Camera does not support ContinuousMove.")
+            return
+
+        velocity_vector = {}
+        pan_tilt_space = spaces.get("continuous_pan_tilt")
+        if pan_tilt_space or not capabilities:
+            pan_tilt_space = pan_tilt_space or {}
+            velocity_vector["PanTilt"] = {
+                "x": clamp(scale_to_range(pan * velocity, pan_tilt_space.get("x")), pan_tilt_space.get("x")),
+                "y": clamp(scale_to_range(tilt * velocity, pan_tilt_space.get("y")), pan_tilt_space.get("y")),
+            }
+        zoom_space = spaces.get("continuous_zoom")
+        if zoom_space or not capabilities:
+            zoom_space = zoom_space or {}
+            velocity_vector["Zoom"] = {"x": clamp(scale_to_range(zoom * velocity, zoom_space.get("x")), zoom_space.get("x"))}
 
         # Start movement
-        ptz_service.ContinuousMove(move_request)
+        prebuilt = self.prebuilt_requests()
+        if prebuilt:
+            prebuilt.continuous_move(velocity_vector)
+        else:
+            move_request = ptz_service.create_type("ContinuousMove")
+            move_request.ProfileToken = profile_token
+            move_request.Velocity = velocity_vector
+            ptz_service.ContinuousMove(move_request)
+        self.position_model.start_continuous(
+            *(max(-1.0, min(value * velocity, 1.0)) for value in (pan, tilt, zoom))
+        )
         print(f"✅ [{self.sensor_id}] Camera is moving... Send 'stop' command to halt.")
+        self._wake_telemetry()
 
         # except Exception as e:
         #     print(f"❌ Error moving camera {self.sensor_id}: {e}")
@@ -572,18 +4227,25 @@ class MQTTSubscriber:
                 print(f"⚠️ PTZ service unavailable. Cannot stop camera.")
                 return
 
-            # Create stop request
-            stop_request = ptz_service.create_type("Stop")
-            stop_request.ProfileToken = profile_token
-            stop_request.PanTilt = True
-            stop_request.Zoom = True
-
             # Stop movement
-            ptz_service.Stop(stop_request)
+            prebuilt = self.prebuilt_requests()
+            if prebuilt:
+                prebuilt.stop()
+            else:
+                stop_request = ptz_service.create_type("Stop")
+                stop_request.ProfileToken = profile_token
+                stop_request.PanTilt = True
+                stop_request.Zoom = True
+                ptz_service.Stop(stop_request)
+            self.position_model.stop()
             print(f"✅ [{self.sensor_id}] Camera movement stopped.")
 
         except Exception as e:
             print(f"❌ Error stopping camera {self.sensor_id}: {e}")
+            return
+
+        # Re-anchor the dead-reckoned estimate where the camera actually stopped
+        self.refresh_position()
 
 
     def move_to_preset(self, preset_name):
@@ -591,13 +4253,13 @@ class MQTTSubscriber:
         try:
             print(f"🎯 Looking for preset: {preset_name}...")
 
-            # Ensure "presets" exist in camera details
-            if "presets" not in camera_details or not camera_details["presets"]:
+            # Ensure presets exist for this camera
+            if not self.presets.names():
                 print(f"⚠️ No presets found for sensor {self.sensor_id}.")
                 return
 
             # Find the preset token by name
-            preset_token = next((p["token"] for p in camera_details["presets"] if p["name"] == preset_name), None)
+            preset_token = self.presets.token_for(preset_name)
             if not preset_token:
                 print(f"⚠️ Preset '{preset_name}' not found.")
                 return
@@ -608,130 +4270,579 @@ class MQTTSubscriber:
                 print(f"⚠️ PTZ service unavailable. Cannot move to preset '{preset_name}'.")
                 return
 
-            # Create request to move to preset
-            preset_request = ptz_service.create_type("GotoPreset")
-            preset_request.ProfileToken = profile_token
-            preset_request.PresetToken = preset_token
-
             # Execute preset move
-            ptz_service.GotoPreset(preset_request)
+            prebuilt = self.prebuilt_requests()
+            if prebuilt:
+                prebuilt.goto_preset(preset_token)
+            else:
+                preset_request = ptz_service.create_type("GotoPreset")
+                preset_request.ProfileToken = profile_token
+                preset_request.PresetToken = preset_token
+                ptz_service.GotoPreset(preset_request)
+            self._track_preset_move(preset_name)
             print(f"✅ [{self.sensor_id}] Successfully moved to preset '{preset_name}'")
+            self._wake_telemetry()
 
         except Exception as e:
             print(f"❌ Error moving to preset '{preset_name}': {e}")
 
+    def _track_preset_move(self, preset_name):
+        """Point the position model at a preset the camera was just sent to."""
+        preset_position = self.presets.position_for(preset_name)
+        if preset_position and self.position_model.estimate():
+            self.position_model.move_to(preset_position["pan"], preset_position["tilt"], preset_position["zoom"])
+        else:
+            # Preset coordinates are unknown here; the next position query re-reads GetStatus
+            self.position_model.invalidate()
+
+    def _read_axis_arguments(self, pan, tilt, zoom, speed):
+        """Convert optional numeric command arguments, raising ValueError on junk."""
+        values = []
+        for value in (pan, tilt, zoom, speed):
+            values.append(None if value is None else float(value))
+        return values
+
+    def move_absolute(self, pan=None, tilt=None, zoom=None, speed=None):
+        """Move to an absolute position; axes left as None keep their current position."""
+        print(f"🎯 [{self.sensor_id}] Absolute move - Pan: {pan}, Tilt: {tilt}, Zoom: {zoom}, Speed: {speed}")
+        try:
+            pan, tilt, zoom, speed = self._read_axis_arguments(pan, tilt, zoom, speed)
+        except (TypeError, ValueError):
+            print(f"❌ [{self.sensor_id}] Invalid absolute move parameters.")
+            return
+
+        camera, ptz_service, profile_token = self.init_camera()
+        if not ptz_service:
+            print(f"⚠️ PTZ service unavailable. Cannot move camera.")
+            return
+
+        capabilities = self.get_ptz_capabilities()
+        spaces = capabilities["spaces"] if capabilities else {}
+
+        if not self.supports_move("absolute"):
+            # Emulate with a relative move when we know where the camera is
+            current = self.get_position()
+            if current and self.supports_move("relative"):
+                deltas = [None if target is None else target - current[axis]
+                          for axis, target in zip(PTZ_AXES, (pan, tilt, zoom))]
+                return self.move_relative(*deltas, speed=speed)
+            print(f"⚠️ [{self.sensor_id}] Camera does not support AbsoluteMove.")
+            return
 
+        pan_tilt_space = spaces.get("absolute_pan_tilt") or {}
+        zoom_space = spaces.get("absolute_zoom") or {}
 
-    def create_preset(self, preset_name):
-        """Save the current PTZ position as a preset and update the local configuration."""
+        # PanTilt must carry both axes: fill a missing one from the position model
+        if (pan is None) != (tilt is None):
+            current = self.get_position()
+            if not current:
+                print(f"❌ [{self.sensor_id}] Pan and tilt both required when the position is unknown.")
+                self.publish_response({"type": "command_error", "command": "move_absolute",
+                                       "error": "pan and tilt both required when position is unknown"})
+                return
+            pan = current["pan"] if pan is None else pan
+            tilt = current["tilt"] if tilt is None else tilt
+
+        position = {}
+        if pan is not None and tilt is not None:
+            pan = clamp(pan, pan_tilt_space.get("x"))
+            tilt = clamp(tilt, pan_tilt_space.get("y"))
+            position["PanTilt"] = {"x": pan, "y": tilt}
+        if zoom is not None:
+            zoom = clamp(zoom, zoom_space.get("x"))
+            position["Zoom"] = {"x": zoom}
+        if not position:
+            print(f"⚠️ [{self.sensor_id}] Nothing to move: no target axes given.")
+            return
+
+        request = {"ProfileToken": profile_token, "Position": position}
+        speed_vector = self._speed_vector(speed, position, spaces)
+        if speed_vector:
+            request["Speed"] = speed_vector
+
+        ptz_service.AbsoluteMove(request)
+        self.position_model.move_to(position.get("PanTilt", {}).get("x"), position.get("PanTilt", {}).get("y"),
+                                    position.get("Zoom", {}).get("x"), speed)
+        print(f"✅ [{self.sensor_id}] Absolute move sent: {position}")
+        self._wake_telemetry()
+
+    def move_relative(self, pan=None, tilt=None, zoom=None, speed=None):
+        """Move by a translation relative to the current position."""
+        print(f"↔️ [{self.sensor_id}] Relative move - Pan: {pan}, Tilt: {tilt}, Zoom: {zoom}, Speed: {speed}")
+        try:
+            pan, tilt, zoom, speed = self._read_axis_arguments(pan, tilt, zoom, speed)
+        except (TypeError, ValueError):
+            print(f"❌ [{self.sensor_id}] Invalid relative move parameters.")
+            return
+
+        camera, ptz_service, profile_token = self.init_camera()
+        if not ptz_service:
+            print(f"⚠️ PTZ service unavailable. Cannot move camera.")
+            return
+
+        capabilities = self.get_ptz_capabilities()
+        spaces = capabilities["spaces"] if capabilities else {}
+
+        if not self.supports_move("relative"):
+            # Emulate with an absolute move from the known position
+            current = self.get_position()
+            if current and self.supports_move("absolute"):
+                targets = [None if delta is None else current[axis] + delta
+                           for axis, delta in zip(PTZ_AXES, (pan, tilt, zoom))]
+                return self.move_absolute(*targets, speed=speed)
+            print(f"⚠️ [{self.sensor_id}] Camera does not support RelativeMove.")
+            return
+
+        pan_tilt_space = spaces.get("relative_pan_tilt") or {}
+        zoom_space = spaces.get("relative_zoom") or {}
+
+        translation = {}
+        if pan is not None or tilt is not None:
+            translation["PanTilt"] = {
+                "x": clamp(pan or 0.0, pan_tilt_space.get("x")),
+                "y": clamp(tilt or 0.0, pan_tilt_space.get("y")),
+            }
+        if zoom is not None:
+            translation["Zoom"] = {"x": clamp(zoom, zoom_space.get("x"))}
+        if not translation:
+            print(f"⚠️ [{self.sensor_id}] Nothing to move: no translation given.")
+            return
+
+        # Work out the destination before sending, based on the pre-move estimate
+        current = self.position_model.estimate()
+
+        request = {"ProfileToken": profile_token, "Translation": translation}
+        speed_vector = self._speed_vector(speed, translation, spaces)
+        if speed_vector:
+            request["Speed"] = speed_vector
+
+        ptz_service.RelativeMove(request)
+
+        if current:
+            target = {
+                "pan": current["pan"] + translation.get("PanTilt", {}).get("x", 0.0),
+                "tilt": current["tilt"] + translation.get("PanTilt", {}).get("y", 0.0),
+                "zoom": current["zoom"] + translation.get("Zoom", {}).get("x", 0.0),
+            }
+            self.position_model.move_to(target["pan"], target["tilt"], target["zoom"], speed)
+        print(f"✅ [{self.sensor_id}] Relative move sent: {translation}")
+        self._wake_telemetry()
+
+    def _speed_vector(self, speed, axes, spaces):
+        """Build the optional Speed element, scaled to the camera's speed spaces."""
+        if speed is None:
+            return None
+        speed = max(0.0, min(speed, 1.0))
+        vector = {}
+        if "PanTilt" in axes:
+            pan_tilt_speed = (spaces.get("pan_tilt_speed") or {}).get("x")
+            value = scale_to_range(speed, pan_tilt_speed)
+            vector["PanTilt"] = {"x": value, "y": value}
+        if "Zoom" in axes:
+            vector["Zoom"] = {"x": scale_to_range(speed, (spaces.get("zoom_speed") or {}).get("x"))}
+        return vector
+
+    def refresh_position(self):
+        """Read GetStatus once and anchor the position model to it."""
+        camera, ptz_service, profile_token = self.init_camera()
+        if not ptz_service:
+            return None
 
         try:
-            config_path = f"{ROOT_DIR}/configuration.json"  
+            prebuilt = self.prebuilt_requests()
+            if prebuilt:
+                status = prebuilt.get_status()
+            else:
+                status = ptz_service.GetStatus({"ProfileToken": profile_token})
+        except Exception as e:
+            logging.warning(f"[{self.sensor_id}] GetStatus failed: {e}")
+            self.status.update(onvif={"state": "error", "error": str(e)[:200], "at": time.time()})
+            return None
+
+        position = getattr(status, "Position", None)
+        if position is None:
+            return None
+
+        pan_tilt = getattr(position, "PanTilt", None)
+        zoom = getattr(position, "Zoom", None)
+        move_status = getattr(status, "MoveStatus", None)
+        moving = any(
+            str(getattr(move_status, axis, "IDLE")).upper() == "MOVING" for axis in ("PanTilt", "Zoom")
+        ) if move_status is not None else None
+
+        self.position_model.update_from_status(
+            float(getattr(pan_tilt, "x", 0.0)) if pan_tilt is not None else 0.0,
+            float(getattr(pan_tilt, "y", 0.0)) if pan_tilt is not None else 0.0,
+            float(getattr(zoom, "x", 0.0)) if zoom is not None else 0.0,
+            moving,
+        )
+        estimate = self.position_model.estimate()
+        if moving is not None:
+            # The camera knows about moves the model never saw (GotoPreset, tours, other clients)
+            estimate["moving"] = moving
+        if self.status.fields.get("onvif", {}).get("state") == "error":
+            self.status.update(onvif={"state": "connected", "profile": profile_token, "since": time.time()})
+        if self.status.settings["include_position"]:
+            self.status.update(position={axis: round(estimate[axis], 3) for axis in PTZ_AXES})
+        return estimate
+
+    def get_position(self, refresh=False):
+        """Return the current position from memory, falling back to GetStatus if it is unknown."""
+        position = None if refresh else self.position_model.estimate()
+        if position is None:
+            position = self.refresh_position()
+        return position
+
+    def report_status(self):
+        """Answer a get_status command on the response topic."""
+        self.publish_response({"type": "status", **self.get_status()})
+
+    def report_command_metrics(self):
+        """Answer a get_command_metrics command: limiter counters plus per-command handler timings."""
+        self.publish_response({"type": "command_metrics", **self.command_scheduler.snapshot(),
+                               "timings": self.commands.snapshot()})
+
+    # Stream Probing
+    def stream_sources(self):
+        """Streams to probe: the camera's default_video_source plus service_settings.stream_probe.sources."""
+        sources = {}
+        url = (config or {}).get("default_arguments", {}).get("default_video_source")
+        if url:
+            sources["default"] = url
+        if self.stream_prober:
+            sources.update(self.stream_prober.settings["sources"])
+        return sources
+
+    def expected_stream(self, name):
+        """What the encoder is configured for, from the encoder cache (no ONVIF call); None if unknown."""
+        cached = self._encoder_cache.get(self.profile_token) if name == "default" else None
+        if not cached:
+            return None
+        video_config = cached["config"]
+        rate_control = getattr(video_config, "RateControl", None)
+        resolution = getattr(video_config, "Resolution", None)
+        expected = {
+            "fps": getattr(rate_control, "FrameRateLimit", None),
+            "bitrate_kbps": getattr(rate_control, "BitrateLimit", None),
+            "width": getattr(resolution, "Width", None),
+            "height": getattr(resolution, "Height", None),
+            "gop_frames": getattr(getattr(video_config, "H264", None), "GovLength", None),
+        }
+        return {key: value for key, value in expected.items() if value is not None} or None
+
+    def on_stream_probe(self, name, result, reason):
+        """StreamProber callback: update the status snapshot and answer probes someone asked for."""
+        if result.get("error"):
+            logging.warning(f"[{self.sensor_id}] Stream probe {name} failed: {result['error']}")
+        elif not result["ok"]:
+            failed = [check for check, passed in result["checks"].items() if not passed]
+            logging.warning(f"[{self.sensor_id}] Stream {name} differs from encoder settings ({', '.join(failed)}): "
+                            f"{result['fps']} fps, {result['width']}x{result['height']}, {result['bitrate_kbps']} kbps")
+        self.status.update(stream_probe=self.stream_prober.snapshot() if self.stream_prober else None)
+        if reason != "scheduled":
+            self.publish_response({"type": "stream_probe", "name": name, **result})
+
+    def probe_stream(self, source=None):
+        """Answer a probe_stream command: probe now, the result follows on the response topic."""
+        if not self.stream_prober:
+            self.publish_response({"type": "stream_probe", "error": "stream probing disabled"})
+            return
+        sources = self.stream_sources()
+        if source is not None and str(source) not in sources:
+            self.publish_response({"type": "stream_probe", "name": str(source),
+                                   "error": f"unknown stream source, expected one of: {', '.join(sources) or 'none'}"})
+            return
+        if not sources:
+            self.publish_response({"type": "stream_probe", "error": "no stream sources configured"})
+            return
+        self.stream_prober.request(str(source) if source is not None else None, "command")
+
+    def report_stream_probes(self):
+        """Answer a get_stream_probes command with the cached probe history."""
+        if not self.stream_prober:
+            self.publish_response({"type": "stream_probes", "error": "stream probing disabled"})
+            return
+        self.publish_response({"type": "stream_probes", **self.stream_prober.metrics()})
+
+    def report_position(self, refresh=False):
+        """Answer a get_position command on the response topic."""
+        position = self.get_position(refresh=bool(refresh))
+        self.publish_response({"type": "position", "position": position})
+        print(f"📍 [{self.sensor_id}] Position: {position}")
+
+
+
+    def reconcile_presets(self, force=False):
+        """Sync the preset table with GetPresets when due (schedule, new ONVIF session or force)."""
+        with self._preset_lock:
+            if not (force or self._presets_need_reconcile or self.presets.is_due(self.preset_reconcile_interval)):
+                return True
+
+            camera, ptz_service, profile_token = self.init_camera()
+            if not ptz_service:
+                return False
+
+            try:
+                camera_presets = ptz_service.GetPresets({"ProfileToken": profile_token})
+            except Exception as e:
+                logging.error(f"[{self.sensor_id}] GetPresets failed during reconciliation: {e}")
+                return False
+
+            self._presets_need_reconcile = False
+            if self.presets.reconcile(camera_presets):
+                print("🔄 Removed presets that are no longer available in the camera.")
+                self.persist_presets()
+            logging.info(f"[{self.sensor_id}] Presets reconciled: {len(self.presets.names())} local, {len(camera_presets or [])} on camera")
+            return True
+
+    def start_preset_reconciler(self):
+        """Reconcile presets in the background every preset_reconcile_interval seconds."""
+        def reconcile_loop():
+            while not self._preset_reconciler_stop.wait(timeout=self.preset_reconcile_interval):
+                try:
+                    self.reconcile_presets()
+                except Exception as e:
+                    logging.error(f"[{self.sensor_id}] Scheduled preset reconciliation failed: {e}")
 
-            # Load existing configuration
+        threading.Thread(target=reconcile_loop, name="preset-reconciler", daemon=True).start()
+
+    def persist_presets(self):
+        """Write the preset table to configuration.json in a single write."""
+        config_path = f"{ROOT_DIR}/configuration.json"
+        try:
             with open(config_path, "r") as file:
                 config_data = json.load(file)
 
-            # Initialize camera & PTZ service
+            presets = self.presets.as_list()
+            config_data["service_settings"]["camera_details"]["presets"] = presets
+            save_config(config_data)
+            self.camera_details["presets"] = presets
+        except Exception as e:
+            logging.error(f"[{self.sensor_id}] Failed to persist presets to {config_path}: {e}")
+
+    def create_preset(self, preset_name):
+        """Save the current PTZ position as a preset and update the local configuration."""
+
+        try:
             print(f"📌 Creating preset: {preset_name}...")
-            camera, ptz_service, profile_token = self.init_camera()
 
+            # 🔍 Already known locally: nothing to do on the camera or on disk
+            preset_token = self.presets.token_for(preset_name)
+            if preset_token and not self._presets_need_reconcile:
+                print(f"📌 Preset '{preset_name}' already exists with token: {preset_token}")
+                return
+
+            # Initialize camera & PTZ service
+            camera, ptz_service, profile_token = self.init_camera()
             if not ptz_service:
                 print("⚠️ PTZ service unavailable. Cannot create preset.")
                 return
 
-            # Get current presets from the camera
-            existing_presets = ptz_service.GetPresets({"ProfileToken": profile_token})
-            existing_preset_map = {p.Name: p.token for p in existing_presets}  # Map preset names to tokens
-            print(existing_preset_map)
-
-            # ✅ **Remove non-existing presets from config**
-            if "camera_details" in config_data["service_settings"] and "presets" in config_data["service_settings"]["camera_details"]:
-                saved_presets = config_data["service_settings"]["camera_details"]["presets"]
-                updated_presets = [p for p in saved_presets if p["name"] in existing_preset_map.keys() and p["token"] == existing_preset_map[p["name"]]]
-                print(saved_presets,updated_presets)
-
-                if len(updated_presets) != len(saved_presets):  # Only update if something changed
-                    config_data["service_settings"]["camera_details"]["presets"] = updated_presets
-                    with open(config_path, "w") as file:
-                        json.dump(config_data, file, indent=4)
-                    print("🔄 Removed presets that are no longer available in the camera.")
-
-            # 🔍 Check if preset already exists
-            if preset_name in existing_preset_map:
-                preset_token = existing_preset_map[preset_name]
-                print(f"✅ Preset '{preset_name}' already exists with token: {preset_token}")
-
-                # Update local config if missing
-                existing_preset_tokens = {p["name"]: p["token"] for p in config_data["camera_details"].get("presets", [])}
-
-                if preset_name not in existing_preset_tokens:
-                    config_data["service_settings"]["camera_details"]["presets"].append({"name": preset_name, "token": preset_token})
-                    
-                    # Save updated config
-                    with open(config_path, "w") as file:
-                        json.dump(config_data, file, indent=4)
-                    
-                    print(f"✅ Preset '{preset_name}' added to local config.")
-                else:
-                    print(f"📌 Preset '{preset_name}' already exists in local config.")
-                
-                return  # Exit without creating a duplicate preset
-
-            # If the preset does not exist, create a new one
-            print(f"📌 Creating new preset: {preset_name}...")
-
-            # Create preset request
-            preset_request = ptz_service.create_type("SetPreset")
-            print(preset_request)
-            preset_request.ProfileToken = profile_token
-            preset_request.PresetName = preset_name
-            print(preset_request)
-
-            # Execute preset creation
-            response = ptz_service.SetPreset(preset_request)
-            print(response)
-            # 🔥 Fix: Use response as token if it's an integer or string
-            if isinstance(response, (str, int)):  
-                preset_token = str(response)  # Convert to string for consistency
+            # ✅ Only talks to the camera when the table is stale (new session, schedule)
+            self.reconcile_presets()
+
+            status, preset_token = self._create_preset_entry(ptz_service, profile_token, preset_name)
+            if status in ("created", "adopted"):
+                self.persist_presets()
+            print(f"✅ Preset '{preset_name}' {status} with token: {preset_token}")
+
+        except Exception as e:
+            print(f"❌ Unexpected error while creating preset '{preset_name}': {e}")
+
+    def _create_preset_entry(self, ptz_service, profile_token, preset_name):
+        """Create one preset in the table (without persisting). Returns (status, token)."""
+        preset_token = self.presets.token_for(preset_name)
+        if preset_token:
+            return "exists", preset_token
+
+        # The camera already has a preset with this name: adopt it instead of creating a duplicate
+        preset_token = self.presets.camera_token_for(preset_name)
+        if preset_token:
+            self.presets.add(preset_name, preset_token)
+            return "adopted", preset_token
+
+        # If the preset does not exist, create a new one
+        print(f"📌 Creating new preset: {preset_name}...")
+        preset_token = self._set_preset(ptz_service, profile_token, preset_name)
+        if preset_token is None:
+            return "error", None
+
+        position = self.position_model.estimate()
+        self.presets.add(preset_name, preset_token, {axis: position[axis] for axis in PTZ_AXES} if position else None)
+        return "created", preset_token
+
+    # ---------------------------------------------------
+    # 📚 Bulk Preset Operations
+    # ---------------------------------------------------
+
+    def _begin_preset_batch(self, command):
+        """Open the ONVIF session and reconcile once for a bulk preset command."""
+        camera, ptz_service, profile_token = self.init_camera()
+        if not ptz_service:
+            self.publish_response({"type": "preset_bulk_result", "command": command, "success": False,
+                                   "error": "PTZ service unavailable"})
+            return None, None
+        self.reconcile_presets()
+        return ptz_service, profile_token
+
+    def _finish_preset_batch(self, command, results, changed):
+        """Persist once and publish one aggregated response for a bulk preset command."""
+        if changed:
+            self.persist_presets()
+
+        summary = {}
+        for result in results:
+            summary[result["status"]] = summary.get(result["status"], 0) + 1
+
+        self.publish_response({
+            "type": "preset_bulk_result",
+            "command": command,
+            "success": "error" not in summary,
+            "summary": summary,
+            "results": results,
+        })
+        print(f"📚 [{self.sensor_id}] {command}: {summary}")
+
+    def wait_until_idle(self, timeout=10.0, poll_interval=0.2):
+        """Poll GetStatus until the camera reports it stopped moving (or the timeout expires)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # Give the camera a moment to start the move before trusting an IDLE status
+            time.sleep(poll_interval)
+            position = self.refresh_position()
+            if position is None or not position["moving"]:
+                return position
+        return None
+
+    def create_presets(self, presets):
+        """Create many presets in one ONVIF session with a single config write.
+
+        Each entry is a preset name or {"preset_name", "pan", "tilt", "zoom"}; with
+        coordinates the camera is moved there first, otherwise the current position is used.
+        """
+        ptz_service, profile_token = self._begin_preset_batch("create_presets")
+        if not ptz_service:
+            return
+
+        results = []
+        changed = False
+        for entry in presets or []:
+            if isinstance(entry, dict):
+                name = entry.get("preset_name") or entry.get("name")
             else:
-                print("❌ Unexpected response format:", response)
-                return
+                name, entry = entry, {}
+
+            if not name:
+                results.append({"name": None, "status": "error", "error": "missing preset_name"})
+                continue
+
+            try:
+                if self.presets.token_for(name) is None and any(entry.get(axis) is not None for axis in PTZ_AXES):
+                    self.move_absolute(entry.get("pan"), entry.get("tilt"), entry.get("zoom"), entry.get("speed"))
+                    self.wait_until_idle(timeout=entry.get("timeout", 10.0))
 
-            # Store preset details
-            camera_details["presets"].append({"name": preset_name, "token": preset_token})
-            config_data["service_settings"]["camera_details"]["presets"] = camera_details["presets"]
+                status, token = self._create_preset_entry(ptz_service, profile_token, name)
+                changed = changed or status in ("created", "adopted")
+                results.append({"name": name, "status": status, "token": token})
+            except Exception as e:
+                results.append({"name": name, "status": "error", "error": str(e)})
 
-            # Save updated config
-            with open(config_path, "w") as file:
-                json.dump(config_data, file, indent=4)
+        self._finish_preset_batch("create_presets", results, changed)
 
-            print(f"✅ Preset '{preset_name}' saved successfully with token: {preset_token}")
+    def delete_presets(self, preset_names):
+        """Remove many presets from the camera and the local table with a single config write."""
+        ptz_service, profile_token = self._begin_preset_batch("delete_presets")
+        if not ptz_service:
+            return
 
+        results = []
+        changed = False
+        for name in preset_names or []:
+            token = self.presets.token_for(name)
+            if token is None:
+                results.append({"name": name, "status": "not_found"})
+                continue
 
-        except FileNotFoundError:
-            print(f"❌ Config file not found: {config_path}")
-        except json.JSONDecodeError:
-            print(f"❌ Error reading JSON from {config_path}")
-        except Exception as e:
-            print(f"❌ Unexpected error while creating preset '{preset_name}': {e}")
+            try:
+                ptz_service.RemovePreset({"ProfileToken": profile_token, "PresetToken": token})
+                self.presets.remove(name)
+                changed = True
+                results.append({"name": name, "status": "deleted", "token": token})
+            except Exception as e:
+                results.append({"name": name, "status": "error", "token": token, "error": str(e)})
+
+        self._finish_preset_batch("delete_presets", results, changed)
+
+    def rename_presets(self, renames, sync_camera=False):
+        """Rename many presets with a single config write.
+
+        `renames` is {"old": "new"} or [{"from": "old", "to": "new"}]. Names are local by default;
+        with sync_camera the camera label is rewritten too, which needs a GotoPreset + SetPreset
+        per preset because ONVIF SetPreset also stores the current position.
+        """
+        if isinstance(renames, dict):
+            renames = [{"from": old, "to": new} for old, new in renames.items()]
+
+        ptz_service, profile_token = self._begin_preset_batch("rename_presets")
+        if not ptz_service:
+            return
+
+        results = []
+        changed = False
+        for rename in renames or []:
+            old_name, new_name = rename.get("from"), rename.get("to")
+            token = self.presets.token_for(old_name)
+            if token is None:
+                results.append({"name": old_name, "status": "not_found"})
+                continue
+            if not new_name or self.presets.token_for(new_name):
+                results.append({"name": old_name, "status": "error", "error": f"target name '{new_name}' invalid or taken"})
+                continue
+
+            try:
+                if sync_camera:
+                    ptz_service.GotoPreset({"ProfileToken": profile_token, "PresetToken": token})
+                    self._track_preset_move(old_name)
+                    if self.wait_until_idle() is None:
+                        raise TimeoutError(f"could not confirm the camera reached preset '{old_name}'")
+                    self._set_preset(ptz_service, profile_token, new_name, preset_token=token)
+                self.presets.rename(old_name, new_name)
+                changed = True
+                results.append({"name": old_name, "new_name": new_name, "status": "renamed", "token": token})
+            except Exception as e:
+                results.append({"name": old_name, "status": "error", "token": token, "error": str(e)})
+
+        self._finish_preset_batch("rename_presets", results, changed)
+
+    def _set_preset(self, ptz_service, profile_token, preset_name, preset_token=None):
+        """Issue SetPreset and return the preset token as a string (None on unexpected responses)."""
+        preset_request = ptz_service.create_type("SetPreset")
+        preset_request.ProfileToken = profile_token
+        preset_request.PresetName = preset_name
+        if preset_token is not None:
+            preset_request.PresetToken = preset_token
+
+        # Execute preset creation
+        response = ptz_service.SetPreset(preset_request)
+        # 🔥 Fix: Use response as token if it's an integer or string
+        if isinstance(response, (str, int)):
+            return str(response)  # Convert to string for consistency
+
+        print("❌ Unexpected response format:", response)
+        return None
 
 
-    def start_patrol(self, preset_names):
-        """Start patrolling between given presets with proper locking and error handling."""
-        print("I am running")
+    def start_patrol(self, preset_names, dwell_time=None, use_camera_tour=True, optimize_route=False):
+        """Start patrolling between given presets, on the camera when it supports preset tours."""
+        dwell_time = dwell_time if isinstance(dwell_time, (int, float)) and dwell_time > 0 else DEFAULT_PATROL_DWELL_TIME
         with self._patrol_lock:
-            if not camera_details:
+            if not self.camera_details:
                 logging.error(f"❌ No camera config found for sensor {self.sensor_id}")
                 return
             
             
-            # Map preset names to tokens
-            presets = {p["name"]: p["token"] for p in camera_details.get("presets", [])}
-            
-            print(preset_names)
             # Validate and filter preset names
-            selected_presets = [name for name in preset_names if name in presets]
+            selected_presets = [name for name in preset_names if self.presets.token_for(name)]
 
             if not selected_presets:
                 logging.warning(f"⚠️ No valid presets found for sensor {self.sensor_id}")
@@ -742,35 +4853,153 @@ class MQTTSubscriber:
                 logging.warning(f"⚠️ Patrol already running for {self.sensor_id}")
                 return
 
+            if optimize_route:
+                selected_presets = self._optimize_patrol_order(selected_presets)
+
+            # ✅ Offload to an on-camera PresetTour: no per-step SOAP traffic, survives our restarts
+            if use_camera_tour and self.supports_preset_tours():
+                if self._start_camera_tour(selected_presets, dwell_time):
+                    return
+                logging.warning(f"⚠️ On-camera preset tour failed for {self.sensor_id}, falling back to local patrol")
+
             # Mark patrol as active
             # ✅ Initialize shutdown event per camera
             self._shutdown_events[self.sensor_id] = threading.Event()
             self._active_patrols[self.sensor_id] = True
+            self._patrol_modes[self.sensor_id] = "scheduler"
+            self.status.update(patrol={"mode": "scheduler", "presets": selected_presets, "dwell_time": dwell_time})
+
+            if self.runtime:
+                # Patrol runs as a cancellable task on the event loop instead of a thread
+                self._patrol_threads[self.sensor_id] = self.runtime.start_patrol(
+                    self, selected_presets, dwell_time, self._shutdown_events[self.sensor_id]
+                )
+                return
 
             def patrol():
                 logging.info(f"🚀 Patrol started for {self.sensor_id}")
+                shutdown_event = self._shutdown_events[self.sensor_id]
                 try:
-                    while self._active_patrols.get(self.sensor_id) and not self._shutdown_events[self.sensor_id].is_set():
+                    while self._active_patrols.get(self.sensor_id) and not shutdown_event.is_set():
                         for preset_name in selected_presets:
-                            if not self._active_patrols.get(self.sensor_id) or self._shutdown_events[self.sensor_id].is_set():
+                            if not self._active_patrols.get(self.sensor_id) or shutdown_event.is_set():
                                 logging.info(f"🛑 Patrol stopping for {self.sensor_id}")
                                 return
                             try:
                                 logging.info(f"📌 Moving to preset {preset_name} for {self.sensor_id}")
                                 self.move_to_preset(preset_name)
-                                time.sleep(5)  # Adjust patrol wait time as needed
+                                # Returns early when the patrol is stopped
+                                if shutdown_event.wait(timeout=dwell_time):
+                                    return
                             except Exception as e:
-                                logging.error(f"❌ Error moving to preset {preset_token}: {e}")
+                                logging.error(f"❌ Error moving to preset {preset_name}: {e}")
                                 return
                 finally:
                     logging.info(f"✅ Patrol completed for {self.sensor_id}")
                     self._active_patrols[self.sensor_id] = False
+                    self.status.update(patrol=None)
 
             # Create and start patrol thread
             patrol_thread = threading.Thread(target=patrol, daemon=True)
             self._patrol_threads[self.sensor_id] = patrol_thread
             patrol_thread.start()
 
+    def _optimize_patrol_order(self, preset_names):
+        """Reorder patrol presets by travel time; presets without known coordinates go last."""
+        self.reconcile_presets()
+        unique_names = list(dict.fromkeys(preset_names))
+        positions = {name: self.presets.position_for(name) for name in unique_names}
+        known = {name: position for name, position in positions.items() if position}
+        unknown = [name for name in unique_names if name not in known]
+
+        if len(known) < 4:
+            return preset_names
+
+        try:
+            ordered, before, after = optimize_patrol_route(known, self.position_model.speeds)
+        except Exception as e:
+            logging.error(f"❌ [{self.sensor_id}] Patrol route optimization failed, keeping given order: {e}")
+            return preset_names
+
+        logging.info(f"🧭 [{self.sensor_id}] Patrol route optimized: travel per cycle {before:.1f}s -> {after:.1f}s")
+        return ordered + unknown
+
+    def supports_preset_tours(self):
+        """Check the discovered PTZ capabilities for on-camera preset tour support."""
+        capabilities = self.get_ptz_capabilities()
+        if not capabilities:
+            return False
+        preset_tours = capabilities.get("preset_tours") or {}
+        operations = preset_tours.get("operations") or ["Start", "Stop"]
+        return preset_tours.get("max", 0) > 0 and "Start" in operations and "Stop" in operations
+
+    def _start_camera_tour(self, selected_presets, dwell_time):
+        """Create, program and start a PresetTour on the camera. Returns True on success."""
+        camera, ptz_service, profile_token = self.init_camera()
+        if not ptz_service:
+            return False
+
+        tour_token = None
+        try:
+            tour_token = ptz_service.CreatePresetTour({"ProfileToken": profile_token})
+            tour = build_preset_tour(
+                tour_token, f"patrol-{self.sensor_id}",
+                [self.presets.token_for(name) for name in selected_presets], dwell_time
+            )
+            ptz_service.ModifyPresetTour({"ProfileToken": profile_token, "PresetTour": tour})
+            ptz_service.OperatePresetTour({"ProfileToken": profile_token, "PresetTourToken": tour_token, "Operation": "Start"})
+        except Exception as e:
+            logging.error(f"❌ Error starting on-camera preset tour for {self.sensor_id}: {e}")
+            if tour_token is not None:
+                self._remove_camera_tour(ptz_service, profile_token, tour_token)
+            return False
+
+        self._camera_tours[self.sensor_id] = tour_token
+        self._patrol_modes[self.sensor_id] = "camera_tour"
+        self._active_patrols[self.sensor_id] = True
+        patrol_state = {"mode": "camera_tour", "tour_token": tour_token, "presets": selected_presets, "dwell_time": dwell_time}
+        self._save_patrol_state(patrol_state)
+        self.status.update(patrol=patrol_state)
+        self.position_model.invalidate()
+        self._wake_telemetry()
+        logging.info(f"🚀 On-camera preset tour {tour_token} started for {self.sensor_id}: {selected_presets}")
+        return True
+
+    def _remove_camera_tour(self, ptz_service, profile_token, tour_token):
+        """Best-effort removal so we don't leak the camera's limited tour slots."""
+        try:
+            ptz_service.RemovePresetTour({"ProfileToken": profile_token, "PresetTourToken": tour_token})
+        except Exception as e:
+            logging.warning(f"⚠️ Could not remove preset tour {tour_token}: {e}")
+
+    def _stop_camera_tour(self):
+        """Stop and remove the on-camera tour for this sensor."""
+        tour_token = self._camera_tours.get(self.sensor_id)
+        camera, ptz_service, profile_token = self.init_camera()
+        if not ptz_service:
+            logging.error(f"❌ PTZ service unavailable, cannot stop preset tour for {self.sensor_id}")
+            return False
+
+        try:
+            ptz_service.OperatePresetTour({"ProfileToken": profile_token, "PresetTourToken": tour_token, "Operation": "Stop"})
+        except Exception as e:
+            logging.error(f"❌ Error stopping preset tour {tour_token}: {e}")
+            return False
+
+        self._remove_camera_tour(ptz_service, profile_token, tour_token)
+        del self._camera_tours[self.sensor_id]
+        self._save_patrol_state(None)
+        return True
+
+    def _save_patrol_state(self, state):
+        """Persist (or clear) the active on-camera patrol in cache/patrol_state.json."""
+        patrol_state = load_json_cache(PATROL_STATE_CACHE)
+        if state is None:
+            patrol_state.pop(self.sensor_id, None)
+        else:
+            patrol_state[self.sensor_id] = state
+        save_json_cache(PATROL_STATE_CACHE, patrol_state)
+
     def stop_patrol(self):
         """Stop the patrol sequence for the given sensor."""
 
@@ -781,6 +5010,16 @@ class MQTTSubscriber:
 
         logging.info(f"🛑 Stopping patrol for {self.sensor_id}")
 
+        # ✅ On-camera tours are stopped with a single OperatePresetTour call
+        if self._patrol_modes.get(self.sensor_id) == "camera_tour":
+            if self._stop_camera_tour():
+                self._active_patrols[self.sensor_id] = False
+                self._patrol_modes.pop(self.sensor_id, None)
+                self.position_model.invalidate()
+                self.status.update(patrol=None)
+                logging.info(f"✅ Patrol stopped for {self.sensor_id}")
+            return
+
         # ✅ Ensure `self._shutdown_events[self.sensor_id]` exists before calling `.set()`
         if self.sensor_id in self._shutdown_events and self._shutdown_events[self.sensor_id]:
             self._shutdown_events[self.sensor_id].set()  # Stop patrol thread
@@ -789,6 +5028,7 @@ class MQTTSubscriber:
             return
 
         self._active_patrols[self.sensor_id] = False
+        self._patrol_modes.pop(self.sensor_id, None)
 
         # ✅ Ensure patrol thread exists before trying to join
         if self.sensor_id in self._patrol_threads:
@@ -806,6 +5046,64 @@ class MQTTSubscriber:
         logging.info(f"✅ Patrol stopped for {self.sensor_id}")
 
 
+    def get_encoder_configuration(self, refresh=False):
+        """Return the cached video encoder configuration and its options for the active profile."""
+        camera, ptz_service, profile_token = self.init_camera()
+        if not camera or not self.media_service:
+            return None
+
+        cached = self._encoder_cache.get(profile_token)
+        if cached and not refresh:
+            return cached
+
+        # Prefer the encoder bound to the profile, fall back to the first one the camera reports
+        video_config = getattr(self.media_profile, "VideoEncoderConfiguration", None)
+        if video_config is None:
+            video_configs = self.media_service.GetVideoEncoderConfigurations()
+            if not video_configs:
+                print(f"❌ [{self.sensor_id}] No video encoder configurations found.")
+                return None
+            video_config = video_configs[0]
+
+        options = None
+        try:
+            options = self.media_service.GetVideoEncoderConfigurationOptions(
+                {"ConfigurationToken": video_config.token, "ProfileToken": profile_token}
+            )
+        except Exception as e:
+            logging.warning(f"[{self.sensor_id}] GetVideoEncoderConfigurationOptions failed, skipping local validation: {e}")
+
+        cached = {"config": video_config, "options": options}
+        self._encoder_cache[profile_token] = cached
+        return cached
+
+    def validate_encoder_request(self, video_config, options, fps=None, width=None, height=None, BitrateLimit=None):
+        """Check requested encoder values against the cached options. Returns an error message or None."""
+        if options is None:
+            return None
+
+        encoding = str(getattr(video_config, "Encoding", "H264"))
+        encoding_options = getattr(options, encoding, None)
+        extension = getattr(getattr(options, "Extension", None), encoding, None)
+
+        if fps is not None and encoding_options is not None:
+            frame_rate_range = getattr(encoding_options, "FrameRateRange", None)
+            if frame_rate_range is not None and not (frame_rate_range.Min <= fps <= frame_rate_range.Max):
+                return f"FPS {fps} outside supported range {frame_rate_range.Min}-{frame_rate_range.Max}"
+
+        if width is not None and height is not None and encoding_options is not None:
+            resolutions = getattr(encoding_options, "ResolutionsAvailable", None) or []
+            supported = {(r.Width, r.Height) for r in resolutions}
+            if supported and (width, height) not in supported:
+                return f"Resolution {width}x{height} not supported (available: {sorted(supported)})"
+
+        if BitrateLimit is not None and extension is not None:
+            bitrate_range = getattr(extension, "BitrateRange", None)
+            if bitrate_range is not None and not (bitrate_range.Min <= BitrateLimit <= bitrate_range.Max):
+                return f"Bitrate {BitrateLimit} outside supported range {bitrate_range.Min}-{bitrate_range.Max}"
+
+        return None
+
     def set_fpsbr(self, fps=None, width=None, height=None, BitrateLimit=None):
         """Set the frame rate (FPS), resolution, and bitrate for the camera's video stream."""
 
@@ -815,51 +5113,57 @@ class MQTTSubscriber:
             return
 
         try:
-            # ✅ Initialize camera and media service
-            camera, ptz_service, profile_token = self.init_camera()
-            if not camera:
+            # ✅ Use the cached encoder configuration and options (fetched once per profile)
+            cached = self.get_encoder_configuration()
+            if not cached:
                 print(f"❌ [{self.sensor_id}] Camera initialization failed.")
                 return
 
-            media_service = camera.create_media_service()
-            if not media_service:
-                print(f"❌ [{self.sensor_id}] Failed to connect to media service.")
-                return
+            video_config = cached["config"]
 
-            # ✅ Retrieve available video encoder configurations
-            video_configs = media_service.GetVideoEncoderConfigurations()
-            if not video_configs:
-                print(f"❌ [{self.sensor_id}] No video encoder configurations found.")
+            # ✅ Validate locally instead of letting the camera reject the SOAP call
+            error = self.validate_encoder_request(video_config, cached["options"], fps, width, height, BitrateLimit)
+            if error:
+                print(f"❌ [{self.sensor_id}] Invalid encoder settings: {error}")
                 return
 
-            # ✅ Select the first encoder configuration (most cameras have only one)
-            video_config = video_configs[0]
-
-            # ✅ Create request to modify video settings
-            request = media_service.create_type("SetVideoEncoderConfiguration")
-            request.Configuration = video_config  # Use existing config
-            request.Configuration.Name = video_config.Name  # Preserve name
+            # ✅ Work on a copy so a failed SET doesn't corrupt the cache
+            new_config = copy.deepcopy(video_config)
+            changed = False
 
             # ✅ Update FPS if provided
             if fps is not None:
-                if hasattr(request.Configuration.RateControl, "FrameRateLimit"):
-                    request.Configuration.RateControl.FrameRateLimit = fps
-                else:
+                if not hasattr(new_config.RateControl, "FrameRateLimit"):
                     print(f"⚠️ [{self.sensor_id}] FrameRateLimit attribute missing in RateControl.")
                     return
+                if new_config.RateControl.FrameRateLimit != fps:
+                    new_config.RateControl.FrameRateLimit = fps
+                    changed = True
 
             # ✅ Update Resolution if width and height are provided
             if width is not None and height is not None:
-                request.Configuration.Resolution.Width = width
-                request.Configuration.Resolution.Height = height
+                if (new_config.Resolution.Width, new_config.Resolution.Height) != (width, height):
+                    new_config.Resolution.Width = width
+                    new_config.Resolution.Height = height
+                    changed = True
 
             # ✅ Update BitrateLimit if provided
             if BitrateLimit is not None:
-                if hasattr(request.Configuration.RateControl, "BitrateLimit"):
-                    request.Configuration.RateControl.BitrateLimit = BitrateLimit
-                else:
+                if not hasattr(new_config.RateControl, "BitrateLimit"):
                     print(f"⚠️ [{self.sensor_id}] BitrateLimit attribute missing in RateControl.")
                     return
+                if new_config.RateControl.BitrateLimit != BitrateLimit:
+                    new_config.RateControl.BitrateLimit = BitrateLimit
+                    changed = True
+
+            # ✅ Skip the SET entirely when nothing differs (reconfiguring drops the RTSP stream on some cameras)
+            if not changed:
+                print(f"✅ [{self.sensor_id}] Encoder already at FPS={fps}, Resolution=({width}x{height}), Bitrate={BitrateLimit}. Skipping update.")
+                return
+
+            # ✅ Create request to modify video settings
+            request = self.media_service.create_type("SetVideoEncoderConfiguration")
+            request.Configuration = new_config
 
             # ✅ Ensure ForcePersistence is set (prevents ONVIF errors)
             if hasattr(request, "ForcePersistence"):
@@ -867,14 +5171,22 @@ class MQTTSubscriber:
             else:
                 print(f"⚠️ [{self.sensor_id}] ForcePersistence attribute missing. Trying without it.")
 
-            print(request)
-
             # ✅ Apply the changes
             print(f"🎥 [{self.sensor_id}] Updating settings: FPS={fps}, Resolution=({width}x{height}), Bitrate={BitrateLimit}")
-            media_service.SetVideoEncoderConfiguration(request)
+            try:
+                self.media_service.SetVideoEncoderConfiguration(request)
+            except Exception:
+                # Camera state is unknown now, re-read it next time
+                self._encoder_cache.pop(self.profile_token, None)
+                raise
 
+            cached["config"] = new_config
             print(f"✅ [{self.sensor_id}] Camera settings updated successfully.")
 
+            # Check the stream actually changed once the camera has restarted its encoder
+            if self.stream_prober:
+                self.stream_prober.request("default", "set_fpsbr", delay=float(self.stream_prober.settings["verify_delay"]))
+
         except Exception as e:
             print(f"❌ [{self.sensor_id}] Error updating camera settings: {e}")
 
@@ -903,21 +5215,19 @@ class MQTTSubscriber:
         """Start MQTT client connection."""
         try:
             # Set connection timeout
-            self.client.connect(MQTT_HOST, MQTT_PORT, keepalive=MQTT_KEEPALIVE)
+            with startup_profiler.stage("MQTT connect (TCP/TLS)"):
+                self.client.connect(MQTT_HOST, MQTT_PORT, keepalive=MQTT_KEEPALIVE)
             
             # Start the MQTT loop in a separate thread
             self.client.loop_start()
             
             # Log connection details
             connection_type = "Certificate-based" if MQTT_CONNECTION_TYPE == MQTT_CONNECTION_TYPES["CERTIFICATE"] else "Username/Password"
-            print(f"🔄 Connecting to MQTT broker at {MQTT_HOST}:{MQTT_PORT} using {connection_type} authentication with client ID: {MQTT_CLIENT_ID}")
+            print(f"🔄 Connecting to MQTT broker at {MQTT_HOST}:{MQTT_PORT} using {connection_type} authentication with client ID: {self.client_id}")
             
-            # Wait for connection to establish
+            # Wait for connection to establish (on_connect sets the event)
             connection_timeout = MQTT_CONNECT_TIMEOUT
-            start_time = time.time()
-            
-            while not self.client.is_connected() and time.time() - start_time < connection_timeout:
-                time.sleep(0.5)
+            self._connected_event.wait(timeout=connection_timeout)
                 
             if not self.client.is_connected():
                 raise TimeoutError(f"Failed to connect to MQTT broker within {connection_timeout} seconds")
@@ -926,6 +5236,279 @@ class MQTTSubscriber:
             print(f"❌ Failed to connect to MQTT broker: {e}")
             raise
 
+# ---------------------------------------------------
+# ⚡ asyncio Runtime
+# ---------------------------------------------------
+
+class LoopTimer:
+    """Thread-safe handle for a callback scheduled on an event loop."""
+
+    def __init__(self, loop, delay, callback):
+        self._loop = loop
+        self._handle = None
+        self._cancelled = False
+        self.finished = threading.Event()  # same as threading.Timer: set once fired or cancelled
+        loop.call_soon_threadsafe(self._schedule, delay, callback)
+
+    def _schedule(self, delay, callback):
+        if not self._cancelled:
+            self._handle = self._loop.call_later(delay, self._fire, callback)
+
+    def _fire(self, callback):
+        self.finished.set()
+        callback()
+
+    def cancel(self):
+        self._cancelled = True
+        self.finished.set()
+        self._loop.call_soon_threadsafe(lambda: self._handle and self._handle.cancel())
+
+
+class LoopTask:
+    """Thread-style handle (is_alive/join) for a coroutine running on the event loop; join cancels it."""
+
+    def __init__(self, loop, coroutine):
+        self._future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+    def is_alive(self):
+        return not self._future.done()
+
+    def join(self, timeout=None):
+        self._future.cancel()
+        try:
+            self._future.result(timeout=timeout)
+        except Exception:
+            pass
+
+
+class AsyncRuntime:
+    """Run one or more MQTTSubscribers on a single asyncio event loop.
+
+    The loop owns the scheduling: paho's sockets are serviced by it (add_reader/add_writer) instead
+    of a network thread, each camera's CommandScheduler queue is drained by a loop task, and patrols,
+    timers and stream supervision are loop tasks with cancellation. The I/O itself is not async:
+    there is no asyncio MQTT client or zeep transport here, so ONVIF (zeep) calls block and run in a
+    bounded executor.
+    """
+
+    def __init__(self, subscribers, executor_workers=ASYNC_EXECUTOR_WORKERS, command_timeout=ASYNC_COMMAND_TIMEOUT):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.subscribers = list(subscribers)
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="onvif")
+        self.command_timeout = command_timeout
+        self.loop = None
+        self._loop_thread = None
+        self._tasks = set()
+        self._stop_event = None
+        self.metrics = {"commands": 0, "priority": 0, "timeouts": 0, "in_flight": 0, "reconnects": 0}
+
+    # ---- scheduling helpers (safe to call from any thread) ----
+
+    def call_later(self, delay, callback):
+        # Timer callbacks (stop_streaming, status flush) may block, so they fire into the executor
+        return LoopTimer(self.loop, delay, lambda: self.loop.run_in_executor(self.executor, callback))
+
+    def spawn(self, coroutine):
+        """Track a task so shutdown can cancel it."""
+        task = self.loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def call_in_loop(self, function, *args):
+        """Run function on the loop thread: now if already there, otherwise on the next iteration."""
+        if threading.get_ident() == self._loop_thread:
+            function(*args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+
+    def _forget_socket(self, fd, writer_only=False):
+        # paho may already have closed the socket, so failing to unregister it is expected
+        for remove in ((self.loop.remove_writer,) if writer_only else (self.loop.remove_writer, self.loop.remove_reader)):
+            try:
+                remove(fd)
+            except (OSError, ValueError):
+                pass
+
+    async def run_blocking(self, function, *args, timeout=None):
+        """Run a blocking call (zeep SOAP, file I/O) in the executor, optionally bounded by a timeout."""
+        future = self.loop.run_in_executor(self.executor, functools.partial(function, *args))
+        if timeout:
+            return await asyncio.wait_for(future, timeout)
+        return await future
+
+    # ---- MQTT on the event loop ----
+
+    def attach(self, subscriber):
+        client = subscriber.client
+        subscriber.runtime = self
+        subscriber.status.put(runtime="asyncio")
+        subscriber.command_scheduler.use_runtime(self)
+
+        # Sockets are registered by fd number so they can still be unregistered after paho closes them
+        def on_socket_open(client, userdata, sock):
+            self.call_in_loop(self.loop.add_reader, sock.fileno(), client.loop_read)
+
+        def on_socket_close(client, userdata, sock):
+            self.call_in_loop(self._forget_socket, sock.fileno())
+
+        def on_socket_register_write(client, userdata, sock):
+            self.call_in_loop(self.loop.add_writer, sock.fileno(), client.loop_write)
+
+        def on_socket_unregister_write(client, userdata, sock):
+            self.call_in_loop(self._forget_socket, sock.fileno(), True)
+
+        def on_disconnect(client, userdata, rc):
+            subscriber._connected_event.clear()
+            subscriber.status.put(mqtt="disconnected")
+            print(f"❌ [{subscriber.sensor_id}] Disconnected from MQTT broker (rc={rc})")
+            if not self._stop_event.is_set():
+                self.spawn(self._reconnect(subscriber))
+
+        client.on_socket_open = on_socket_open
+        client.on_socket_close = on_socket_close
+        client.on_socket_register_write = on_socket_register_write
+        client.on_socket_unregister_write = on_socket_unregister_write
+        # Runs on the loop (paho's loop_read is called from it): parse, validate, then queue or spawn
+        client.on_message = subscriber.on_message
+        client.on_disconnect = on_disconnect
+
+    async def _connect(self, subscriber):
+        # The TCP/TLS handshake blocks, so it runs in the executor; socket callbacks hop back to the loop
+        await self.run_blocking(subscriber.client.connect, MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE)
+
+    async def _reconnect(self, subscriber):
+        delay = 1
+        while not self._stop_event.is_set():
+            try:
+                await asyncio.sleep(delay)
+                self.metrics["reconnects"] += 1
+                await self.run_blocking(subscriber.client.reconnect)
+                print(f"✅ [{subscriber.sensor_id}] Reconnected to MQTT broker")
+                return
+            except Exception as e:
+                print(f"⚠️ [{subscriber.sensor_id}] Reconnect failed: {e}")
+                delay = min(delay * 2, 60)
+
+    async def _misc_loop(self):
+        """paho's keepalive/retry housekeeping, once a second for every client."""
+        while True:
+            await asyncio.sleep(1)
+            for subscriber in self.subscribers:
+                subscriber.client.loop_misc()
+
+    # ---- commands ----
+
+    def spawn_command(self, command, handler):
+        """Priority commands (stop_ptz, stop_patrol, get_status) run at once, outside the camera's queue."""
+        self.metrics["priority"] += 1
+        self.spawn(self.execute(command, handler))
+
+    async def execute(self, command, handler):
+        """Run one command handler in the executor; returns once it has finished.
+
+        A blocking SOAP call can't be cancelled from here, so a command that outlives command_timeout
+        is reported and then still awaited: the camera's next queued command never overtakes it (an
+        earlier move can't land after a later one), and a stop_ptz sent meanwhile is repeated once
+        it returns (see CommandScheduler).
+        """
+        self.metrics["commands"] += 1
+        self.metrics["in_flight"] += 1
+        future = self.loop.run_in_executor(self.executor, handler)
+        try:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.command_timeout)
+            except asyncio.TimeoutError:
+                self.metrics["timeouts"] += 1
+                logging.warning(f"{command} still running after {self.command_timeout}s; holding this camera's queue until it returns")
+                await future
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Error executing {command}: {e}")
+        finally:
+            self.metrics["in_flight"] -= 1
+
+    # ---- patrols and streams ----
+
+    def start_patrol(self, subscriber, selected_presets, dwell_time, shutdown_event):
+        return LoopTask(self.loop, self._patrol(subscriber, selected_presets, dwell_time, shutdown_event))
+
+    async def _patrol(self, subscriber, selected_presets, dwell_time, shutdown_event):
+        sensor_id = subscriber.sensor_id
+        logging.info(f"🚀 Patrol started for {sensor_id} (event loop)")
+        try:
+            while subscriber._active_patrols.get(sensor_id) and not shutdown_event.is_set():
+                for preset_name in selected_presets:
+                    if not subscriber._active_patrols.get(sensor_id) or shutdown_event.is_set():
+                        return
+                    try:
+                        await self.run_blocking(subscriber.move_to_preset, preset_name, timeout=self.command_timeout)
+                    except (asyncio.TimeoutError, Exception) as e:
+                        logging.error(f"❌ Error moving to preset {preset_name}: {e}")
+                        return
+                    await asyncio.sleep(dwell_time)
+        finally:
+            logging.info(f"✅ Patrol completed for {sensor_id}")
+            subscriber._active_patrols[sensor_id] = False
+            subscriber.status.update(patrol=None)
+
+    async def _supervise_streams(self):
+        """Reap on-demand ffmpeg processes that exited on their own and report it."""
+        while True:
+            await asyncio.sleep(1)
+            for subscriber in self.subscribers:
+                with subscriber._ffmpeg_lock:
+                    exited = subscriber.reap_on_demand_streams()
+                for stream_id, returncode in exited:
+                    logging.warning(f"[{subscriber.sensor_id}] Stream {stream_id} exited with code {returncode}")
+
+    # ---- lifecycle ----
+
+    def stop(self):
+        self._stop_event.set()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop_event = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self.loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+
+        for subscriber in self.subscribers:
+            self.attach(subscriber)
+        with startup_profiler.stage("MQTT connect (TCP/TLS)"):
+            results = await asyncio.gather(*(self._connect(subscriber) for subscriber in self.subscribers),
+                                           return_exceptions=True)
+        for subscriber, result in zip(self.subscribers, results):
+            if isinstance(result, Exception):
+                print(f"❌ [{subscriber.sensor_id}] Failed to connect to MQTT broker: {result}")
+                self.spawn(self._reconnect(subscriber))
+        print(f"⚡ asyncio runtime running {len(self.subscribers)} subscriber(s) on one event loop")
+
+        self.spawn(self._misc_loop())
+        self.spawn(self._supervise_streams())
+        await self._stop_event.wait()
+        await self.shutdown()
+
+    async def shutdown(self):
+        logging.info("Stopping asyncio runtime...")
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Each cleanup runs its own steps in parallel against its deadline; the subscribers go in parallel too
+        results = await asyncio.gather(*(self.run_blocking(subscriber.cleanup) for subscriber in self.subscribers),
+                                       return_exceptions=True)
+        for subscriber, result in zip(self.subscribers, results):
+            if isinstance(result, Exception):
+                logging.error(f"[{subscriber.sensor_id}] Error during cleanup: {result}")
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 # ---------------------------------------------------
 # 🏁 Main Execution
 # ---------------------------------------------------
@@ -936,13 +5519,31 @@ def handle_exit(signum, frame):
         subscriber.cleanup()
     sys.exit(0)
 
+def parse_args():
+    """Parse command line flags for the subscriber service."""
+    parser = argparse.ArgumentParser(description="Camera control MQTT subscriber")
+    parser.add_argument("--fast-start", action="store_true",
+                        help="Subscribe first and preload ONVIF/MongoDB dependencies in the background")
+    parser.add_argument("--runtime", choices=("threaded", "asyncio"), default=None,
+                        help="Concurrency runtime (default: SUBSCRIBER_RUNTIME env or threaded)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print an import/initialization timing breakdown once subscribed")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    setup_logging()
+    args = parse_args()
+    FAST_START = FAST_START or args.fast_start
+    SUBSCRIBER_RUNTIME = args.runtime or SUBSCRIBER_RUNTIME
+    startup_profiler.enabled = args.profile_startup
+
+    with startup_profiler.stage("setup logging"):
+        setup_logging()
     logging.info("Logging setup complete.")
 
     try:
         # Load configuration
-        config = load_config()
+        with startup_profiler.stage("load configuration"):
+            config = load_config()
         if not config:
             raise ValueError("Failed to load configuration")
 
@@ -984,8 +5585,39 @@ if __name__ == "__main__":
         # Initialize subscriber
         sensor_id = config["sensor_id"]
         logging.info(f"Initializing subscriber for sensor {sensor_id} with connection type: {MQTT_CONNECTION_TYPE}")
-        subscriber = MQTTSubscriber(sensor_id)
-        
+        if not FAST_START:
+            # Keep the previous behaviour: fail early if ONVIF/MongoDB libraries are broken
+            preload_heavy_dependencies()
+        with startup_profiler.stage("MQTT subscriber init"):
+            subscriber = MQTTSubscriber(sensor_id)
+
+        # Apply edits to configuration.json without restarting the service
+        watch_settings = dict(DEFAULT_CONFIG_WATCH_SETTINGS, **(config["service_settings"].get("config_watch") or {}))
+        if watch_settings["enabled"]:
+            subscriber.config_watcher = ConfigWatcher(f"{ROOT_DIR}/configuration.json", subscriber.reload_config_file, watch_settings)
+            subscriber.config_watcher.start()
+
+        # Optionally receive config edits straight from MongoDB instead of update_configuration commands
+        push_settings = dict(DEFAULT_CONFIG_PUSH_SETTINGS, **(config["service_settings"].get("config_push") or {}))
+        if push_settings["enabled"]:
+            subscriber.start_config_stream(push_settings)
+
+        if subscriber.stream_governor:
+            subscriber.stream_governor.start()
+        if subscriber.stream_prober:
+            subscriber.stream_prober.start()
+
+        # Transcode the clips operators play most before anyone asks for them
+        if subscriber.media_cache and subscriber.media_cache.settings["prewarm"]:
+            subscriber.media_cache.prewarm(subscriber.media_cache.settings["prewarm"])
+
+        runtime = SUBSCRIBER_RUNTIME if args.runtime or "SUBSCRIBER_RUNTIME" in os.environ else \
+            config["service_settings"].get("runtime", SUBSCRIBER_RUNTIME)
+        if runtime == "asyncio":
+            # The event loop installs its own SIGTERM/SIGINT handlers and owns reconnection
+            asyncio.run(AsyncRuntime([subscriber]).run())
+            sys.exit(0)
+
         # Run the subscriber infinitely with reconnection handling
         while True:
             try:
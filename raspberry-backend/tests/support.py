@@ -0,0 +1,57 @@
+"""Shared setup for the subscriber tests: load subscriber-raspi5.py against a throwaway config."""
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+SENSOR_ID = "test-cam"
+MODULE_NAME = "subscriber_under_test"
+
+
+def load_subscriber_module():
+    """Import the subscriber once per test run, with module globals pointing at a temp ROOT_DIR."""
+    if MODULE_NAME in sys.modules:
+        return sys.modules[MODULE_NAME]
+    spec = importlib.util.spec_from_file_location(MODULE_NAME, os.path.join(BACKEND_DIR, "subscriber-raspi5.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[MODULE_NAME] = module
+
+    module.ROOT_DIR = tempfile.mkdtemp(prefix="subscriber-test-")
+    module.MQTT_CONNECTION_TYPE = module.MQTT_CONNECTION_TYPES["PLAIN"]
+    module.config = {
+        "sensor_id": SENSOR_ID,
+        "service_settings": {
+            "camera_details": {"host": "sim", "http_port": 80, "username": "u", "password": "p", "presets": []},
+            "mqtt_topics": {"control": "{sensor_id}/control", "response": "{sensor_id}/response"},
+            "mongo_db_client": {"uri": "mongodb://localhost", "database": "d", "collection": "c"},
+            "system": {"configurations_folder_path": "c", "services_to_restart": [],
+                       "all_configuration_sufix": ".json", "auto_update_interval": 300},
+            "config_watch": {"enabled": False},
+            "media_cache": {"enabled": False},
+            "stream_probe": {"enabled": False},
+        },
+    }
+    with open(os.path.join(module.ROOT_DIR, "configuration.json"), "w") as file:
+        json.dump(module.config, file)
+    settings = module.config["service_settings"]
+    module.camera_details = settings["camera_details"]
+    module.mqtt_topics = settings["mqtt_topics"]
+    module.mongo_db_client = settings["mongo_db_client"]
+    module.system_settings = settings["system"]
+    return module
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
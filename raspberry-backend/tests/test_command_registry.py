@@ -0,0 +1,76 @@
+"""CommandRegistry: payload validation and the values handlers receive."""
+import unittest
+from types import SimpleNamespace
+
+from support import load_subscriber_module
+
+subscriber_module = load_subscriber_module()
+CommandError = subscriber_module.CommandError
+
+
+class RecordingTarget:
+    """Stands in for MQTTSubscriber: every registry method records the arguments it was called with."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, method):
+        return lambda *arguments: self.calls.append((method, arguments))
+
+
+class CommandRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.target = RecordingTarget()
+        self.registry = subscriber_module.CommandRegistry(self.target)
+
+    def run_command(self, command, **payload):
+        self.registry.prepare(command, payload)()
+        return self.target.calls[-1][1]
+
+    def test_valid_payload_reaches_the_handler(self):
+        self.assertEqual(self.run_command("move", pan=1, tilt=-0.5, velocity=0.25), (1, -0.5, 0, 0.25))
+        self.assertEqual(self.run_command("set_fpsbr", fps=20, BitrateLimit=2048), (20, None, None, 2048))
+
+    def test_numeric_strings_and_integral_floats_become_numbers(self):
+        self.assertEqual(self.run_command("set_fpsbr", fps="20", width=1920.0, height="1080", BitrateLimit="512.5"),
+                         (20, 1920, 1080, 512.5))
+        fps = self.run_command("start_stream", rtmp_url="rtmp://x", streaming_fps=" 25 ")[2]
+        self.assertEqual(fps, 25)
+        self.assertIsInstance(fps, int)
+
+    def test_defaults_and_explicit_nulls_pass_through(self):
+        self.assertEqual(self.run_command("move_absolute", pan=None, tilt=0.1), (None, 0.1, None, None))
+        self.assertEqual(self.run_command("start_patrol"), ([], None, True, False))
+
+    def test_rejected_payloads(self):
+        rejected = [
+            ("move", {"pan": "left"}),
+            ("move", {"pan": True}),
+            ("move", {"pan": [1]}),
+            ("set_fpsbr", {"fps": "nan"}),
+            ("set_fpsbr", {"fps": "inf"}),
+            ("start_patrol", {"use_camera_tour": "yes"}),
+            ("create_preset", {}),
+            ("create_preset", {"preset_name": 1.5}),
+            ("cache_media", {"video_files": "a.mp4"}),
+        ]
+        for command, payload in rejected:
+            with self.subTest(command=command, payload=payload):
+                with self.assertRaises(CommandError):
+                    self.registry.prepare(command, payload)
+        self.assertEqual(self.target.calls, [])
+
+    def test_unknown_command_is_not_prepared(self):
+        self.assertIsNone(self.registry.prepare("self_destruct", {}))
+
+    def test_coerced_fps_is_range_checked_against_encoder_options(self):
+        fps = self.registry.arguments("set_fpsbr", {"fps": "40"})[0]
+        options = SimpleNamespace(H264=SimpleNamespace(FrameRateRange=SimpleNamespace(Min=1, Max=30)), Extension=None)
+        error = subscriber_module.MQTTSubscriber.validate_encoder_request(
+            None, SimpleNamespace(Encoding="H264"), options, fps=fps)
+        self.assertEqual(error, "FPS 40 outside supported range 1-30")
+
+
+if __name__ == "__main__":
+    unittest.main()
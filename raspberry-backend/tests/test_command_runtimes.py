@@ -0,0 +1,200 @@
+"""Command handling against the simulated camera, in both runtimes (threaded and asyncio).
+
+No broker or camera needed: control messages are handed to the subscriber's on_message the way
+paho would, and the PTZ service is fleet_simulator's SimulatedPTZ.
+
+    python -m pytest raspberry-backend/tests -q
+"""
+import asyncio
+import json
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from support import SENSOR_ID, load_subscriber_module, wait_for
+
+import fleet_simulator
+
+COMMAND_LIMITS = {"enabled": True, "max_delay": 5.0, "classes": {"motion": {"rate": 100, "burst": 100}}}
+
+subscriber_module = load_subscriber_module()
+
+
+def control_message(command, **arguments):
+    payload = json.dumps(dict(arguments, command=command)).encode()
+    return SimpleNamespace(topic=f"{SENSOR_ID}/control", payload=payload)
+
+
+class CommandRuntimeTests:
+    """Scenarios shared by both runtimes; subclasses say how messages are delivered."""
+
+    command_limits = None
+
+    def setUp(self):
+        subscriber_module.config["service_settings"]["command_limits"] = self.command_limits or {"enabled": False}
+        self.camera = fleet_simulator.SimulatedCamera({"pan": 0.5, "tilt": 0.5, "zoom": 0.5}, latency=0.0, jitter=0.0)
+        self.soap_calls = []
+        self.subscriber = subscriber_module.MQTTSubscriber(SENSOR_ID)
+        self.subscriber.init_camera = lambda: (self.camera, self.camera.ptz, "profile0")
+        self.responses = []
+        self.subscriber.client.publish = self._capture_publish
+        self._record_calls("ContinuousMove", "Stop", "AbsoluteMove")
+
+    def _capture_publish(self, topic, payload=None, *args, **kwargs):
+        if topic.endswith("/response"):
+            self.responses.append(json.loads(payload))
+
+    def _record_calls(self, *operations):
+        for operation in operations:
+            original = getattr(self.camera.ptz, operation)
+
+            def recorded(request, operation=operation, original=original):
+                result = original(request)
+                self.soap_calls.append(operation)
+                return result
+            setattr(self.camera.ptz, operation, recorded)
+
+    def slow_down(self, operation, seconds):
+        original = getattr(self.camera.ptz, operation)
+
+        def slow(request):
+            time.sleep(seconds)
+            return original(request)
+        setattr(self.camera.ptz, operation, slow)
+
+    def camera_moving(self):
+        with self.camera.ptz._lock:
+            self.camera.ptz._advance()
+            return self.camera.ptz._moving()
+
+    # ---- scenarios ----
+
+    def test_move_then_stop(self):
+        self.send(control_message("move", pan=1, tilt=0, zoom=0, velocity=0.5))
+        self.send(control_message("stop_ptz"))
+        self.assertTrue(self.settle(lambda: self.soap_calls.count("Stop") >= 1))
+        # With command limits on, the Stop may instead cancel the move while it is still queued
+        self.assertEqual(self.soap_calls[-1], "Stop")
+        self.assertFalse(self.camera_moving())
+
+    def test_get_position_replies(self):
+        self.send(control_message("get_position", refresh=True))
+        self.assertTrue(self.settle(lambda: any(r.get("type") == "position" for r in self.responses)))
+        reply = next(r for r in self.responses if r.get("type") == "position")
+        self.assertAlmostEqual(reply["position"]["pan"], 0.0)
+
+    def test_invalid_arguments_are_rejected(self):
+        self.send(control_message("move", pan="left"))
+        self.assertTrue(self.settle(lambda: any(r.get("type") == "command_error" for r in self.responses)))
+        self.assertNotIn("ContinuousMove", self.soap_calls)
+
+
+class LimitedCommandRuntimeTests(CommandRuntimeTests):
+    """Command limits on: queued commands run on the scheduler's worker (thread or loop task)."""
+
+    command_limits = COMMAND_LIMITS
+
+    def test_stop_wins_over_an_in_flight_move(self):
+        self.slow_down("ContinuousMove", 0.5)
+        self.send(control_message("move", pan=1, tilt=0, zoom=0, velocity=0.5))
+        self.assertTrue(wait_for(lambda: self.subscriber.command_scheduler.snapshot()["in_flight"] == "move"))
+        self.send(control_message("stop_ptz"))
+        # The Stop goes out at once and again after the slow ContinuousMove returns
+        self.assertTrue(self.settle(lambda: self.soap_calls.count("Stop") >= 2))
+        self.assertEqual(self.soap_calls, ["Stop", "ContinuousMove", "Stop"])
+        self.assertFalse(self.camera_moving())
+
+
+class ThreadedRuntimeMixin:
+    """paho's network thread calls on_message; here the test thread plays that role."""
+
+    def send(self, msg):
+        self.subscriber.on_message(self.subscriber.client, None, msg)
+
+    def settle(self, condition, timeout=5.0):
+        return wait_for(condition, timeout)
+
+    def tearDown(self):
+        self.subscriber.command_scheduler.stop()
+
+
+class AsyncRuntimeMixin:
+    """An AsyncRuntime loop on a background thread; messages arrive on the loop like paho's loop_read."""
+
+    command_timeout = 5.0
+
+    def setUp(self):
+        super().setUp()
+        self.runtime = subscriber_module.AsyncRuntime([self.subscriber], command_timeout=self.command_timeout)
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run_loop():
+            asyncio.set_event_loop(self.loop)
+            self.runtime.loop = self.loop
+            self.runtime._loop_thread = threading.get_ident()
+            self.runtime._stop_event = asyncio.Event()
+            self.runtime.attach(self.subscriber)
+            ready.set()
+            self.loop.run_forever()
+
+        self.loop_thread = threading.Thread(target=run_loop, daemon=True)
+        self.loop_thread.start()
+        ready.wait(timeout=5)
+
+    def send(self, msg):
+        client = self.subscriber.client
+        self.loop.call_soon_threadsafe(client.on_message, client, None, msg)
+
+    def settle(self, condition, timeout=5.0):
+        return wait_for(condition, timeout)
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.runtime.shutdown(), self.loop).result(timeout=15)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join(timeout=5)
+        self.loop.close()
+
+
+class ThreadedRuntimeTests(ThreadedRuntimeMixin, CommandRuntimeTests, unittest.TestCase):
+    pass
+
+
+class ThreadedLimitedRuntimeTests(ThreadedRuntimeMixin, LimitedCommandRuntimeTests, unittest.TestCase):
+    pass
+
+
+class AsyncRuntimeTests(AsyncRuntimeMixin, CommandRuntimeTests, unittest.TestCase):
+    pass
+
+
+class AsyncLimitedRuntimeTests(AsyncRuntimeMixin, LimitedCommandRuntimeTests, unittest.TestCase):
+    pass
+
+
+class AsyncCommandTimeoutTests(AsyncRuntimeMixin, CommandRuntimeTests, unittest.TestCase):
+    """A command that outlives the timeout still keeps the camera's commands in order."""
+
+    command_timeout = 0.1
+
+    def test_timed_out_move_is_not_overtaken(self):
+        self.slow_down("ContinuousMove", 0.5)
+        self.send(control_message("move", pan=1, tilt=0, zoom=0, velocity=0.5))
+        self.send(control_message("move_absolute", pan=0.2, tilt=0.1, zoom=0.0))
+        self.assertTrue(self.settle(lambda: "AbsoluteMove" in self.soap_calls))
+        self.assertEqual(self.soap_calls, ["ContinuousMove", "AbsoluteMove"])
+        self.assertEqual(self.runtime.metrics["timeouts"], 1)
+
+    def test_stop_after_timed_out_move_leaves_camera_stopped(self):
+        self.slow_down("ContinuousMove", 0.5)
+        self.send(control_message("move", pan=1, tilt=0, zoom=0, velocity=0.5))
+        self.assertTrue(wait_for(lambda: self.runtime.metrics["timeouts"] == 1))
+        self.send(control_message("stop_ptz"))
+        self.assertTrue(self.settle(lambda: self.soap_calls.count("Stop") >= 2))
+        self.assertEqual(self.soap_calls[-1], "Stop")
+        self.assertFalse(self.camera_moving())
+
+
+if __name__ == "__main__":
+    unittest.main()
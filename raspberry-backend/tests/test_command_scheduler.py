@@ -0,0 +1,138 @@
+"""TokenBucket and CommandScheduler: refill, burst, delays, rejections and the priority lane."""
+import threading
+import unittest
+
+from support import load_subscriber_module, wait_for
+
+subscriber_module = load_subscriber_module()
+
+
+class TokenBucketTests(unittest.TestCase):
+
+    def test_burst_is_available_at_once(self):
+        bucket = subscriber_module.TokenBucket(rate=1, burst=3)
+        self.assertEqual([bucket.reserve(max_delay=0) for _ in range(3)], [0.0, 0.0, 0.0])
+
+    def test_past_the_burst_tokens_are_handed_out_with_a_delay(self):
+        bucket = subscriber_module.TokenBucket(rate=2, burst=1)
+        self.assertEqual(bucket.reserve(max_delay=5), 0.0)
+        self.assertAlmostEqual(bucket.reserve(max_delay=5), 0.5, places=2)
+        self.assertAlmostEqual(bucket.reserve(max_delay=5), 1.0, places=2)
+
+    def test_delay_beyond_max_delay_is_rejected_without_taking_a_token(self):
+        bucket = subscriber_module.TokenBucket(rate=1, burst=1)
+        bucket.reserve(max_delay=0)
+        self.assertIsNone(bucket.reserve(max_delay=0.5))
+        self.assertAlmostEqual(bucket.reserve(max_delay=2), 1.0, places=2)
+
+    def test_zero_rate_never_refills(self):
+        bucket = subscriber_module.TokenBucket(rate=0, burst=1)
+        bucket.reserve(max_delay=0)
+        self.assertIsNone(bucket.reserve(max_delay=3600))
+
+    def test_refill_over_time_is_capped_at_the_burst(self):
+        bucket = subscriber_module.TokenBucket(rate=2, burst=2)
+        bucket.reserve(max_delay=0)
+        bucket.reserve(max_delay=0)
+        bucket.updated_at -= 0.5   # half a second later: one token back
+        self.assertEqual(bucket.reserve(max_delay=0), 0.0)
+        self.assertIsNone(bucket.reserve(max_delay=0.1))
+        bucket.updated_at -= 60
+        self.assertEqual([bucket.reserve(max_delay=0) for _ in range(2)], [0.0, 0.0])
+        self.assertIsNone(bucket.reserve(max_delay=0.1))
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def make_scheduler(self, **limits):
+        self.acks = []
+        scheduler = subscriber_module.CommandScheduler(
+            subscriber_module.merge_command_limits(dict({"enabled": True, "ack": "all"}, **limits)), self.acks.append)
+        self.addCleanup(scheduler.stop)
+        return scheduler
+
+    def statuses(self, command):
+        return [ack["status"] for ack in self.acks if ack["command"] == command]
+
+
+class StreamCommandTests(SchedulerTestCase):
+
+    def test_stream_commands_have_their_own_class(self):
+        for command in ("start_stream", "start_on_demand_stream", "cache_media"):
+            self.assertEqual(subscriber_module.COMMAND_CLASSES[command], "streams")
+        for command in ("stop_stream", "stop_on_demand_stream"):
+            self.assertEqual(subscriber_module.COMMAND_CLASSES[command], "priority")
+
+    def test_stop_gets_through_once_the_stream_bucket_is_empty(self):
+        scheduler = self.make_scheduler()
+        started = []
+        release = threading.Event()
+        for _ in range(6):
+            scheduler.submit("start_on_demand_stream", lambda: (release.wait(5), started.append(1)))
+        self.assertIn("rejected", self.statuses("start_on_demand_stream"))
+
+        stopped = []
+        scheduler.submit("stop_on_demand_stream", lambda: stopped.append(1))
+        self.assertEqual(stopped, [1])
+        self.assertEqual(self.statuses("stop_on_demand_stream"), ["bypassed"])
+        release.set()
+        self.assertTrue(wait_for(lambda: scheduler.snapshot()["in_flight"] is None and not scheduler.queued(), timeout=10))
+
+
+class SchedulerLimitTests(SchedulerTestCase):
+
+    def block_worker(self, scheduler):
+        """Park the worker on a command so later ones stay queued; returns the release event."""
+        release = threading.Event()
+        scheduler.submit("get_position", lambda: release.wait(5))
+        self.addCleanup(release.set)
+        self.assertTrue(wait_for(lambda: scheduler.snapshot()["in_flight"] == "get_position"))
+        return release
+
+    def test_full_queue_rejects_new_commands(self):
+        scheduler = self.make_scheduler(queue_size=2)
+        self.block_worker(scheduler)
+        scheduler.submit("move", lambda: None)
+        scheduler.submit("move", lambda: None)
+        scheduler.submit("move", lambda: None)
+        self.assertEqual(self.statuses("move"), ["accepted", "accepted", "rejected"])
+        self.assertEqual(self.acks[-1]["reason"], "queue_full")
+        self.assertEqual(scheduler.snapshot()["classes"]["motion"], {"accepted": 2, "rejected": 1})
+
+    def test_rate_limited_rejection_reports_retry_after(self):
+        scheduler = self.make_scheduler(classes={"presets": {"rate": 1, "burst": 1}}, max_delay=0.5)
+        self.block_worker(scheduler)
+        scheduler.submit("create_preset", lambda: None)
+        scheduler.submit("create_preset", lambda: None)
+        self.assertEqual(self.statuses("create_preset"), ["accepted", "rejected"])
+        self.assertEqual(self.acks[-1]["reason"], "rate_limited")
+        self.assertEqual(self.acks[-1]["retry_after"], 1.0)
+
+    def test_delayed_command_runs_once_its_token_is_due(self):
+        scheduler = self.make_scheduler(classes={"presets": {"rate": 5, "burst": 1}})
+        ran = []
+        scheduler.submit("create_preset", lambda: ran.append(1))
+        scheduler.submit("create_preset", lambda: ran.append(2))
+        self.assertEqual(self.statuses("create_preset"), ["accepted", "delayed"])
+        self.assertTrue(wait_for(lambda: ran == [1, 2]))
+
+    def test_stop_cancels_queued_moves(self):
+        scheduler = self.make_scheduler()
+        release = self.block_worker(scheduler)
+        moved, stopped = [], []
+        scheduler.submit("move", lambda: moved.append(1))
+        scheduler.submit("stop_ptz", lambda: stopped.append(1))
+        release.set()
+        self.assertTrue(wait_for(lambda: scheduler.snapshot()["in_flight"] is None))
+        self.assertEqual((moved, stopped), ([], [1]))
+        self.assertEqual(self.statuses("move"), ["accepted", "cancelled"])
+
+    def test_disabled_limits_run_commands_inline(self):
+        scheduler = self.make_scheduler(enabled=False)
+        ran = []
+        scheduler.submit("create_preset", lambda: ran.append(threading.get_ident()))
+        self.assertEqual(ran, [threading.get_ident()])
+
+
+if __name__ == "__main__":
+    unittest.main()
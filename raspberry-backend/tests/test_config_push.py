@@ -0,0 +1,183 @@
+"""MongoDB config push: applying change stream deltas, resume tokens and the polling fallback."""
+import threading
+import unittest
+
+from support import SENSOR_ID, load_subscriber_module, wait_for
+
+subscriber_module = load_subscriber_module()
+apply_config_update = subscriber_module.apply_config_update
+
+BASE_CONFIG = {"sensor_id": SENSOR_ID, "service_settings": {"camera_details": {"host": "10.0.0.5", "presets": [
+    {"name": "gate", "token": "1"}, {"name": "yard", "token": "2"}]}, "mqtt_topics": {"control": "c"}}}
+
+
+class ApplyConfigUpdateTests(unittest.TestCase):
+
+    def test_nested_fields_are_merged_into_a_copy(self):
+        description = {"updatedFields": {"config_content.service_settings.camera_details.host": "10.0.0.9",
+                                          "config_content.service_settings.camera_details.presets.1.name": "car park",
+                                          "version": 7}}
+        new_config = apply_config_update(BASE_CONFIG, description)
+        details = new_config["service_settings"]["camera_details"]
+        self.assertEqual(details["host"], "10.0.0.9")
+        self.assertEqual(details["presets"][1], {"name": "car park", "token": "2"})
+        self.assertEqual(BASE_CONFIG["service_settings"]["camera_details"]["host"], "10.0.0.5")
+
+    def test_new_keys_and_array_elements_are_created(self):
+        description = {"updatedFields": {"config_content.service_settings.telemetry.enabled": True,
+                                          "config_content.service_settings.camera_details.presets.3": {"name": "roof"}}}
+        new_config = apply_config_update(BASE_CONFIG, description)
+        self.assertEqual(new_config["service_settings"]["telemetry"], {"enabled": True})
+        self.assertEqual(new_config["service_settings"]["camera_details"]["presets"][2:], [None, {"name": "roof"}])
+
+    def test_removed_fields(self):
+        description = {"removedFields": ["config_content.service_settings.mqtt_topics.control",
+                                         "config_content.service_settings.missing.key"]}
+        new_config = apply_config_update(BASE_CONFIG, description)
+        self.assertEqual(new_config["service_settings"]["mqtt_topics"], {})
+
+    def test_whole_content_replaced_as_document_or_json_string(self):
+        self.assertEqual(apply_config_update(BASE_CONFIG, {"updatedFields": {"config_content": {"a": 1}}}), {"a": 1})
+        self.assertEqual(apply_config_update(BASE_CONFIG, {"updatedFields": {"config_content": '{"a": 2}'}}), {"a": 2})
+
+    def test_changes_outside_config_content_are_ignored(self):
+        self.assertIsNone(apply_config_update(BASE_CONFIG, {"updatedFields": {"version": 8, "updated_by": "ops"}}))
+        self.assertIsNone(apply_config_update(BASE_CONFIG, {}))
+
+
+class MongoError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeStream:
+    """Yields the queued changes, then blocks like a real change stream until closed."""
+
+    def __init__(self, changes):
+        self.changes = changes
+        self.resume_token = None
+        self.closed = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        for number, change in enumerate(self.changes, start=1):
+            self.resume_token = {"_data": f"token-{number}"}
+            yield change
+        self.closed.wait(5)
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeCollection:
+
+    def __init__(self, document, watch_results):
+        self.document = document
+        self.watch_results = list(watch_results)   # per watch() call: an exception to raise or a list of changes
+        self.watch_calls = []
+        self.find_calls = 0
+
+    def watch(self, pipeline, **options):
+        self.watch_calls.append(options)
+        result = self.watch_results.pop(0) if self.watch_results else []
+        if isinstance(result, Exception):
+            raise result
+        return FakeStream(result)
+
+    def find_one(self, query, projection):
+        self.find_calls += 1
+        return {key: value for key, value in self.document.items() if key in projection or key == "_id"}
+
+
+class ConfigStreamTests(unittest.TestCase):
+
+    def setUp(self):
+        subscriber_module.save_json_cache(subscriber_module.CONFIG_STREAM_CACHE, {})
+        self.config = dict(BASE_CONFIG)
+        self.delivered = []
+
+    def follow(self, collection, **settings):
+        def on_update(new_config):
+            self.delivered.append(new_config)
+            self.config = new_config
+        stream = subscriber_module.ConfigStream(SENSOR_ID, {}, on_update, lambda: self.config,
+                                                dict({"retry_interval": 0.01, "poll_interval": 0.01}, **settings))
+        stream._collection = lambda: collection
+        stream.start()
+        self.addCleanup(stream.stop)
+        return stream
+
+    def cached_token(self):
+        return subscriber_module.load_json_cache(subscriber_module.CONFIG_STREAM_CACHE).get(SENSOR_ID, {}).get("resume_token")
+
+    def test_updates_are_applied_and_the_resume_token_saved(self):
+        collection = FakeCollection({}, [[
+            {"operationType": "update", "updateDescription": {"updatedFields": {"config_content.service_settings.camera_details.host": "10.0.0.7"}}},
+            {"operationType": "update", "updateDescription": {"updatedFields": {"version": 3}}},
+        ]])
+        self.follow(collection)
+        self.assertTrue(wait_for(lambda: self.cached_token() == {"_data": "token-2"}))
+        self.assertEqual(len(self.delivered), 1)
+        self.assertEqual(self.delivered[0]["service_settings"]["camera_details"]["host"], "10.0.0.7")
+        self.assertEqual(collection.watch_calls, [{}])
+
+    def test_restart_resumes_after_the_cached_token(self):
+        subscriber_module.save_json_cache(subscriber_module.CONFIG_STREAM_CACHE, {SENSOR_ID: {"resume_token": {"_data": "old"}}})
+        collection = FakeCollection({}, [[]])
+        self.follow(collection)
+        self.assertTrue(wait_for(lambda: collection.watch_calls))
+        self.assertEqual(collection.watch_calls[0], {"start_after": {"_data": "old"}})
+
+    def test_lost_resume_token_starts_fresh_and_resynchronises(self):
+        subscriber_module.save_json_cache(subscriber_module.CONFIG_STREAM_CACHE, {SENSOR_ID: {"resume_token": {"_data": "stale"}}})
+        pushed = dict(BASE_CONFIG, sensor_id="renamed")
+        collection = FakeCollection({"_id": SENSOR_ID, "config_content": pushed},
+                                    [MongoError("ChangeStreamHistoryLost", 286), []])
+        self.follow(collection)
+        self.assertTrue(wait_for(lambda: self.delivered))
+        self.assertEqual(collection.watch_calls, [{"start_after": {"_data": "stale"}}, {}])
+        self.assertEqual(self.delivered, [pushed])
+        self.assertIsNone(self.cached_token())
+
+    def test_truncated_arrays_fetch_the_whole_document(self):
+        pushed = dict(BASE_CONFIG, service_settings={"camera_details": {"presets": []}})
+        collection = FakeCollection({"_id": SENSOR_ID, "config_content": pushed}, [[
+            {"operationType": "update", "updateDescription": {
+                "updatedFields": {}, "truncatedArrays": [{"field": "config_content.service_settings.camera_details.presets", "newSize": 0}]}},
+        ]])
+        self.follow(collection)
+        self.assertTrue(wait_for(lambda: self.delivered))
+        self.assertEqual(self.delivered, [pushed])
+
+    def test_replacement_and_unchanged_documents(self):
+        collection = FakeCollection({}, [[
+            {"operationType": "replace", "fullDocument": {"config_content": BASE_CONFIG}},
+            {"operationType": "replace", "fullDocument": {"config_content": {"sensor_id": "new"}}},
+            {"operationType": "delete"},
+        ]])
+        self.follow(collection)
+        self.assertTrue(wait_for(lambda: self.cached_token() == {"_data": "token-3"}))
+        self.assertEqual(self.delivered, [{"sensor_id": "new"}])
+
+    def test_falls_back_to_polling_without_a_replica_set(self):
+        pushed = dict(BASE_CONFIG, sensor_id="polled")
+        collection = FakeCollection({"_id": SENSOR_ID, "version": 1, "config_content": pushed},
+                                    [MongoError("The $changeStream stage is only supported on replica sets", 40573)])
+        stream = self.follow(collection)
+        self.assertTrue(wait_for(lambda: self.delivered))
+        self.assertEqual(stream.mode, "poll")
+        self.assertEqual(self.delivered, [pushed])
+        # Same version on later polls: nothing is delivered again
+        calls = collection.find_calls
+        self.assertTrue(wait_for(lambda: collection.find_calls >= calls + 3))
+        self.assertEqual(len(self.delivered), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+"""MediaCache: content-addressed keys, background transcodes (with a fake ffmpeg) and LRU eviction."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from support import load_subscriber_module, wait_for
+
+subscriber_module = load_subscriber_module()
+
+# Copies the input to the output, or fails when the input's name says so
+FAKE_FFMPEG = f"""#!{sys.executable}
+import shutil, sys
+args = sys.argv[1:]
+source = args[args.index("-i") + 1]
+if "broken" in source:
+    sys.stderr.write("Invalid data found when processing input")
+    sys.exit(1)
+shutil.copyfile(source, args[-1])
+"""
+
+KB = 1024
+
+
+class MediaCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="media-cache-test-")
+        self.addCleanup(shutil.rmtree, self.root, True)
+        bin_dir = os.path.join(self.root, "bin")
+        os.makedirs(bin_dir)
+        with open(os.path.join(bin_dir, "ffmpeg"), "w") as file:
+            file.write(FAKE_FFMPEG)
+        os.chmod(os.path.join(bin_dir, "ffmpeg"), 0o755)
+        for patcher in (mock.patch.object(subscriber_module, "ROOT_DIR", self.root),
+                        mock.patch.dict(os.environ, {"PATH": bin_dir + os.pathsep + os.environ.get("PATH", "")})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.videos = os.path.join(self.root, "videos")
+        os.makedirs(self.videos)
+
+    def video(self, name, size=4 * KB, fill=b"a"):
+        path = os.path.join(self.videos, name)
+        with open(path, "wb") as file:
+            file.write(fill * size)
+        return path
+
+    def cache(self, **settings):
+        cache = subscriber_module.MediaCache(dict({"nice": 0}, **settings))
+        self.addCleanup(cache.stop, 0)
+        return cache
+
+    def settle(self, cache, transcodes):
+        self.assertTrue(wait_for(lambda: cache.snapshot()["pending"] == 0
+                                 and cache.transcodes + cache.failures >= transcodes))
+
+    def test_key_covers_content_and_encoding(self):
+        key = subscriber_module.rendition_key("abc", {"width": 1280, "height": 720})
+        self.assertEqual(key, subscriber_module.rendition_key("abc", {"height": 720, "width": 1280}))
+        self.assertNotEqual(key, subscriber_module.rendition_key("abd", {"width": 1280, "height": 720}))
+        self.assertNotEqual(key, subscriber_module.rendition_key("abc", {"width": 960, "height": 720}))
+
+    def test_miss_schedules_a_transcode_and_the_next_play_hits(self):
+        cache = self.cache()
+        clip = self.video("clip.mp4")
+        self.assertIsNone(cache.lookup(clip))
+        self.settle(cache, 1)
+        rendition = cache.lookup(clip)
+        self.assertTrue(rendition and os.path.isfile(rendition))
+        self.assertEqual(os.path.dirname(rendition), os.path.join(self.root, "cache", "media"))
+        snapshot = cache.snapshot()
+        self.assertEqual((snapshot["hits"], snapshot["misses"], snapshot["transcodes"]), (1, 1, 1))
+        self.assertEqual([name for name in os.listdir(os.path.dirname(rendition)) if name.endswith(".tmp")], [])
+
+    def test_same_content_under_another_name_is_encoded_once(self):
+        cache = self.cache()
+        first, copy = self.video("a.mp4"), self.video("b.mp4")
+        cache.lookup(first)
+        self.settle(cache, 1)
+        cache.lookup(copy)
+        self.assertTrue(wait_for(lambda: cache.snapshot()["pending"] == 0))
+        self.assertEqual(cache.lookup(copy), cache.lookup(first))
+        self.assertEqual(cache.transcodes, 1)
+
+    def test_edited_source_is_a_miss(self):
+        cache = self.cache()
+        clip = self.video("clip.mp4")
+        cache.lookup(clip)
+        self.settle(cache, 1)
+        self.video("clip.mp4", size=5 * KB, fill=b"b")
+        self.assertIsNone(cache.lookup(clip))
+        self.settle(cache, 2)
+        self.assertIsNotNone(cache.lookup(clip))
+
+    def test_changed_encoding_settings_are_a_miss(self):
+        cache = self.cache()
+        clip = self.video("clip.mp4")
+        cache.lookup(clip)
+        self.settle(cache, 1)
+        cache.configure({"nice": 0, "encoding": {"video_bitrate": "600k"}})
+        self.assertIsNone(cache.lookup(clip))
+
+    def test_least_recently_played_rendition_is_evicted(self):
+        cache = self.cache(max_size_mb=1)
+        first, second, third = (self.video(f"{n}.mp4", size=400 * KB, fill=n.encode()) for n in "xyz")
+        for number, clip in enumerate((first, second), start=1):
+            cache.lookup(clip)
+            self.settle(cache, number)
+        self.assertIsNotNone(cache.lookup(first))   # played again: second is now the oldest
+        cache.lookup(third)
+        self.settle(cache, 3)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNotNone(cache.lookup(first))
+        self.assertIsNotNone(cache.lookup(third))
+        self.assertIsNone(cache.lookup(second))
+        self.assertEqual(len(os.listdir(os.path.join(self.root, "cache", "media"))), 2)
+
+    def test_index_survives_a_restart_and_drops_missing_files(self):
+        cache = self.cache()
+        kept, lost = self.video("kept.mp4", fill=b"k"), self.video("lost.mp4", fill=b"l")
+        for number, clip in enumerate((kept, lost), start=1):
+            cache.lookup(clip)
+            self.settle(cache, number)
+        os.remove(cache.lookup(lost))
+        leftover = os.path.join(cache.directory, "half.mp4.123.tmp")
+        open(leftover, "w").close()
+
+        restarted = self.cache()
+        self.assertIsNotNone(restarted.lookup(kept))
+        self.assertIsNone(restarted.lookup(lost))
+        self.assertFalse(os.path.exists(leftover))
+
+    def test_failed_transcode_is_counted_and_cleaned_up(self):
+        cache = self.cache()
+        clip = self.video("broken.mp4")
+        cache.lookup(clip)
+        self.settle(cache, 1)
+        self.assertEqual((cache.failures, cache.transcodes), (1, 0))
+        self.assertEqual(os.listdir(cache.directory), [])
+
+    def test_prewarm_scans_folders(self):
+        cache = self.cache()
+        self.video("one.mp4", fill=b"1")
+        self.video("two.MKV", fill=b"2")
+        self.video("notes.txt", fill=b"3")
+        self.assertEqual(cache.prewarm([self.videos, os.path.join(self.videos, "missing.mp4")]), 2)
+        self.settle(cache, 2)
+        self.assertEqual(cache.snapshot()["renditions"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
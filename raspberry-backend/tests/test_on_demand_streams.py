@@ -0,0 +1,207 @@
+"""On-demand streams: slot admission and placement, and governor restarts of running encodes."""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from support import SENSOR_ID, load_subscriber_module
+
+subscriber_module = load_subscriber_module()
+
+# Stands in for ffmpeg: runs until terminated
+IDLE_PROCESS = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+class StreamSlotsTests(unittest.TestCase):
+
+    def slots(self, cores=(0, 1, 2, 3), **settings):
+        return subscriber_module.StreamSlots(settings, cores=list(cores))
+
+    def test_capacity_leaves_reserved_cores_free(self):
+        slots = self.slots()
+        self.assertEqual((slots.reserved, slots.pool, slots.capacity), ([0], [1, 2, 3], 3.0))
+        self.assertTrue(all(slots.reserve(f"e{n}", "encode") for n in range(3)))
+        self.assertIsNone(slots.reserve("e3", "encode"))
+        slots.release("e1")
+        self.assertIsNotNone(slots.reserve("e3", "encode"))
+
+    def test_remuxes_are_cheaper_than_encodes(self):
+        slots = self.slots()
+        slots.reserve("e0", "encode")
+        slots.reserve("e1", "encode")
+        self.assertTrue(all(slots.reserve(f"r{n}", "remux") for n in range(4)))
+        self.assertIsNone(slots.reserve("r4", "remux"))
+        self.assertEqual(slots.snapshot()["used"], 3.0)
+
+    def test_single_core_still_runs_one_encode(self):
+        slots = self.slots(cores=[0])
+        self.assertEqual(slots.capacity, 1.0)
+        self.assertIsNotNone(slots.reserve("e0", "encode"))
+        self.assertIsNone(slots.reserve("e1", "encode"))
+
+    def test_max_streams_caps_admission(self):
+        slots = self.slots(max_streams=2)
+        slots.reserve("r0", "remux")
+        slots.reserve("r1", "remux")
+        self.assertIsNone(slots.reserve("r2", "remux"))
+
+    def test_encodes_are_spread_over_the_least_loaded_cores(self):
+        slots = self.slots()
+        placed = [slots.reserve(f"e{n}", "encode")["cores"] for n in range(3)]
+        self.assertEqual(sorted(placed), [[1], [2], [3]])
+        self.assertEqual(slots.get("e0")["nice"], 5)
+
+    def test_remuxes_share_the_whole_pool_at_normal_priority(self):
+        remux = self.slots().reserve("r0", "remux")
+        self.assertEqual((remux["cores"], remux["nice"]), ([1, 2, 3], 0))
+
+    def test_released_core_is_reused_first(self):
+        slots = self.slots()
+        for n in range(3):
+            slots.reserve(f"e{n}", "encode")
+        freed = slots.get("e1")["cores"]
+        slots.release("e1")
+        self.assertEqual(slots.reserve("e3", "encode")["cores"], freed)
+
+    def test_unpinned(self):
+        slots = self.slots(pin_cores=False)
+        self.assertIsNone(slots.reserve("e0", "encode")["cores"])
+
+    def test_apply_renices_and_pins_a_child(self):
+        process = subprocess.Popen(IDLE_PROCESS)
+        self.addCleanup(subscriber_module.terminate_processes, [process], 0)
+        core = subscriber_module.available_cores()[0]
+        subscriber_module.StreamSlots().apply({"nice": 3, "cores": [core]}, process.pid)
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, process.pid), os.getpriority(os.PRIO_PROCESS, 0) + 3)
+        if hasattr(os, "sched_getaffinity"):
+            self.assertEqual(os.sched_getaffinity(process.pid), {core})
+        # An exited process or a missing core is logged, not raised
+        subscriber_module.StreamSlots().apply({"nice": 0, "cores": [4095]}, process.pid)
+
+
+class StreamAdmissionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.subscriber = subscriber_module.MQTTSubscriber(SENSOR_ID)
+        self.responses = []
+        self.subscriber.publish_response = self.responses.append
+        self.subscriber.media_cache = None
+        self.subscriber.stream_slots.configure({"pin_cores": False}, cores=[0, 1, 2])
+        self.subscriber.on_demand_command = lambda *args, **kwargs: IDLE_PROCESS
+        self.addCleanup(lambda: subscriber_module.terminate_processes(list(self.subscriber.ffmpeg_processes.values()), 0))
+        video = tempfile.NamedTemporaryFile(suffix=".mp4", delete=False)
+        video.close()
+        self.addCleanup(os.remove, video.name)
+        self.video = video.name
+
+    def test_streams_beyond_capacity_are_refused(self):
+        for stream_id in ("a", "b", "c"):
+            self.subscriber.start_on_demand_stream("rtmp://server/x", self.video, stream_id)
+        self.assertEqual(sorted(self.subscriber.ffmpeg_processes), ["a", "b"])
+        self.assertEqual(self.responses[-1]["error"], "no free stream slot")
+        self.assertEqual(self.responses[-1]["stream_id"], "c")
+
+    def test_exited_stream_gives_its_slot_back(self):
+        self.subscriber.start_on_demand_stream("rtmp://server/x", self.video, "a")
+        self.subscriber.start_on_demand_stream("rtmp://server/x", self.video, "b")
+        subscriber_module.terminate_processes([self.subscriber.ffmpeg_processes["a"]], 0)
+        self.subscriber.start_on_demand_stream("rtmp://server/x", self.video, "c")
+        self.assertEqual(sorted(self.subscriber.ffmpeg_processes), ["b", "c"])
+
+    def test_stop_releases_the_slot(self):
+        self.subscriber.start_on_demand_stream("rtmp://server/x", self.video, "a")
+        self.subscriber.start_on_demand_stream("rtmp://server/x", self.video, "b")
+        self.subscriber.stop_on_demand_stream("a")
+        self.assertIsNone(self.subscriber.stream_slots.get("a"))
+        self.subscriber.start_on_demand_stream("rtmp://server/x", self.video, "c")
+        self.assertIn("c", self.subscriber.ffmpeg_processes)
+
+
+class GovernorRestartTests(unittest.TestCase):
+
+    def setUp(self):
+        self.subscriber = subscriber_module.MQTTSubscriber(SENSOR_ID)
+        self.subscriber.client.publish = lambda *args, **kwargs: None
+        self.subscriber.stream_governor = subscriber_module.StreamGovernor(None, {"root": "/nonexistent"})
+        # Room for a few encodes whatever this machine has; nothing is pinned
+        self.subscriber.stream_slots.configure({"pin_cores": False}, cores=[0, 1, 2, 3])
+        self.launched = []
+        self.subscriber.on_demand_command = self.record_launch
+        self.addCleanup(self.kill_all)
+
+    def record_launch(self, video_file, rtmp_url, rendition=None, offset=0):
+        self.launched.append((video_file, offset))
+        return IDLE_PROCESS
+
+    def kill_all(self):
+        subscriber_module.terminate_processes(list(self.subscriber.ffmpeg_processes.values()), grace=0)
+
+    def start_encode(self, stream_id):
+        slot = self.subscriber.stream_slots.reserve(stream_id, "encode")
+        process = subprocess.Popen(IDLE_PROCESS)
+        self.addCleanup(subscriber_module.terminate_processes, [process], 0)
+        self.subscriber.ffmpeg_processes[stream_id] = process
+        self.subscriber._stream_info[stream_id] = {
+            "video_file": f"{stream_id}.mp4", "rtmp_url": f"rtmp://server/{stream_id}", "mode": "encode",
+            "quality": "720p", "cores": slot["cores"], "nice": slot["nice"], "started_at": time.time() - 12,
+        }
+        return process
+
+    def restart_with(self, during_terminate):
+        """Step the governor down and run _restart_encode_streams, calling during_terminate() mid-termination."""
+        real_terminate = subscriber_module.terminate_processes
+        seen = []
+
+        def terminate(processes, grace):
+            if not seen:
+                seen.append(self.subscriber._ffmpeg_lock.locked())
+                during_terminate()
+            return real_terminate(processes, grace=0.5)
+
+        self.subscriber.stream_governor.level = 1
+        with mock.patch.object(subscriber_module, "terminate_processes", terminate):
+            self.subscriber._restart_encode_streams()
+        return seen
+
+    def test_restart_relaunches_at_the_new_level_without_holding_the_lock(self):
+        old = self.start_encode("s1")
+        lock_free = []
+        seen = self.restart_with(lambda: lock_free.append(self.subscriber._ffmpeg_lock.acquire(timeout=0.1)
+                                                          and self.subscriber._ffmpeg_lock.release() is None))
+        self.assertEqual(seen, [False])
+        self.assertEqual(lock_free, [True])
+        self.assertIsNotNone(old.poll())
+        relaunched = self.subscriber.ffmpeg_processes["s1"]
+        self.assertIsNot(relaunched, old)
+        self.assertIsNone(relaunched.poll())
+        self.assertEqual(self.launched[0][0], "s1.mp4")
+        self.assertGreaterEqual(self.launched[0][1], 12)
+        info = self.subscriber._stream_info["s1"]
+        self.assertEqual(info["quality"], "540p")
+        self.assertGreaterEqual(info["offset"], 12)
+
+    def test_stream_stopped_during_the_restart_stays_stopped(self):
+        self.start_encode("s1")
+        self.start_encode("s2")
+        stopper = threading.Thread(target=self.subscriber.stop_on_demand_stream, args=("s1",))
+        self.restart_with(lambda: (stopper.start(), stopper.join(5)))
+        self.assertNotIn("s1", self.subscriber.ffmpeg_processes)
+        self.assertNotIn("s1", self.subscriber._stream_info)
+        self.assertIsNone(self.subscriber.stream_slots.get("s1"))
+        self.assertEqual([video_file for video_file, _ in self.launched], ["s2.mp4"])
+
+    def test_stream_restarted_by_someone_else_is_left_alone(self):
+        self.start_encode("s1")
+
+        def replace():
+            self.subscriber.ffmpeg_processes["s1"] = subprocess.Popen(IDLE_PROCESS)
+        self.restart_with(replace)
+        self.assertEqual(self.launched, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Travel-optimized patrol ordering (nearest neighbour + 2-opt) and how start_patrol applies it."""
+import copy
+import itertools
+import random
+import unittest
+from unittest import mock
+
+from support import SENSOR_ID, load_subscriber_module
+
+subscriber_module = load_subscriber_module()
+optimize_patrol_route = subscriber_module.optimize_patrol_route
+
+SPEEDS = {"pan": 0.5, "tilt": 0.5, "zoom": 0.5}
+
+
+def at(pan, tilt, zoom=0.0):
+    return {"pan": pan, "tilt": tilt, "zoom": zoom}
+
+
+def cycle_time(order, positions, speeds=SPEEDS):
+    hops = zip(order, order[1:] + order[:1])
+    return sum(max(abs(positions[a][axis] - positions[b][axis]) / speeds[axis] for axis in speeds) for a, b in hops)
+
+
+class OptimizePatrolRouteTests(unittest.TestCase):
+
+    def test_hop_takes_as_long_as_the_slowest_axis(self):
+        np = subscriber_module.lazy_import("numpy")
+        matrix = subscriber_module.travel_time_matrix(np.array([[0.0, 0.0, 0.0], [0.5, 0.2, 0.1]]),
+                                                      np.array([0.5, 0.1, 1.0]))
+        self.assertAlmostEqual(matrix[0, 1], 2.0)
+        self.assertAlmostEqual(matrix[1, 0], 2.0)
+        self.assertEqual(matrix[0, 0], 0.0)
+
+    def test_three_or_fewer_presets_keep_their_order(self):
+        for count in (1, 2, 3):
+            positions = {f"p{i}": at(0.9 * (-1) ** i, 0.1 * i) for i in range(count)}
+            names, before, after = optimize_patrol_route(positions, SPEEDS)
+            self.assertEqual(names, list(positions))
+            self.assertEqual(before, after)
+
+    def test_crossed_loop_is_uncrossed(self):
+        # Presets along one pan line, visited back and forth
+        positions = {"a": at(-1, 0), "c": at(0.5, 0), "b": at(-0.5, 0), "d": at(1, 0)}
+        names, before, after = optimize_patrol_route(positions, SPEEDS)
+        self.assertEqual(names[0], "a")
+        self.assertIn(names, (["a", "b", "c", "d"], ["a", "d", "c", "b"]))
+        self.assertAlmostEqual(before, 12.0)
+        self.assertAlmostEqual(after, 8.0)
+        self.assertAlmostEqual(after, cycle_time(names, positions))
+
+    def test_good_order_is_left_alone(self):
+        positions = {"a": at(-1, -1), "b": at(1, -1), "c": at(1, 1), "d": at(-1, 1), "e": at(-1, 0)}
+        names, before, after = optimize_patrol_route(positions, SPEEDS)
+        self.assertEqual(names, list(positions))
+        self.assertEqual(before, after)
+
+    def test_random_layouts_never_get_slower_and_stay_near_optimal(self):
+        rng = random.Random(7)
+        for _ in range(20):
+            positions = {f"p{i}": at(rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(0, 1)) for i in range(7)}
+            names, before, after = optimize_patrol_route(positions, SPEEDS)
+            self.assertEqual(sorted(names), sorted(positions))
+            self.assertEqual(names[0], "p0")
+            self.assertAlmostEqual(before, cycle_time(list(positions), positions))
+            self.assertAlmostEqual(after, cycle_time(names, positions))
+            self.assertLessEqual(after, before + 1e-9)
+            best = min(cycle_time(["p0"] + list(rest), positions) for rest in itertools.permutations(list(positions)[1:]))
+            self.assertLessEqual(after, best * 1.25)
+
+    def test_speeds_change_the_route(self):
+        # Fast pan, slow tilt: the route should group presets by tilt
+        positions = {"a": at(-1, 0), "b": at(1, 1), "c": at(1, 0), "d": at(-1, 1)}
+        names, _, _ = optimize_patrol_route(positions, {"pan": 10.0, "tilt": 0.1, "zoom": 1.0})
+        self.assertIn(names, (["a", "c", "b", "d"], ["a", "d", "b", "c"]))
+
+
+class OptimizePatrolOrderTests(unittest.TestCase):
+
+    def setUp(self):
+        camera_config = copy.deepcopy(subscriber_module.camera_details)
+        self.subscriber = subscriber_module.MQTTSubscriber(SENSOR_ID, camera_config=camera_config)
+        self.subscriber.reconcile_presets = lambda force=False: True
+        line = {"a": at(-1, 0), "c": at(0.5, 0), "b": at(-0.5, 0), "d": at(1, 0)}
+        for token, (name, position) in enumerate(line.items(), start=1):
+            self.subscriber.presets.add(name, token, position)
+        self.subscriber.presets.add("mystery", 9)
+
+    def test_presets_without_coordinates_go_last(self):
+        order = self.subscriber._optimize_patrol_order(["a", "mystery", "c", "b", "d"])
+        self.assertEqual(order[-1], "mystery")
+        self.assertEqual(order[0], "a")
+        self.assertEqual(sorted(order), ["a", "b", "c", "d", "mystery"])
+        self.assertIn(order[:4], (["a", "b", "c", "d"], ["a", "d", "c", "b"]))
+
+    def test_duplicates_are_visited_once(self):
+        order = self.subscriber._optimize_patrol_order(["a", "c", "b", "d", "a"])
+        self.assertEqual(sorted(order), ["a", "b", "c", "d"])
+
+    def test_fewer_than_four_known_presets_keep_the_given_order(self):
+        given = ["c", "mystery", "a", "b"]
+        self.assertEqual(self.subscriber._optimize_patrol_order(given), given)
+
+    def test_failure_keeps_the_given_order(self):
+        given = ["a", "c", "b", "d"]
+        with mock.patch.object(subscriber_module, "optimize_patrol_route", side_effect=ImportError("numpy")):
+            self.assertEqual(self.subscriber._optimize_patrol_order(given), given)
+
+
+if __name__ == "__main__":
+    unittest.main()
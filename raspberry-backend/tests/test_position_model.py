@@ -0,0 +1,118 @@
+"""PositionModel dead reckoning, and absolute moves that depend on it."""
+import json
+import unittest
+
+from support import SENSOR_ID, load_subscriber_module
+
+import fleet_simulator
+
+subscriber_module = load_subscriber_module()
+
+
+def elapse(model, seconds):
+    """Pretend `seconds` passed since the model was last anchored."""
+    model.anchored_at -= seconds
+
+
+class PositionModelTests(unittest.TestCase):
+
+    def setUp(self):
+        self.model = subscriber_module.PositionModel(
+            speeds={"pan": 0.5, "tilt": 0.25, "zoom": 0.1},
+            limits={"pan": [-1.0, 1.0], "tilt": [-1.0, 1.0], "zoom": [0.0, 1.0]})
+
+    def assertPosition(self, expected, places=3):
+        estimate = self.model.estimate()
+        for axis, value in expected.items():
+            self.assertAlmostEqual(estimate[axis], value, places=places, msg=axis)
+        return estimate
+
+    def test_unknown_until_anchored(self):
+        self.assertIsNone(self.model.estimate())
+        self.model.start_continuous(1, 0, 0)
+        self.assertIsNone(self.model.estimate())
+
+    def test_status_anchor(self):
+        self.model.update_from_status(0.1, -0.2, 0.3)
+        estimate = self.assertPosition({"pan": 0.1, "tilt": -0.2, "zoom": 0.3})
+        self.assertEqual((estimate["moving"], estimate["source"]), (False, "status"))
+
+    def test_continuous_move_is_dead_reckoned_and_clamped(self):
+        self.model.update_from_status(0.0, 0.0, 0.0)
+        self.model.start_continuous(0.5, -1.0, 0.0)
+        elapse(self.model, 2.0)
+        estimate = self.assertPosition({"pan": 0.5, "tilt": -0.5, "zoom": 0.0})
+        self.assertEqual((estimate["moving"], estimate["source"]), (True, "estimate"))
+        elapse(self.model, 10.0)
+        self.assertPosition({"pan": 1.0, "tilt": -1.0})
+
+    def test_move_to_travels_towards_the_target_and_stops_there(self):
+        self.model.update_from_status(0.0, 0.0, 0.0)
+        self.model.move_to(pan=0.8, zoom=None, speed=0.5)
+        elapse(self.model, 1.0)
+        self.assertTrue(self.assertPosition({"pan": 0.25, "tilt": 0.0, "zoom": 0.0})["moving"])
+        elapse(self.model, 10.0)
+        self.assertFalse(self.assertPosition({"pan": 0.8, "tilt": 0.0})["moving"])
+
+    def test_stop_freezes_the_estimate(self):
+        self.model.update_from_status(0.0, 0.0, 0.0)
+        self.model.start_continuous(1.0, 0.0, 0.0)
+        elapse(self.model, 1.0)
+        self.model.stop()
+        elapse(self.model, 5.0)
+        self.assertFalse(self.assertPosition({"pan": 0.5}, places=2)["moving"])
+
+    def test_status_reports_whether_the_camera_still_moves(self):
+        self.model.update_from_status(0.0, 0.0, 0.0)
+        self.model.start_continuous(1.0, 0.0, 0.0)
+        self.model.update_from_status(0.2, 0.0, 0.0)   # no MoveStatus: keep dead reckoning
+        elapse(self.model, 1.0)
+        self.assertPosition({"pan": 0.7})
+        self.model.update_from_status(0.3, 0.0, 0.0, moving=False)
+        elapse(self.model, 1.0)
+        self.assertPosition({"pan": 0.3})
+
+    def test_move_rebases_a_running_motion(self):
+        self.model.update_from_status(0.0, 0.0, 0.0)
+        self.model.start_continuous(1.0, 0.0, 0.0)
+        elapse(self.model, 1.0)
+        self.model.move_to(pan=0.0)
+        self.assertPosition({"pan": 0.5}, places=2)
+
+    def test_invalidate(self):
+        self.model.update_from_status(0.0, 0.0, 0.0)
+        self.model.invalidate()
+        self.assertIsNone(self.model.estimate())
+
+
+class MoveAbsoluteTests(unittest.TestCase):
+
+    def setUp(self):
+        subscriber_module.config["service_settings"]["command_limits"] = {"enabled": False}
+        self.camera = fleet_simulator.SimulatedCamera({"pan": 10, "tilt": 10, "zoom": 10}, latency=0.0, jitter=0.0)
+        self.camera.ptz.position.update(pan=0.2, tilt=-0.4, zoom=0.5)
+        self.subscriber = subscriber_module.MQTTSubscriber(SENSOR_ID)
+        self.subscriber.init_camera = lambda: (self.camera, self.camera.ptz, "profile0")
+        self.responses = []
+        self.subscriber.client.publish = lambda topic, payload=None, *args, **kwargs: self.responses.append(json.loads(payload))
+        self.sent = []
+        absolute_move = self.camera.ptz.AbsoluteMove
+        self.camera.ptz.AbsoluteMove = lambda request: (self.sent.append(request), absolute_move(request))
+
+    def test_missing_axis_is_filled_from_the_camera_position(self):
+        self.subscriber.move_absolute(pan=0.6)
+        self.assertEqual(self.sent[0]["Position"], {"PanTilt": {"x": 0.6, "y": -0.4}})
+
+    def test_missing_axis_with_unknown_position_is_an_error(self):
+        def unreachable(request):
+            raise ConnectionError("camera unreachable")
+        self.camera.ptz.GetStatus = unreachable
+        self.subscriber.move_absolute(pan=0.6, zoom=0.5)
+        self.assertEqual(self.sent, [])
+        self.assertIn({"type": "command_error", "command": "move_absolute",
+                       "error": "pan and tilt both required when position is unknown"},
+                      [{key: response.get(key) for key in ("type", "command", "error")} for response in self.responses])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""PositionTelemetry: delta suppression, sampling rate and batching."""
+import unittest
+
+from support import load_subscriber_module, wait_for
+
+subscriber_module = load_subscriber_module()
+
+
+def position(pan, tilt=0.0, zoom=0.0, **extra):
+    return dict({"pan": pan, "tilt": tilt, "zoom": zoom}, **extra)
+
+
+class PositionTelemetryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.samples = []
+        self.messages = []
+        self.telemetry = subscriber_module.PositionTelemetry(
+            lambda: self.samples.pop(0) if self.samples else None, self.messages.append,
+            {"epsilon": 0.01, "moving_interval": 0.2, "idle_interval": 5.0, "publish_interval": 1.0})
+
+    def kept(self):
+        return [sample[1:] for sample in self.telemetry._buffer]
+
+    def test_changes_below_epsilon_are_dropped(self):
+        for pan in (0.0, 0.005, 0.009, 0.02, 0.025, 0.5):
+            self.telemetry.record(position(pan))
+        self.assertEqual(self.kept(), [[0.0, 0.0, 0.0], [0.02, 0.0, 0.0], [0.5, 0.0, 0.0]])
+
+    def test_epsilon_is_measured_from_the_last_kept_sample(self):
+        # Slow drift still shows up once it adds up to more than epsilon
+        for pan in (0.0, 0.006, 0.012):
+            self.telemetry.record(position(pan))
+        self.assertEqual([sample[0] for sample in self.kept()], [0.0, 0.012])
+
+    def test_any_axis_counts(self):
+        self.telemetry.record(position(0.0))
+        self.telemetry.record(position(0.0, zoom=0.05))
+        self.assertEqual(len(self.kept()), 2)
+
+    def test_flush_publishes_one_batch_and_skips_empty_ones(self):
+        self.telemetry.record(position(0.0))
+        self.telemetry.record(position(0.3, 0.1, 0.2))
+        self.telemetry.flush()
+        self.telemetry.flush()
+        self.assertEqual(len(self.messages), 1)
+        message = self.messages[0]
+        self.assertEqual(message["fields"], ["t", "pan", "tilt", "zoom"])
+        self.assertEqual([sample[1:] for sample in message["samples"]], [[0.0, 0.0, 0.0], [0.3, 0.1, 0.2]])
+
+    def test_sampling_rate_follows_movement(self):
+        self.samples = [position(0.0), position(0.0), position(0.2), position(0.2), position(0.2, moving=True)]
+        self.assertEqual(self.telemetry.step(), 5.0)     # first sample
+        self.assertEqual(self.telemetry.step(), 5.0)     # unchanged
+        self.assertEqual(self.telemetry.step(), 0.2)     # changed without MoveStatus: a move the model never saw
+        self.assertEqual(self.telemetry.step(), 5.0)     # settled
+        self.assertEqual(self.telemetry.step(), 0.2)     # camera reports MoveStatus MOVING
+        self.telemetry.wake()
+        self.assertEqual(self.telemetry.step(), 0.2)     # no sample, but a move command was just sent
+
+    def test_step_flushes_once_the_publish_interval_passed(self):
+        self.samples = [position(0.0), position(0.1)]
+        self.telemetry.step()
+        self.assertEqual(self.messages, [])
+        self.telemetry._last_flush -= 1.0
+        self.telemetry.step()
+        self.assertEqual(len(self.messages[0]["samples"]), 2)
+
+    def test_sample_errors_do_not_stop_sampling(self):
+        def failing():
+            raise ConnectionError("camera unreachable")
+        self.telemetry.sample = failing
+        self.assertEqual(self.telemetry.step(), 5.0)
+
+    def test_stop_flushes_what_is_buffered(self):
+        self.samples = [position(0.0)]
+        self.telemetry.start()
+        self.assertTrue(wait_for(lambda: self.kept() or self.messages))
+        self.telemetry.stop()
+        self.assertEqual(len(self.messages), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""PresetTable reconciliation with GetPresets, and when create_preset talks to the camera."""
+import copy
+import unittest
+from types import SimpleNamespace
+
+from support import SENSOR_ID, load_subscriber_module
+
+import fleet_simulator
+
+subscriber_module = load_subscriber_module()
+
+
+def camera_preset(token, name, pan=0.0, tilt=0.0, zoom=0.0):
+    return SimpleNamespace(token=token, Name=name, PTZPosition=SimpleNamespace(
+        PanTilt=SimpleNamespace(x=pan, y=tilt), Zoom=SimpleNamespace(x=zoom)))
+
+
+class PresetTableTests(unittest.TestCase):
+
+    def setUp(self):
+        self.table = subscriber_module.PresetTable([
+            {"name": "gate", "token": 1}, {"name": "yard", "token": "2"}, {"name": "dock", "token": "3"},
+            {"token": "9"},   # no name: ignored
+        ])
+
+    def test_loads_saved_presets_in_order(self):
+        self.assertEqual(self.table.names(), ["gate", "yard", "dock"])
+        self.assertEqual(self.table.token_for("gate"), "1")
+        self.assertTrue(self.table.is_due(3600))
+
+    def test_reconcile_drops_presets_missing_on_the_camera(self):
+        changed = self.table.reconcile([camera_preset(1, "gate", 0.1, 0.2, 0.3), camera_preset(3, "Dock")])
+        self.assertTrue(changed)
+        self.assertEqual(self.table.as_list(), [{"name": "gate", "token": "1"}, {"name": "dock", "token": "3"}])
+        self.assertEqual(self.table.position_for("gate"), {"pan": 0.1, "tilt": 0.2, "zoom": 0.3})
+        self.assertFalse(self.table.is_due(3600))
+
+    def test_reconcile_without_changes(self):
+        self.assertFalse(self.table.reconcile([camera_preset(t, n) for t, n in (("1", "a"), ("2", "b"), ("3", "c"), ("4", "d"))]))
+        self.assertEqual(self.table.names(), ["gate", "yard", "dock"])
+
+    def test_empty_camera_answer_clears_the_table(self):
+        self.assertTrue(self.table.reconcile(None))
+        self.assertEqual(self.table.names(), [])
+
+    def test_preset_without_coordinates(self):
+        self.table.reconcile([SimpleNamespace(token="1", Name="gate", PTZPosition=None),
+                              SimpleNamespace(token="2", Name="yard", PTZPosition=SimpleNamespace(PanTilt=None, Zoom=SimpleNamespace(x=0.4)))])
+        self.assertIsNone(self.table.position_for("gate"))
+        self.assertEqual(self.table.position_for("yard"), {"pan": 0.0, "tilt": 0.0, "zoom": 0.4})
+        self.assertIsNone(self.table.position_for("unknown"))
+
+    def test_camera_presets_can_be_adopted_unless_already_bound(self):
+        self.table.reconcile([camera_preset("1", "gate"), camera_preset("2", "yard"), camera_preset("7", "roof"),
+                              camera_preset("3", "roof")])
+        self.assertEqual(self.table.camera_token_for("roof"), "7")
+        self.assertIsNone(self.table.camera_token_for("gate2"))
+
+    def test_add_remove_rename(self):
+        self.table.reconcile([camera_preset("1", "gate"), camera_preset("2", "yard"), camera_preset("3", "dock")])
+        self.table.add("roof", 4, {"pan": 0.5, "tilt": 0.0, "zoom": 0.0})
+        self.assertEqual(self.table.position_for("roof"), {"pan": 0.5, "tilt": 0.0, "zoom": 0.0})
+
+        self.assertTrue(self.table.rename("yard", "car park"))
+        self.assertFalse(self.table.rename("yard", "other"))
+        self.assertFalse(self.table.rename("gate", "dock"))
+        self.assertEqual(self.table.names(), ["gate", "car park", "dock", "roof"])
+        self.assertEqual(self.table.camera_presets["2"]["name"], "car park")
+
+        self.assertEqual(self.table.remove("gate"), "1")
+        self.assertIsNone(self.table.remove("gate"))
+        self.assertNotIn("1", self.table.camera_presets)
+
+
+class CreatePresetTests(unittest.TestCase):
+    """create_preset reconciles once per ONVIF session, not on every call."""
+
+    def setUp(self):
+        self.camera = fleet_simulator.SimulatedCamera({"pan": 1, "tilt": 1, "zoom": 1}, latency=0.0, jitter=0.0)
+        self.camera.ptz.presets.clear()
+        self.camera.ptz.presets["5"] = {"name": "roof", "position": {"pan": 0.5, "tilt": 0.1, "zoom": 0.0}}
+        camera_config = copy.deepcopy(subscriber_module.camera_details)
+        camera_config["presets"] = [{"name": "gone", "token": "4"}]
+        self.subscriber = subscriber_module.MQTTSubscriber(SENSOR_ID, camera_config=camera_config)
+        self.subscriber.init_camera = lambda: (self.camera, self.camera.ptz, "profile0")
+        self.operations = []
+        for operation in ("GetPresets", "SetPreset"):
+            self.record(operation)
+
+    def record(self, operation):
+        original = getattr(self.camera.ptz, operation)
+
+        def recorded(request):
+            self.operations.append(operation)
+            return original(request)
+        setattr(self.camera.ptz, operation, recorded)
+
+    def test_first_create_reconciles_and_later_ones_do_not(self):
+        self.subscriber.create_preset("gate")
+        self.subscriber.create_preset("yard")
+        self.subscriber.create_preset("gate")
+        self.assertEqual(self.operations, ["GetPresets", "SetPreset", "SetPreset"])
+        self.assertEqual(self.subscriber.presets.names(), ["gate", "yard"])
+        self.assertEqual(self.subscriber.camera_details["presets"], self.subscriber.presets.as_list())
+
+    def test_existing_camera_preset_is_adopted(self):
+        self.subscriber.create_preset("roof")
+        self.assertEqual(self.operations, ["GetPresets"])
+        self.assertEqual(self.subscriber.presets.token_for("roof"), "5")
+        self.assertEqual(self.subscriber.presets.position_for("roof"), {"pan": 0.5, "tilt": 0.1, "zoom": 0.0})
+
+    def test_due_reconcile_runs_again(self):
+        self.subscriber.create_preset("gate")
+        self.subscriber.preset_reconcile_interval = 0
+        self.subscriber.create_preset("yard")
+        self.assertEqual(self.operations, ["GetPresets", "SetPreset", "GetPresets", "SetPreset"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Bounded parallel shutdown: one deadline for every step, dependencies, and child process termination."""
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from support import load_subscriber_module
+
+subscriber_module = load_subscriber_module()
+ShutdownCoordinator = subscriber_module.ShutdownCoordinator
+
+# A child that ignores SIGTERM, like an ffmpeg stuck flushing to a dead RTMP server
+STUBBORN_PROCESS = [sys.executable, "-c",
+                    "import signal, sys, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print('ready', flush=True); time.sleep(30)"]
+
+
+def start_stubborn():
+    process = subprocess.Popen(STUBBORN_PROCESS, stdout=subprocess.PIPE)
+    process.stdout.readline()   # SIGTERM handler installed
+    return process
+
+
+class ShutdownCoordinatorTests(unittest.TestCase):
+
+    def test_steps_run_in_parallel(self):
+        coordinator = ShutdownCoordinator(deadline=5)
+        for name in ("mqtt", "streams", "telemetry"):
+            coordinator.run(name, lambda: time.sleep(0.3))
+        report = coordinator.wait()
+        self.assertLess(report["total_seconds"], 0.6)
+        self.assertEqual({name: step["result"] for name, step in report["steps"].items()},
+                         {"mqtt": "ok", "streams": "ok", "telemetry": "ok"})
+        self.assertGreaterEqual(report["steps"]["mqtt"]["seconds"], 0.3)
+
+    def test_hung_step_is_abandoned_at_the_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        coordinator = ShutdownCoordinator(deadline=0.3)
+        coordinator.run("camera", lambda: release.wait(10))
+        coordinator.run("cache", lambda: None)
+        started = time.monotonic()
+        report = coordinator.wait()
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(report["steps"]["camera"], {"seconds": None, "result": "timed out"})
+        self.assertEqual(report["steps"]["cache"]["result"], "ok")
+        self.assertEqual(coordinator.remaining(), 0.0)
+
+    def test_dependent_step_runs_after_its_dependency(self):
+        order = []
+        coordinator = ShutdownCoordinator(deadline=5)
+        coordinator.run("flush", lambda: (time.sleep(0.2), order.append("flush")))
+        coordinator.run("disconnect", lambda: order.append("disconnect"), after=("flush",))
+        coordinator.run("unknown-dependency", lambda: order.append("other"), after=("missing",))
+        coordinator.wait()
+        self.assertLess(order.index("flush"), order.index("disconnect"))
+
+    def test_dependency_wait_is_bounded_by_the_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        ran = threading.Event()
+        coordinator = ShutdownCoordinator(deadline=0.3)
+        coordinator.run("flush", lambda: release.wait(10))
+        coordinator.run("disconnect", ran.set, after=("flush",))
+        coordinator.wait()
+        self.assertTrue(ran.wait(1.0))
+
+    def test_failing_step_is_reported(self):
+        def fail():
+            raise OSError("broker unreachable")
+        coordinator = ShutdownCoordinator(deadline=1)
+        coordinator.run("mqtt", fail)
+        self.assertEqual(coordinator.wait()["steps"]["mqtt"]["result"], "error: broker unreachable")
+
+
+class TerminateProcessesTests(unittest.TestCase):
+
+    def test_cooperative_processes_exit_on_sigterm(self):
+        processes = [subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"]) for _ in range(3)]
+        started = time.monotonic()
+        self.assertEqual(subscriber_module.terminate_processes(processes, grace=5), 0)
+        self.assertLess(time.monotonic() - started, 2.0)
+        self.assertTrue(all(process.poll() is not None for process in processes))
+
+    def test_stubborn_processes_share_one_grace_period(self):
+        processes = [start_stubborn() for _ in range(2)]
+        started = time.monotonic()
+        self.assertEqual(subscriber_module.terminate_processes(processes, grace=0.5), 2)
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertTrue(all(process.poll() is not None for process in processes))
+
+    def test_exited_and_missing_processes_are_skipped(self):
+        done = subprocess.Popen([sys.executable, "-c", "pass"])
+        done.wait()
+        self.assertEqual(subscriber_module.terminate_processes([None, done], grace=1), 0)
+
+
+class PreviousShutdownTests(unittest.TestCase):
+
+    def test_summary_of_the_last_shutdown(self):
+        root = tempfile.mkdtemp(prefix="shutdown-test-")
+        self.addCleanup(shutil.rmtree, root, True)
+        with mock.patch.object(subscriber_module, "ROOT_DIR", root):
+            self.assertIsNone(subscriber_module.previous_shutdown_summary())
+            subscriber_module.save_json_cache(subscriber_module.LAST_SHUTDOWN_CACHE, {
+                "total_seconds": 1.2, "steps": {"mqtt": {"seconds": 0.4, "result": "ok"},
+                                                "streams": {"seconds": None, "result": "timed out"}}})
+            self.assertEqual(subscriber_module.previous_shutdown_summary(),
+                             {"total_seconds": 1.2, "steps": {"mqtt": 0.4, "streams": None}})
+
+
+if __name__ == "__main__":
+    unittest.main()
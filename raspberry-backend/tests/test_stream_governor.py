@@ -0,0 +1,161 @@
+"""StreamGovernor against a fake sysfs/procfs tree (settings["root"])."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import load_subscriber_module, wait_for
+
+subscriber_module = load_subscriber_module()
+
+
+class FakeSystem:
+    """proc/stat and sys/class/thermal under a temp dir; CPU counters advance 1000 jiffies per load() call."""
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix="governor-test-")
+        os.makedirs(os.path.join(self.root, "proc"))
+        self.busy = 0
+        self.idle = 0
+        self.load(0.0)
+
+    def load(self, busy_fraction):
+        self.busy += int(1000 * busy_fraction)
+        self.idle += 1000 - int(1000 * busy_fraction)
+        # cpu  user nice system idle iowait irq softirq steal
+        with open(os.path.join(self.root, "proc", "stat"), "w") as file:
+            file.write(f"cpu  {self.busy} 0 0 {self.idle} 0 0 0 0 0 0\ncpu0 0 0 0 0 0 0 0 0 0 0\n")
+
+    def temperature(self, celsius, zone=0, zone_type="cpu-thermal"):
+        zone_dir = os.path.join(self.root, "sys", "class", "thermal", f"thermal_zone{zone}")
+        os.makedirs(zone_dir, exist_ok=True)
+        with open(os.path.join(zone_dir, "temp"), "w") as file:
+            file.write(f"{int(celsius * 1000)}\n")
+        if zone_type:
+            with open(os.path.join(zone_dir, "type"), "w") as file:
+                file.write(f"{zone_type}\n")
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class StreamGovernorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.system = FakeSystem()
+        self.addCleanup(self.system.cleanup)
+        self.changes = []
+        self.governor = subscriber_module.StreamGovernor(self.changes.append, {
+            "root": self.system.root, "interval": 0.05, "down_samples": 2, "up_samples": 3, "min_hold": 10.0,
+        })
+        self.now = 1000.0
+
+    def step(self, temperature=None, cpu=0.1, seconds=60.0):
+        """One governor tick: write the readings, sample the fake tree and evaluate."""
+        if temperature is not None:
+            self.system.temperature(temperature)
+        self.system.load(cpu)
+        self.now += seconds
+        return self.governor.evaluate(self.governor.sample(), now=self.now)
+
+    def test_reads_the_fake_tree(self):
+        self.system.temperature(51.5, zone=0)
+        self.system.temperature(47.0, zone=1, zone_type="")
+        with open(os.path.join(self.system.root, "sys", "class", "thermal", "thermal_zone1", "type"), "w"):
+            pass
+        self.system.temperature(40.0, zone=2, zone_type="gpu")
+        with open(os.path.join(self.system.root, "sys", "class", "thermal", "thermal_zone2", "temp"), "w") as file:
+            file.write("garbage\n")
+        self.assertEqual(subscriber_module.read_temperatures(self.system.root), {"cpu-thermal": 51.5, "thermal_zone1": 47.0})
+
+        self.governor.sample()
+        self.system.load(0.75)
+        sample = self.governor.sample()
+        self.assertEqual(sample["cpu"], 0.75)
+        self.assertEqual(sample["temperature"], 51.5)
+
+    def test_missing_tree_gives_an_empty_sample(self):
+        governor = subscriber_module.StreamGovernor(None, {"root": os.path.join(self.system.root, "nowhere")})
+        self.assertEqual(governor.sample(), {"cpu": None, "temperature": None, "zones": {}})
+
+    def test_steps_down_after_consecutive_hot_samples(self):
+        self.step(temperature=60)
+        self.assertIsNone(self.step(temperature=76))
+        change = self.step(temperature=77)
+        self.assertEqual((change["level"], change["previous"], change["name"]), (1, "720p", "540p"))
+        self.assertEqual(change["reason"], "temperature 77.0°C")
+        self.assertEqual(self.governor.apply({"bufsize": "1600k"})["fps"], 15)
+        self.assertEqual(self.governor.live_fps(25), 15)
+
+    def test_cpu_load_steps_down(self):
+        self.step(temperature=50)
+        self.step(cpu=0.95)
+        change = self.step(cpu=0.95)
+        self.assertEqual(change["level"], 1)
+        self.assertEqual(change["reason"], "cpu 95%")
+
+    def test_critical_temperature_drops_to_the_lowest_level_at_once(self):
+        self.step(temperature=60)
+        change = self.step(temperature=81, seconds=0.1)
+        self.assertEqual((change["level"], change["name"]), (2, "360p"))
+
+    def test_min_hold_spaces_out_changes(self):
+        self.step(temperature=76)
+        self.assertEqual(self.step(temperature=76)["level"], 1)
+        self.step(temperature=76, seconds=1)
+        self.assertIsNone(self.step(temperature=76, seconds=1))
+        self.assertEqual(self.step(temperature=76, seconds=10)["level"], 2)
+
+    def test_steps_back_up_only_below_the_low_threshold(self):
+        self.step(temperature=81)
+        self.assertEqual(self.governor.level, 2)
+        # Between temp_low and temp_high: neither hot nor cool, so the level holds
+        for _ in range(5):
+            self.assertIsNone(self.step(temperature=70))
+        self.assertIsNone(self.step(temperature=60))
+        self.assertIsNone(self.step(temperature=60))
+        self.assertIsNone(self.step(temperature=70))   # resets the cool streak
+        self.assertIsNone(self.step(temperature=60))
+        self.assertIsNone(self.step(temperature=60))
+        change = self.step(temperature=60)
+        self.assertEqual((change["level"], change["previous"], change["reason"]), (1, "360p", "cooled down"))
+        self.assertIsNone(self.step(temperature=60))
+
+    def test_busy_cpu_blocks_stepping_up(self):
+        self.step(temperature=81)
+        for _ in range(5):
+            self.assertIsNone(self.step(temperature=60, cpu=0.7))
+        self.assertEqual(self.governor.level, 2)
+
+    def test_background_thread_reports_changes(self):
+        self.governor.settings["min_hold"] = 0
+        self.system.temperature(85)
+        self.governor.start()
+        self.addCleanup(self.governor.stop)
+        self.assertTrue(wait_for(lambda: self.changes))
+        change = self.changes[0]
+        self.assertEqual(change["level"], 2)
+        self.assertEqual(change["temperature"], 85.0)
+        self.assertEqual(change["reason"], "critical temperature 85.0°C")
+        self.assertEqual(self.governor.snapshot()["name"], "360p")
+
+        self.system.temperature(50)
+        self.assertTrue(wait_for(lambda: self.governor.level == 0))
+        self.assertEqual([change["name"] for change in self.changes], ["360p", "540p", "720p"])
+
+    def test_failing_change_handler_does_not_stop_the_governor(self):
+        def failing(change):
+            self.changes.append(change)
+            raise RuntimeError("restart failed")
+        self.governor.on_change = failing
+        self.governor.settings["min_hold"] = 0
+        self.system.temperature(85)
+        self.governor.start()
+        self.addCleanup(self.governor.stop)
+        self.assertTrue(wait_for(lambda: self.changes))
+        self.system.temperature(50)
+        self.assertTrue(wait_for(lambda: self.governor.level == 0))
+
+
+if __name__ == "__main__":
+    unittest.main()